@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+from collections import deque
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from . import crud, models, schemas, rabbitmq
+
+# Un lot est inséré en un seul INSERT multi-lignes : lignes × colonnes paramètres liés.
+# Limite commune aux drivers : 32766 pour SQLite (65535 pour le protocole PostgreSQL)
+MAX_BIND_PARAMS = 32766
+# Colonnes liées par ligne insérée : toutes sauf l'id (les valeurs par défaut Python sont envoyées aussi)
+_PARAMS_PER_ROW = len(models.Client.__table__.columns) - 1
+# Nombre de lignes validées puis insérées ensemble (une transaction et un événement par lot)
+BULK_CHUNK_SIZE = max(1, min(int(os.getenv("BULK_CHUNK_SIZE", "1000")), MAX_BIND_PARAMS // _PARAMS_PER_ROW))
+# Taille maximale (en caractères) d'un enregistrement CSV sur plusieurs lignes : au-delà,
+# le guillemet ouvrant est considéré comme jamais fermé et la lecture reprend à la ligne suivante
+MAX_RECORD_SIZE = 64 * 1024
+
+FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+def detect_format(content_type: str):
+    """Retourne 'csv' ou 'ndjson' selon le Content-Type, None si non supporté"""
+    return FORMATS.get(content_type.split(";")[0].strip().lower())
+
+
+async def iter_lines(stream):
+    """Découpe le corps de la requête en lignes au fil de l'eau, sans le charger en entier"""
+    buffer = b""
+    line_no = 0
+    async for data in stream:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line
+    if buffer:
+        yield line_no + 1, buffer
+
+
+def _error_detail(e: ValidationError):
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in e.errors()
+    )
+
+
+class _LineFeed:
+    """Itérateur de lignes lu par un csv.reader unique, rempli au fil de l'eau.
+
+    On n'y dépose que des enregistrements complets : le reader ne tombe jamais à court de lignes
+    au milieu d'un champ entre guillemets.
+    """
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+async def _decoded_lines(stream):
+    """(numéro de ligne, texte ou None si l'encodage est invalide) pour chaque ligne du corps"""
+    async for line_no, raw in iter_lines(stream):
+        try:
+            yield line_no, raw.decode("utf-8-sig").rstrip("\r")
+        except UnicodeDecodeError:
+            yield line_no, None
+
+
+def _ends_quoted(line: str, quoted: bool) -> bool:
+    """Vrai si la ligne se termine à l'intérieur d'un champ entre guillemets.
+
+    Même règle que le dialecte excel de csv.reader : un guillemet n'ouvre un champ qu'en début
+    de champ (O"Neil reste un champ ordinaire), "" dans un champ entre guillemets est un guillemet.
+    quoted : la ligne continue un champ entre guillemets ouvert sur une ligne précédente.
+    """
+    field_start = not quoted
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quoted:
+            if char == '"':
+                if line[i + 1:i + 2] == '"':
+                    i += 1
+                else:
+                    quoted = False
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char == ","
+        i += 1
+    return quoted
+
+
+async def _csv_records(stream):
+    """(numéro de la première ligne, valeurs, erreur) pour chaque enregistrement CSV non vide.
+
+    Un champ entre guillemets peut contenir des retours à la ligne (adresse sur plusieurs lignes) :
+    un enregistrement est complet quand sa dernière ligne ne se termine pas dans un tel champ.
+    Un enregistrement ouvert depuis plus de MAX_RECORD_SIZE caractères est rapporté en erreur.
+    """
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    pending, start, size, quoted = [], None, 0, False
+    async for line_no, line in _decoded_lines(stream):
+        if line is None:
+            pending, size, quoted = [], 0, False
+            yield line_no, None, "Encodage invalide (UTF-8 attendu)"
+            continue
+        if not pending:
+            if not line.strip():
+                continue
+            start = line_no
+        pending.append(line)
+        size += len(line) + 1
+        quoted = _ends_quoted(line, quoted)
+        if quoted:
+            if size > MAX_RECORD_SIZE:
+                pending, size, quoted = [], 0, False
+                yield start, None, "Guillemet non fermé"
+            continue
+        feed.lines.extend(text + "\n" for text in pending)
+        pending, size = [], 0
+        try:
+            yield start, next(reader), None
+        except csv.Error:
+            feed.lines.clear()
+            yield start, None, "CSV invalide"
+    if pending:
+        yield start, None, "Guillemet non fermé"
+
+
+async def _ndjson_records(stream):
+    """(numéro de ligne, objet JSON, erreur) pour chaque ligne non vide"""
+    async for line_no, line in _decoded_lines(stream):
+        if line is None:
+            yield line_no, None, "Encodage invalide (UTF-8 attendu)"
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_no, None, "JSON invalide"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Un objet JSON est attendu"
+            continue
+        yield line_no, record, None
+
+
+async def _records(stream, fmt: str):
+    """(numéro de ligne, dictionnaire des champs, erreur) quel que soit le format"""
+    if fmt != "csv":
+        async for item in _ndjson_records(stream):
+            yield item
+        return
+    fieldnames = None
+    async for line_no, values, error in _csv_records(stream):
+        if error:
+            yield line_no, None, error
+        elif fieldnames is None:
+            fieldnames = [name.strip() for name in values]
+        else:
+            # Les cellules vides correspondent aux champs optionnels absents
+            yield line_no, {k: v for k, v in zip(fieldnames, values) if v != ""}, None
+
+
+async def iter_rows(stream, fmt: str):
+    """Produit (numéro de ligne, client validé, erreur) pour chaque ligne non vide du fichier"""
+    async for line_no, record, error in _records(stream, fmt):
+        if error:
+            yield line_no, None, error
+            continue
+        try:
+            yield line_no, schemas.ClientCreate(**record), None
+        except ValidationError as e:
+            yield line_no, None, _error_detail(e)
+
+
+def import_chunk(db: Session, chunk: list):
+    """Insère un lot de (numéro de ligne, client) et retourne (nombre de créés, erreurs)"""
+    inserted = crud.bulk_create_clients(db, [client for _, client in chunk])
+
+    # Les lignes absentes du RETURNING ont été ignorées par ON CONFLICT : email déjà utilisé
+    pending = {row.email.lower() for row in inserted}
+    errors = []
+    for line_no, client in chunk:
+        email = client.email.lower()
+        if email in pending:
+            pending.discard(email)
+        else:
+            errors.append({"ligne": line_no, "email": client.email, "detail": "Email déjà utilisé"})
+
+    if inserted:
+        rabbitmq.publish_clients_created([
+            {
+                "client_id": row.id,
+                "data": {
+                    "nom": row.nom,
+                    "email": row.email,
+                    "adresse": row.adresse,
+                    "telephone": row.telephone
+                }
+            }
+            for row in inserted
+        ])
+    return len(inserted), errors
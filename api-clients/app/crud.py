@@ -1,4 +1,7 @@
+from sqlalchemy import Integer, any_, bindparam, case, func, or_, text, tuple_
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import ARRAY
 from . import models, schemas
 
 # CREATE - Créer un client en base
@@ -10,13 +13,90 @@ def create_client(db: Session, client: schemas.ClientCreate):
     db.refresh(db_client)
     return db_client
 
+# CREATE (BULK) - Insérer un lot de clients en un seul INSERT multi-lignes
+# Les emails déjà présents sont ignorés (ON CONFLICT DO NOTHING) : seules les lignes réellement insérées sont renvoyées
+def bulk_create_clients(db: Session, clients: list):
+    if not clients:
+        return []
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = (
+        dialect.insert(models.Client)
+        .values([client.model_dump() for client in clients])
+        .on_conflict_do_nothing()
+        .returning(models.Client.id, models.Client.nom, models.Client.email,
+                   models.Client.adresse, models.Client.telephone)
+    )
+    inserted = db.execute(stmt).all()
+    db.commit()
+    return inserted
+
 # READ - Récupérer un client par son ID unique
 def get_client(db: Session, client_id: int):
     return db.query(models.Client).filter(models.Client.id == client_id).first()
 
-# READ - Récupérer la liste de tous les clients
-def get_clients(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Client).offset(skip).limit(limit).all()
+# READ - Récupérer plusieurs clients en une seule requête
+# PostgreSQL : WHERE id = ANY(:ids), un seul paramètre tableau quel que soit le nombre d'ids
+def get_clients_by_ids(db: Session, client_ids: list):
+    if db.get_bind().dialect.name == "postgresql":
+        condition = models.Client.id == any_(bindparam("ids", client_ids, type_=ARRAY(Integer)))
+    else:
+        condition = models.Client.id.in_(client_ids)
+    return db.query(models.Client).filter(condition).all()
+
+# READ - Récupérer un client par son email (insensible à la casse, via l'index lower(email))
+def get_client_by_email(db: Session, email: str):
+    return db.query(models.Client).filter(func.lower(models.Client.email) == email.lower()).first()
+
+# READ - Vérifier si un email est déjà utilisé, sans charger le client
+def client_email_exists(db: Session, email: str):
+    query = db.query(models.Client.id).filter(func.lower(models.Client.email) == email.lower())
+    return db.query(query.exists()).scalar()
+
+# READ - Rechercher des clients par nom, prénom ou email (correspondance partielle)
+# PostgreSQL : ILIKE et opérateur % de pg_trgm (servis par les index GIN trigrammes), classés par similarité
+# Autres bases (SQLite en test) : simple LIKE, les correspondances en début de mot d'abord
+def search_clients(db: Session, q: str, limit: int = 20):
+    pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    columns = (models.Client.nom, models.Client.prenom, models.Client.email)
+    query = db.query(models.Client)
+
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.filter(or_(
+            *(column.ilike(pattern, escape="\\") for column in columns),
+            *(column.op("%")(q) for column in columns)
+        )).order_by(func.greatest(*(func.similarity(column, q) for column in columns)).desc())
+    else:
+        query = query.filter(or_(
+            *(func.lower(column).like(pattern, escape="\\") for column in columns)
+        )).order_by(
+            case(*((func.lower(column).like(pattern[1:], escape="\\"), 0) for column in columns), else_=1),
+            models.Client.nom,
+            models.Client.prenom
+        )
+    return query.order_by(models.Client.id).limit(limit).all()
+
+# READ - Récupérer la liste des clients, triée par (created_at, id)
+# Si "after" est fourni (created_at, id du dernier client de la page précédente),
+# on pagine par curseur : la page suivante est une simple lecture d'index, quelle que soit sa profondeur
+def get_clients(db: Session, skip: int = 0, limit: int = 100, after=None):
+    query = db.query(models.Client).order_by(models.Client.created_at, models.Client.id)
+    if after is not None:
+        query = query.filter(tuple_(models.Client.created_at, models.Client.id) > tuple_(*after))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+# READ - Nombre total de clients (estimation via pg_class sur PostgreSQL pour éviter un COUNT(*) complet)
+def count_clients(db: Session, estimate: bool = False):
+    if estimate and db.get_bind().dialect.name == "postgresql":
+        reltuples = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table"),
+            {"table": models.Client.__tablename__}
+        ).scalar()
+        # reltuples vaut -1 tant que la table n'a jamais été analysée
+        if reltuples is not None and reltuples >= 0:
+            return reltuples
+    return db.query(func.count(models.Client.id)).scalar()
 
 # UPDATE - Modifier un client existant
 def update_client(db: Session, client_id: int, client: schemas.ClientUpdate):
@@ -1,11 +1,11 @@
 import os
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
 from .routes import router
+from . import migrations
 
-# Création automatique des tables au démarrage (pour le dev)
-Base.metadata.create_all(bind=engine)
+# Création automatique des tables, colonnes et index manquants au démarrage
+migrations.upgrade()
 
 ALLOWED_ORIGINS = os.getenv(
     "ALLOWED_ORIGINS",
@@ -22,6 +22,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "Last-Modified"],
 )
 
 # Inclusion des routes définies précédemment
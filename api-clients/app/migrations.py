@@ -0,0 +1,57 @@
+"""Mise a niveau du schema d'une base existante.
+
+create_all ne cree que les tables absentes : sur un volume PostgreSQL deja initialise,
+les colonnes et index ajoutes au modele depuis ne seraient jamais crees. upgrade() les ajoute
+(ADD COLUMN / CREATE INDEX IF NOT EXISTS) ; idempotent, execute au demarrage de l'API.
+L'index unique ix_clients_email_lower echoue si deux emails ne different que par la casse :
+les dedoublonner avant la mise a niveau.
+
+Commande manuelle : docker compose run --rm api-clients python -m app.migrations
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from . import models
+from .database import Base, engine
+
+logger = logging.getLogger(__name__)
+
+# Verrou consultatif PostgreSQL : les workers qui demarrent ensemble migrent l'un apres l'autre
+MIGRATION_LOCK_ID = 72_001
+
+
+def _add_missing_columns(conn, table) -> list:
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    if_not_exists = "IF NOT EXISTS " if conn.dialect.name == "postgresql" else ""
+    added = []
+    for column in table.columns:
+        if column.name not in existing:
+            spec = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{spec}")
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def upgrade(bind=engine) -> list:
+    """Cree les tables, colonnes et index manquants. Retourne les colonnes ajoutees."""
+    added = []
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        # Extension pg_trgm avant les index trigrammes (PostgreSQL uniquement)
+        models.TRGM_EXTENSION_DDL(models.Client.__table__, conn)
+        Base.metadata.create_all(conn)
+        for table in Base.metadata.sorted_tables:
+            added += _add_missing_columns(conn, table)
+            # IF NOT EXISTS plutot qu'une inspection : SQLite ne rapporte pas les index sur expression.
+            # Appele comme un listener pour respecter ddl_if (index trigrammes PostgreSQL)
+            for index in table.indexes:
+                CreateIndex(index, if_not_exists=True)(table, conn)
+    if added:
+        logger.info(f"Colonnes ajoutees : {', '.join(added)}")
+    return added
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index, DDL, event
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from .database import Base
 
 class Client(Base):
@@ -12,5 +13,24 @@ class Client(Base):
     telephone = Column(String(20))
     adresse = Column(String(500))
     actif = Column(Boolean, default=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    # Valeur aussi fixée côté Python : même précision (microsecondes) que les curseurs de pagination
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+# Index fonctionnel sur lower(email) : la recherche par email insensible a la casse
+# devient une seule lecture d'index (et deux emails ne peuvent differer que par la casse)
+Index("ix_clients_email_lower", func.lower(Client.email), unique=True)
+
+# Index composite pour la pagination par curseur (ORDER BY created_at, id)
+Index("ix_clients_created_at_id", Client.created_at, Client.id)
+
+# Recherche approchée (GET /customers/search) : index GIN trigrammes, PostgreSQL uniquement
+TRGM_EXTENSION_DDL = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(Client.__table__, "before_create", TRGM_EXTENSION_DDL)
+for _column in ("nom", "prenom", "email"):
+    Index(
+        f"ix_clients_{_column}_trgm",
+        Client.__table__.c[_column],
+        postgresql_using="gin",
+        postgresql_ops={_column: "gin_trgm_ops"},
+    ).ddl_if(dialect="postgresql")
@@ -0,0 +1,22 @@
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou falsifié"""
+
+
+# Le curseur est opaque pour le front : base64 d'un JSON [created_at, id]
+def encode_cursor(created_at: datetime, client_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), client_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        created_at, client_id = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        return datetime.fromisoformat(created_at), int(client_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
@@ -62,6 +62,16 @@ def publish_client_created(client_id: int, client_data: dict):
     })
 
 
+def publish_clients_created(clients: list):
+    """Publie un seul événement de création pour tout un lot de clients (import en masse)"""
+    publish_message("client.created", {
+        "event": "client_created",
+        "batch": True,
+        "clients": clients,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+
 def publish_client_updated(client_id: int, client_data: dict):
     """Publie un événement de modification de client"""
     publish_message("client.updated", {
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, schemas, rabbitmq
+from typing import List, Literal, Optional
+from . import crud, schemas, rabbitmq, bulk
+from .pagination import encode_cursor, decode_cursor, InvalidCursor
+from .http_cache import make_etag, not_modified
 from .database import get_db
 from .auth import verify_api_key
 
@@ -11,6 +14,11 @@ router = APIRouter(
     dependencies=[Depends(verify_api_key)]
 )
 
+
+# Marqueur de version d'un client : updated_at n'est renseigné qu'après la première modification
+def _version(db_client):
+    return db_client.updated_at or db_client.created_at
+
 # POST /customers : Créer un client
 @router.post("/", response_model=schemas.ClientResponse, status_code=201)
 def create_customer(client: schemas.ClientCreate, db: Session = Depends(get_db)):
@@ -23,18 +31,118 @@ def create_customer(client: schemas.ClientCreate, db: Session = Depends(get_db))
     })
     return db_client
 
-# GET /customers : Liste tous les clients
+# POST /customers/bulk : Importer des clients en masse (corps CSV ou NDJSON)
+# Le fichier est lu en flux et inséré par lots de BULK_CHUNK_SIZE lignes
+@router.post("/bulk", response_model=schemas.BulkImportResponse)
+async def bulk_create_customers(request: Request, db: Session = Depends(get_db)):
+    fmt = bulk.detect_format(request.headers.get("content-type", ""))
+    if fmt is None:
+        raise HTTPException(
+            status_code=415,
+            detail="Format non supporte. Formats acceptes : text/csv, application/x-ndjson"
+        )
+
+    total, crees, erreurs = 0, 0, []
+    chunk = []
+    async for line_no, client, error in bulk.iter_rows(request.stream(), fmt):
+        total += 1
+        if error:
+            erreurs.append({"ligne": line_no, "detail": error})
+            continue
+        chunk.append((line_no, client))
+        if len(chunk) >= bulk.BULK_CHUNK_SIZE:
+            created, chunk_errors = await run_in_threadpool(bulk.import_chunk, db, chunk)
+            crees += created
+            erreurs += chunk_errors
+            chunk = []
+    if chunk:
+        created, chunk_errors = await run_in_threadpool(bulk.import_chunk, db, chunk)
+        crees += created
+        erreurs += chunk_errors
+
+    return {"total": total, "crees": crees, "erreurs": erreurs}
+
+# POST /customers/batch : Récupérer plusieurs clients d'un coup (évite un GET par commande affichée)
+@router.post("/batch", response_model=schemas.ClientBatchResponse)
+def read_customers_batch(batch: schemas.ClientBatchRequest, db: Session = Depends(get_db)):
+    ids = list(dict.fromkeys(batch.ids))
+    clients = {c.id: c for c in crud.get_clients_by_ids(db, client_ids=ids)}
+    return {
+        "clients": clients,
+        "manquants": [client_id for client_id in ids if client_id not in clients]
+    }
+
+# GET /customers : Liste les clients, page par page
+# Le curseur de la page suivante est renvoyé dans le header X-Next-Cursor (absent sur la dernière page)
+# total=exact|estimate ajoute le header X-Total-Count
 @router.get("/", response_model=List[schemas.ClientResponse])
-def read_customers(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_clients(db, skip=skip, limit=limit)
+def read_customers(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    total: Optional[Literal["exact", "estimate"]] = None,
+    db: Session = Depends(get_db)
+):
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except InvalidCursor:
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+
+    # On lit une ligne de plus pour savoir s'il existe une page suivante
+    clients = crud.get_clients(db, skip=skip, limit=limit + 1, after=after)
+    if len(clients) > limit:
+        clients = clients[:limit]
+        last = clients[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    if total:
+        response.headers["X-Total-Count"] = str(crud.count_clients(db, estimate=(total == "estimate")))
+
+    # La page n'a pas changé si aucun de ses clients n'a changé : 304 sans re-sérialiser
+    etag = make_etag([(c.id, _version(c)) for c in clients], response.headers.get("X-Total-Count"))
+    last_modified = max((_version(c) for c in clients), default=None)
+    return not_modified(request, response, etag, last_modified) or clients
+
+# Longueur minimale de la recherche : pg_trgm ne tire aucun trigramme d'un motif de 2 caractères,
+# l'index GIN ne filtrerait plus rien (parcours complet et tri par similarité sur toute la table)
+SEARCH_MIN_LENGTH = 3
+
+# GET /customers/search : Rechercher des clients par nom, prénom ou email (les plus pertinents d'abord)
+@router.get("/search", response_model=List[schemas.ClientResponse])
+def search_customers(
+    q: str = Query(..., min_length=SEARCH_MIN_LENGTH),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    q = q.strip()
+    if len(q) < SEARCH_MIN_LENGTH:
+        raise HTTPException(status_code=422, detail=f"Recherche trop courte ({SEARCH_MIN_LENGTH} caractères minimum)")
+    return crud.search_clients(db, q=q, limit=limit)
+
+# GET /customers/by-email : Récupérer un client par son email (utilisé par la connexion)
+@router.get("/by-email", response_model=schemas.ClientResponse)
+def read_customer_by_email(email: str, db: Session = Depends(get_db)):
+    db_client = crud.get_client_by_email(db, email=email)
+    if db_client is None:
+        raise HTTPException(status_code=404, detail="Client non trouvé")
+    return db_client
+
+# GET /customers/by-email/exists : Savoir si un email est déjà utilisé (utilisé par l'inscription)
+@router.get("/by-email/exists", response_model=schemas.EmailExistsResponse)
+def customer_email_exists(email: str, db: Session = Depends(get_db)):
+    return {"exists": crud.client_email_exists(db, email=email)}
 
 # GET /customers/{id} : Récupérer un client spécifique
 @router.get("/{client_id}", response_model=schemas.ClientResponse)
-def read_customer(client_id: int, db: Session = Depends(get_db)):
+def read_customer(client_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     db_client = crud.get_client(db, client_id=client_id)
     if db_client is None:
         raise HTTPException(status_code=404, detail="Client non trouvé")
-    return db_client
+    version = _version(db_client)
+    return not_modified(request, response, make_etag(db_client.id, version), version) or db_client
 
 # PUT /customers/{id} : Modifier un client
 @router.put("/{client_id}", response_model=schemas.ClientResponse)
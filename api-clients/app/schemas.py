@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 
@@ -34,3 +34,33 @@ class ClientResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Reponse de GET /customers/by-email/exists
+class EmailExistsResponse(BaseModel):
+    exists: bool
+
+
+# Une ligne rejetée lors d'un import en masse
+class BulkImportError(BaseModel):
+    ligne: int
+    email: Optional[str] = None
+    detail: str
+
+
+# Rapport renvoyé par POST /customers/bulk
+class BulkImportResponse(BaseModel):
+    total: int
+    crees: int
+    erreurs: List[BulkImportError]
+
+
+# Ce qu'on reçoit pour POST /customers/batch
+class ClientBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=5000)
+
+
+# Clients trouvés, indexés par id, et ids introuvables
+class ClientBatchResponse(BaseModel):
+    clients: Dict[int, ClientResponse]
+    manquants: List[int]
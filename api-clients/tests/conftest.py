@@ -19,6 +19,7 @@ from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.database import Base, get_db
+from app import bulk as bulk_module, migrations as migrations_module
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 
@@ -67,3 +68,15 @@ def sample_client():
         "telephone": "0612345678",
         "adresse": "lyon , 69000"
     }
+
+
+@pytest.fixture
+def migrations():
+    """Module de mise a niveau du schema de l'API Clients."""
+    return migrations_module
+
+
+@pytest.fixture
+def bulk():
+    """Module de l'import en masse (CSV / NDJSON)."""
+    return bulk_module
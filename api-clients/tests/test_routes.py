@@ -1,4 +1,6 @@
 import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
 
 
 class TestRootEndpoint:
@@ -61,6 +63,108 @@ class TestCreateCustomer:
         assert response.json()["nom"] == "Martin"
 
 
+class TestBulkCreateCustomers:
+    """Tests pour POST /customers/bulk"""
+
+    def test_bulk_csv(self, client):
+        """Import CSV - tous les clients valides sont créés"""
+        body = (
+            "nom,prenom,email,telephone,adresse\n"
+            "Martin,Sophie,sophie@example.com,0612345678,Paris\n"
+            "Durand,Pierre,pierre@example.com,,\n"
+        )
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "text/csv"})
+        assert response.status_code == 200
+        assert response.json() == {"total": 2, "crees": 2, "erreurs": []}
+        assert len(client.get("/customers/").json()) == 2
+
+    def test_bulk_ndjson_rapport_erreurs(self, client, sample_client):
+        """Import NDJSON - les lignes invalides ou en double sont rapportées"""
+        client.post("/customers/", json=sample_client)
+        body = "\n".join([
+            '{"nom": "Martin", "prenom": "Sophie", "email": "sophie@example.com"}',
+            '{"nom": "Durand", "prenom": "Pierre", "email": "pas-un-email"}',
+            'pas du json',
+            '{"nom": "Faouz", "prenom": "Don", "email": "DON@gmail.com"}',
+        ])
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 4
+        assert data["crees"] == 1
+        assert [e["ligne"] for e in data["erreurs"]] == [2, 3, 4]
+        assert data["erreurs"][2]["detail"] == "Email déjà utilisé"
+
+    def test_bulk_csv_champ_multiligne(self, client):
+        """Adresse entre guillemets sur plusieurs lignes - un seul client, retours à la ligne conservés"""
+        body = (
+            "nom,prenom,email,telephone,adresse\n"
+            'Martin,Sophie,sophie@example.com,,"12 rue du Café\nBâtiment B, 2e étage"\n'
+            'Durand,"Pierre ""Pierrot""",pierre@example.com,,Lyon\n'
+        )
+        response = client.post("/customers/bulk", content=body.encode(), headers={"Content-Type": "text/csv"})
+        assert response.json() == {"total": 2, "crees": 2, "erreurs": []}
+        clients = {c["email"]: c for c in client.get("/customers/").json()}
+        assert clients["sophie@example.com"]["adresse"] == "12 rue du Café\nBâtiment B, 2e étage"
+        assert clients["pierre@example.com"]["prenom"] == 'Pierre "Pierrot"'
+
+    def test_bulk_csv_guillemet_non_ferme(self, client):
+        """Guillemet jamais fermé - erreur rapportée sur la ligne où l'enregistrement commence"""
+        body = (
+            "nom,prenom,email\n"
+            "Martin,Sophie,sophie@example.com\n"
+            'Durand,Pierre,"pierre@example.com\n'
+            "Dupont,Jean,jean@example.com\n"
+        )
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "text/csv"})
+        data = response.json()
+        assert data["crees"] == 1
+        assert data["erreurs"] == [{"ligne": 3, "email": None, "detail": "Guillemet non fermé"}]
+
+    def test_bulk_csv_guillemet_dans_un_champ(self, client):
+        """Guillemet au milieu d'un champ non entre guillemets - champ ordinaire, les lignes suivantes sont lues"""
+        body = (
+            "nom,prenom,email,telephone,adresse\n"
+            'Dupont,Jean,jean@example.com,,"3 place Bellecour\nLyon"\n'
+            'O"Neil,Pat,pat@example.com,,Dublin\n'
+            "Martin,Sophie,sophie@example.com,,Paris\n"
+            "Durand,Pierre,pierre@example.com,,Nantes\n"
+        )
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "text/csv"})
+        assert response.json() == {"total": 4, "crees": 4, "erreurs": []}
+        noms = {c["email"]: c["nom"] for c in client.get("/customers/").json()}
+        assert noms["pat@example.com"] == 'O"Neil'
+
+    def test_bulk_csv_enregistrement_trop_long(self, client, bulk, monkeypatch):
+        """Guillemet ouvert sur trop de lignes - erreur sur sa ligne, la lecture reprend ensuite"""
+        monkeypatch.setattr(bulk, "MAX_RECORD_SIZE", 50)
+        body = (
+            "nom,prenom,email,adresse\n"
+            'Durand,Pierre,pierre@example.com,"1 rue\n'
+            "suite de l'adresse jamais fermee\n"
+            "Martin,Sophie,sophie@example.com,Paris\n"
+        )
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "text/csv"})
+        data = response.json()
+        assert data["crees"] == 1
+        assert data["erreurs"] == [{"ligne": 2, "email": None, "detail": "Guillemet non fermé"}]
+
+    def test_bulk_par_lots(self, client):
+        """Un fichier plus long qu'un lot (1000 lignes par défaut) est traité en plusieurs lots"""
+        body = "\n".join(
+            f'{{"nom": "Client", "prenom": "Numero{i}", "email": "client{i}@example.com"}}'
+            for i in range(2500)
+        )
+        response = client.post("/customers/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+        assert response.json()["crees"] == 2500
+
+    def test_bulk_format_non_supporte(self, client):
+        """Content-Type inconnu - retourne 415"""
+        response = client.post("/customers/bulk", content="x", headers={"Content-Type": "text/plain"})
+        assert response.status_code == 415
+
+
 class TestReadCustomers:
     """Tests pour GET /customers/"""
 
@@ -90,6 +194,74 @@ class TestReadCustomers:
         assert len(response.json()) == 2
 
 
+class TestPaginateCustomers:
+    """Tests pour la pagination par curseur de GET /customers/"""
+
+    def _create_customers(self, client, n):
+        for i in range(n):
+            client.post("/customers/", json={
+                "nom": "Client",
+                "prenom": f"Numero{i}",
+                "email": f"client{i}@example.com"
+            })
+
+    def test_pages_follow_cursor(self, client):
+        """Les pages successives couvrent tous les clients, sans doublon"""
+        self._create_customers(client, 5)
+
+        ids = []
+        response = client.get("/customers/", params={"limit": 2})
+        while True:
+            assert response.status_code == 200
+            ids += [c["id"] for c in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            response = client.get("/customers/", params={"limit": 2, "cursor": cursor})
+
+        assert len(ids) == 5
+        assert len(set(ids)) == 5
+
+    def test_last_page_has_no_cursor(self, client, sample_client):
+        """Pas de X-Next-Cursor quand tout tient dans la page"""
+        client.post("/customers/", json=sample_client)
+        response = client.get("/customers/", params={"limit": 10})
+        assert response.status_code == 200
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_invalid_cursor(self, client):
+        """Curseur illisible - retourne 400"""
+        response = client.get("/customers/", params={"cursor": "pas-un-curseur"})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Curseur invalide"
+
+    def test_total_count_header(self, client):
+        """total=exact ajoute le header X-Total-Count"""
+        self._create_customers(client, 3)
+        response = client.get("/customers/", params={"limit": 1, "total": "exact"})
+        assert response.status_code == 200
+        assert response.headers["X-Total-Count"] == "3"
+
+
+class TestReadCustomersBatch:
+    """Tests pour POST /customers/batch"""
+
+    def test_batch_found_and_missing(self, client, sample_client):
+        """Retourne les clients trouvés indexés par id et la liste des ids manquants"""
+        customer_id = client.post("/customers/", json=sample_client).json()["id"]
+        response = client.post("/customers/batch", json={"ids": [customer_id, 99999, customer_id]})
+        assert response.status_code == 200
+        data = response.json()
+        assert list(data["clients"].keys()) == [str(customer_id)]
+        assert data["clients"][str(customer_id)]["email"] == sample_client["email"]
+        assert data["manquants"] == [99999]
+
+    def test_batch_empty_ids(self, client):
+        """Liste d'ids vide - retourne 422"""
+        response = client.post("/customers/batch", json={"ids": []})
+        assert response.status_code == 422
+
+
 class TestReadCustomer:
     """Tests pour GET /customers/{id}"""
 
@@ -110,6 +282,115 @@ class TestReadCustomer:
         assert response.json()["detail"] == "Client non trouvé"
 
 
+class TestSearchCustomers:
+    """Tests pour GET /customers/search"""
+
+    def test_search_partial_nom(self, client, sample_client):
+        """Recherche sur une partie du nom, insensible à la casse"""
+        client.post("/customers/", json=sample_client)
+        client.post("/customers/", json={"nom": "Martin", "prenom": "Sophie", "email": "sophie@example.com"})
+        response = client.get("/customers/search", params={"q": "fao"})
+        assert response.status_code == 200
+        assert [c["nom"] for c in response.json()] == ["Faouz"]
+
+    def test_search_prenom_et_email(self, client, sample_client):
+        """Les correspondances en début de mot sont classées en premier"""
+        client.post("/customers/", json=sample_client)
+        client.post("/customers/", json={"nom": "Martin", "prenom": "Sophie", "email": "sophie.don@example.com"})
+        response = client.get("/customers/search", params={"q": "don"})
+        assert response.status_code == 200
+        assert [c["prenom"] for c in response.json()] == ["Don", "Sophie"]
+
+    def test_search_limit(self, client):
+        """Le nombre de résultats est limité par 'limit'"""
+        for i in range(3):
+            client.post("/customers/", json={"nom": "Dupont", "prenom": f"Numero{i}", "email": f"d{i}@example.com"})
+        response = client.get("/customers/search", params={"q": "dupont", "limit": 2})
+        assert response.status_code == 200
+        assert len(response.json()) == 2
+
+    def test_search_query_too_short(self, client):
+        """Requête de moins de 3 caractères (espaces exclus) - retourne 422"""
+        for q in ("d", "du", " du "):
+            response = client.get("/customers/search", params={"q": q})
+            assert response.status_code == 422
+
+
+class TestReadCustomerByEmail:
+    """Tests pour GET /customers/by-email et /customers/by-email/exists"""
+
+    def test_get_customer_by_email(self, client, sample_client):
+        """Email existant - retourne 200 avec le client"""
+        create_response = client.post("/customers/", json=sample_client)
+        response = client.get("/customers/by-email", params={"email": sample_client["email"]})
+        assert response.status_code == 200
+        assert response.json()["id"] == create_response.json()["id"]
+
+    def test_get_customer_by_email_case_insensitive(self, client, sample_client):
+        """La recherche ignore la casse de l'email"""
+        client.post("/customers/", json=sample_client)
+        response = client.get("/customers/by-email", params={"email": "DON@Gmail.com"})
+        assert response.status_code == 200
+        assert response.json()["email"] == sample_client["email"]
+
+    def test_get_customer_by_email_not_found(self, client):
+        """Email inconnu - retourne 404"""
+        response = client.get("/customers/by-email", params={"email": "inconnu@example.com"})
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Client non trouvé"
+
+    def test_customer_email_exists(self, client, sample_client):
+        """exists vaut True pour un email utilisé, False sinon"""
+        client.post("/customers/", json=sample_client)
+        response = client.get("/customers/by-email/exists", params={"email": "Don@gmail.com"})
+        assert response.status_code == 200
+        assert response.json() == {"exists": True}
+
+        response = client.get("/customers/by-email/exists", params={"email": "autre@example.com"})
+        assert response.json() == {"exists": False}
+
+
+class TestConditionalGetCustomer:
+    """Tests pour ETag / If-None-Match / Last-Modified sur GET /customers"""
+
+    def test_get_customer_etag_304(self, client, sample_client):
+        """Même ETag renvoyé - retourne 304 sans corps"""
+        customer_id = client.post("/customers/", json=sample_client).json()["id"]
+        response = client.get(f"/customers/{customer_id}")
+        etag = response.headers["ETag"]
+        assert "Last-Modified" in response.headers
+
+        response = client.get(f"/customers/{customer_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    def test_get_customer_if_modified_since(self, client, sample_client):
+        """If-Modified-Since égal à Last-Modified - retourne 304"""
+        customer_id = client.post("/customers/", json=sample_client).json()["id"]
+        last_modified = client.get(f"/customers/{customer_id}").headers["Last-Modified"]
+        response = client.get(f"/customers/{customer_id}", headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+
+    def test_get_customer_etag_change_after_update(self, client, sample_client):
+        """Après modification, l'ancien ETag ne correspond plus - retourne 200"""
+        customer_id = client.post("/customers/", json=sample_client).json()["id"]
+        etag = client.get(f"/customers/{customer_id}").headers["ETag"]
+        client.put(f"/customers/{customer_id}", json={"nom": "Nouveau Nom"})
+
+        response = client.get(f"/customers/{customer_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["nom"] == "Nouveau Nom"
+        assert response.headers["ETag"] != etag
+
+    def test_get_customers_list_etag_304(self, client, sample_client):
+        """La liste aussi répond 304 tant qu'elle n'a pas changé"""
+        client.post("/customers/", json=sample_client)
+        etag = client.get("/customers/").headers["ETag"]
+        response = client.get("/customers/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+
 class TestUpdateCustomer:
     """Tests pour PUT /customers/{id}"""
 
@@ -188,3 +469,26 @@ class TestDeleteCustomer:
         response = client.delete("/customers/99999")
         assert response.status_code == 404
         assert response.json()["detail"] == "Client non trouvé"
+
+
+class TestSchemaUpgrade:
+    """Tests de la mise a niveau d'une base creee avant les nouveaux index"""
+
+    def test_upgrade_base_existante(self, migrations):
+        """Index manquants crees sur la table existante ; relancer ne change rien"""
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE clients (id INTEGER PRIMARY KEY, nom VARCHAR(100) NOT NULL, "
+                "prenom VARCHAR(100) NOT NULL, email VARCHAR(255) NOT NULL UNIQUE, telephone VARCHAR(20), "
+                "adresse VARCHAR(500), actif BOOLEAN, created_at DATETIME, updated_at DATETIME)"
+            ))
+
+        assert migrations.upgrade(engine) == []
+
+        # sqlite_master plutot que l'inspecteur, qui ignore les index sur expression (lower(email))
+        with engine.connect() as conn:
+            indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+        assert {"ix_clients_email_lower", "ix_clients_created_at_id"} <= indexes
+        assert not any(name.endswith("_trgm") for name in indexes)
+        assert migrations.upgrade(engine) == []
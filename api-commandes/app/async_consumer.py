@@ -0,0 +1,312 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from .consumer import HANDLERS, QUEUES, RABBITMQ_URL, event_key
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE_NAME = "payetonkawa"
+# Nombre de messages non acquittes que RabbitMQ peut nous confier en meme temps
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", "200"))
+# Nombre d'evenements traites en parallele (un worker et une session de base par unite)
+CONSUMER_CONCURRENCY = int(os.getenv("CONSUMER_CONCURRENCY", "8"))
+# Acquittements groupes : envoyes tous les CONSUMER_ACK_BATCH messages ou toutes les CONSUMER_ACK_INTERVAL secondes
+CONSUMER_ACK_BATCH = int(os.getenv("CONSUMER_ACK_BATCH", "50"))
+CONSUMER_ACK_INTERVAL = float(os.getenv("CONSUMER_ACK_INTERVAL", "0.2"))
+
+
+# Points de chaque shard sur l'anneau de hachage : plus il y en a, plus la repartition est reguliere
+RING_POINTS = 128
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+@lru_cache(maxsize=None)
+def _ring(shards: int):
+    """Anneau de hachage coherent : (positions triees, shard proprietaire de chaque position)"""
+    points = sorted((_hash(f"shard-{shard}-{point}"), shard) for shard in range(shards) for point in range(RING_POINTS))
+    return [position for position, _ in points], [shard for _, shard in points]
+
+
+def shard_of(key, shards: int) -> int:
+    """Numero de shard stable d'une entite (meme resultat dans tous les processus).
+
+    Hachage coherent : quand le nombre de shards change, seules les entites de la portion
+    de l'anneau reprise par un nouveau shard (ou laissee par un shard retire) changent de shard.
+    """
+    positions, owners = _ring(shards)
+    return owners[bisect.bisect(positions, _hash(repr(key))) % len(positions)]
+
+
+class AckBatcher:
+    """Regroupe les acquittements d'un canal.
+
+    Les messages se terminent dans le desordre : un seul basic_ack(multiple=True) acquitte
+    tous les messages traites dont le delivery tag precede le plus ancien message encore en cours.
+    """
+
+    def __init__(self, channel, batch_size: int = CONSUMER_ACK_BATCH):
+        self._channel = channel
+        self._batch_size = batch_size
+        self._in_flight = set()
+        self._done = []
+
+    def received(self, delivery_tag: int):
+        self._in_flight.add(delivery_tag)
+
+    def ack(self, delivery_tag: int):
+        self._in_flight.discard(delivery_tag)
+        self._done.append(delivery_tag)
+        if len(self._done) >= self._batch_size:
+            self.flush()
+
+    def nack(self, delivery_tag: int, requeue: bool = True):
+        self._in_flight.discard(delivery_tag)
+        self._channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+
+    def flush(self):
+        if not self._done:
+            return
+        oldest = min(self._in_flight, default=None)
+        ready = [tag for tag in self._done if oldest is None or tag < oldest]
+        if not ready:
+            return
+        self._channel.basic_ack(delivery_tag=max(ready), multiple=True)
+        if len(ready) == len(self._done):
+            self._done = []
+        else:
+            ready = set(ready)
+            self._done = [tag for tag in self._done if tag not in ready]
+
+
+class EventProcessor:
+    """Traite les evenements en parallele, dans l'ordre d'arrivee pour une meme entite.
+
+    Les evenements d'une entite (client_id, produit_id) vont toujours au meme worker, qui les
+    traite l'un apres l'autre ; ceux d'entites differentes sont traites en parallele.
+    Chaque worker garde sa session : les connexions viennent du pool de l'engine.
+    """
+
+    def __init__(self, acks: AckBatcher, concurrency: int = CONSUMER_CONCURRENCY,
+                 session_factory=SessionLocal, handlers=HANDLERS):
+        self._acks = acks
+        self._concurrency = concurrency
+        self._session_factory = session_factory
+        self._handlers = handlers
+        self._queues = []
+        self._sessions = []
+        self._workers = []
+        self._executor = None
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="consumer")
+        self._queues = [asyncio.Queue() for _ in range(self._concurrency)]
+        self._sessions = [self._session_factory() for _ in range(self._concurrency)]
+        self._workers = [asyncio.create_task(self._work(i)) for i in range(self._concurrency)]
+
+    def submit(self, delivery_tag: int, routing_key: str, body: bytes):
+        self._acks.received(delivery_tag)
+        try:
+            data = json.loads(body)
+            key = event_key(routing_key, data, self._handlers)
+        except Exception as e:
+            # Message illisible ou inattendu : le remettre en file ne le rendrait pas valide
+            logger.error(f"Message {routing_key} rejete: {e}")
+            self._acks.nack(delivery_tag, requeue=False)
+            return
+        self._queues[shard_of(key, self._concurrency)].put_nowait((delivery_tag, routing_key, data))
+
+    async def _work(self, index: int):
+        queue, db = self._queues[index], self._sessions[index]
+        loop = asyncio.get_running_loop()
+        while True:
+            delivery_tag, routing_key, data = await queue.get()
+            handler, _ = self._handlers[routing_key]
+            try:
+                await loop.run_in_executor(self._executor, self._run, handler, db, data)
+                self._acks.ack(delivery_tag)
+            except Exception as e:
+                logger.error(f"Erreur traitement {routing_key}: {e}")
+                self._acks.nack(delivery_tag)
+            finally:
+                queue.task_done()
+
+    @staticmethod
+    def _run(handler, db, data):
+        try:
+            handler(db, data)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            # Rend la connexion au pool ; la session reste utilisable pour le message suivant
+            db.close()
+
+    async def drain(self):
+        """Attend la fin du traitement de tous les evenements recus, puis envoie les derniers acks"""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+        self._acks.flush()
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        for db in self._sessions:
+            db.close()
+
+
+def _call(method, **kwargs):
+    """Appelle une methode pika a callback et renvoie un future resolu par ce callback"""
+    future = asyncio.get_running_loop().create_future()
+    method(callback=lambda frame: future.done() or future.set_result(frame), **kwargs)
+    return future
+
+
+class AsyncConsumer:
+    """Consumer RabbitMQ asyncio : prefetch et parallelisme configurables, acks groupes.
+
+    queues : {file: routing key liee a l'exchange}. Une file associee a None n'est pas liee
+    (file de shard alimentee par le routeur) : la routing key d'origine est lue dans le header "routing_key".
+    """
+
+    def __init__(self, url: str = RABBITMQ_URL, prefetch: int = CONSUMER_PREFETCH,
+                 concurrency: int = CONSUMER_CONCURRENCY, queues=QUEUES):
+        self.url = url
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.queues = queues
+        self._stopping = asyncio.Event()
+        self._closed = None
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        self._closed = loop.create_future()
+
+        def on_open_error(connection, error):
+            opened.set_exception(error if isinstance(error, BaseException) else ConnectionError(error))
+
+        def on_closed(connection, reason):
+            if not self._closed.done():
+                self._closed.set_result(reason)
+
+        connection = AsyncioConnection(
+            pika.URLParameters(self.url),
+            on_open_callback=opened.set_result,
+            on_open_error_callback=on_open_error,
+            on_close_callback=on_closed,
+            custom_ioloop=loop
+        )
+        return await opened
+
+    async def _open_channel(self, connection):
+        opened = asyncio.get_running_loop().create_future()
+        connection.channel(on_open_callback=opened.set_result)
+        channel = await opened
+        await _call(channel.exchange_declare, exchange=EXCHANGE_NAME, exchange_type="topic", durable=True)
+        for queue, routing_key in self.queues.items():
+            await _call(channel.queue_declare, queue=queue, durable=True)
+            if routing_key is not None:
+                await _call(channel.queue_bind, queue=queue, exchange=EXCHANGE_NAME, routing_key=routing_key)
+        await _call(channel.basic_qos, prefetch_count=self.prefetch)
+        return channel
+
+    def stop(self):
+        """Arret propre : plus de nouveaux messages, fin des traitements en cours, derniers acks"""
+        self._stopping.set()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    async def run(self):
+        """Consomme jusqu'a l'arret demande par stop() ou la perte de la connexion"""
+        connection = await self._connect()
+        channel = await self._open_channel(connection)
+        acks = AckBatcher(channel)
+        processor = EventProcessor(acks, self.concurrency)
+        processor.start()
+
+        def on_message(routing_key, ch, method, properties, body):
+            routing_key = routing_key or (properties.headers or {}).get("routing_key")
+            processor.submit(method.delivery_tag, routing_key, body)
+
+        consumer_tags = [
+            channel.basic_consume(queue=queue, on_message_callback=partial(on_message, routing_key))
+            for queue, routing_key in self.queues.items()
+        ]
+        logger.info(f"Consumer asyncio démarré (prefetch={self.prefetch}, concurrence={self.concurrency})")
+
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(CONSUMER_ACK_INTERVAL)
+                acks.flush()
+
+        flusher = asyncio.create_task(flush_periodically())
+        stopping = asyncio.create_task(self._stopping.wait())
+        try:
+            await asyncio.wait([stopping, self._closed], return_when=asyncio.FIRST_COMPLETED)
+            if not self._closed.done():
+                for consumer_tag in consumer_tags:
+                    channel.basic_cancel(consumer_tag)
+                await processor.drain()
+                connection.close()
+                await self._closed
+        finally:
+            flusher.cancel()
+            stopping.cancel()
+            await processor.stop()
+
+
+async def serve(consumer: AsyncConsumer, heartbeat=None):
+    """Fait tourner le consumer jusqu'a SIGTERM / SIGINT, en se reconnectant si besoin.
+
+    heartbeat (optionnel) est appele chaque seconde : le superviseur sait que le processus repond.
+    """
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, consumer.stop)
+
+    async def beat():
+        while True:
+            heartbeat()
+            await asyncio.sleep(1)
+
+    beating = asyncio.create_task(beat()) if heartbeat else None
+    try:
+        while not consumer.stopping:
+            try:
+                await consumer.run()
+            except Exception as e:
+                logger.error(f"Consumer interrompu: {e}")
+            if not consumer.stopping:
+                logger.warning("Connexion RabbitMQ perdue, reconnexion dans 5 s...")
+                try:
+                    # Un arret demande pendant l'attente est pris en compte immediatement
+                    await asyncio.wait_for(consumer._stopping.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        if beating:
+            beating.cancel()
+
+
+async def main():
+    await serve(AsyncConsumer())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
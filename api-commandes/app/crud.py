@@ -1,58 +1,133 @@
-from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+from sqlalchemy import delete, func, insert, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from . import models, schemas
 
+# Statuts dont les commandes ne comptent pas dans les agregats de ventes
+# (les commandes d'un client supprime en sortent comme les commandes annulees)
+STATUTS_HORS_VENTES = ("annulee", "client_supprime")
+
 
 # CREATE - Creer une commande avec ses lignes
+# Deux requetes quel que soit le nombre de lignes : INSERT ... RETURNING pour la commande,
+# puis un seul INSERT multi-lignes ... RETURNING pour toutes les lignes
 def create_commande(db: Session, commande: schemas.CommandeCreate):
     # Calculer le total a partir des lignes
     total = sum(ligne.prix_unitaire * ligne.quantite for ligne in commande.lignes)
 
-    # Creer la commande
-    db_commande = models.Commande(
-        client_id=commande.client_id,
-        total=total
-    )
-    db.add(db_commande)
-    db.flush()  # Pour obtenir l'ID de la commande avant de creer les lignes
-
-    # Creer les lignes de commande
-    for ligne in commande.lignes:
-        db_ligne = models.LigneCommande(
-            commande_id=db_commande.id,
-            produit_id=ligne.produit_id,
-            quantite=ligne.quantite,
-            prix_unitaire=ligne.prix_unitaire
-        )
-        db.add(db_ligne)
+    db_commande = db.scalars(
+        insert(models.Commande).values(client_id=commande.client_id, total=total).returning(models.Commande)
+    ).one()
+    lignes = db.scalars(
+        insert(models.LigneCommande).returning(models.LigneCommande),
+        [
+            {
+                "commande_id": db_commande.id,
+                "produit_id": ligne.produit_id,
+                "quantite": ligne.quantite,
+                "prix_unitaire": ligne.prix_unitaire
+            }
+            for ligne in commande.lignes
+        ]
+    ).all()
+    lignes.sort(key=lambda ligne: ligne.id)
+    # La relation est remplie avec les lignes inserees : pas de SELECT pour la relire
+    set_committed_value(db_commande, "lignes", lignes)
+    _ajuster_stats(db, [db_commande], 1)
 
+    # Detachee avant le commit, la commande n'est pas expiree : pas de refresh pour construire la reponse
+    db.expunge(db_commande)
     db.commit()
-    db.refresh(db_commande)
     return db_commande
 
 
+# Commandes avec leurs lignes chargees d'avance : une seule requete supplementaire
+# (SELECT ... WHERE commande_id IN (...)) pour toutes les lignes, au lieu d'une par commande
+def _commandes_query(db: Session):
+    return db.query(models.Commande).options(selectinload(models.Commande.lignes))
+
+
 # READ - Recuperer une commande par son ID
 def get_commande(db: Session, commande_id: int):
-    return db.query(models.Commande).filter(models.Commande.id == commande_id).first()
+    return _commandes_query(db).filter(models.Commande.id == commande_id).first()
+
+
+# Commande a modifier : sur PostgreSQL, ligne verrouillee (FOR UPDATE) jusqu'au commit, pour que
+# deux modifications concurrentes ne retirent ou n'ajoutent pas deux fois la commande aux agregats
+def _get_commande_verrouillee(db: Session, commande_id: int):
+    query = _commandes_query(db).filter(models.Commande.id == commande_id)
+    if db.get_bind().dialect.name == "postgresql":
+        # populate_existing : le statut lu est celui de la ligne verrouillee, pas celui deja en session
+        query = query.with_for_update().populate_existing()
+    return query.first()
+
 
+# READ - Recuperer les commandes, les plus recentes d'abord, avec filtres optionnels
+# "after" = (date_commande, id) de la derniere commande de la page precedente : pagination par curseur
+def get_commandes(db: Session, skip: int = 0, limit: int = 100, statut=None, client_id=None,
+                  date_min=None, date_max=None, after=None):
+    query = _commandes_query(db)
+    if statut is not None:
+        query = query.filter(models.Commande.statut == statut)
+    if client_id is not None:
+        query = query.filter(models.Commande.client_id == client_id)
+    if date_min is not None:
+        query = query.filter(models.Commande.date_commande >= date_min)
+    if date_max is not None:
+        query = query.filter(models.Commande.date_commande <= date_max)
 
-# READ - Recuperer toutes les commandes
-def get_commandes(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Commande).offset(skip).limit(limit).all()
+    # Tri sur (date_commande, id) : l'id departage les commandes passees au meme instant
+    query = query.order_by(models.Commande.date_commande.desc(), models.Commande.id.desc())
+    if after is not None:
+        query = query.filter(tuple_(models.Commande.date_commande, models.Commande.id) < tuple_(*after))
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
 
 
-# READ - Recuperer les commandes d'un client specifique
-def get_commandes_by_client(db: Session, client_id: int):
-    return db.query(models.Commande).filter(models.Commande.client_id == client_id).all()
+# READ - Recuperer les commandes d'un client specifique (historique, les plus recentes d'abord)
+def get_commandes_by_client(db: Session, client_id: int, limit: int = 100, after=None):
+    return get_commandes(db, limit=limit, client_id=client_id, after=after)
+
+
+# READ - Parcourir toutes les commandes avec leurs lignes (export)
+# Une ligne de resultat par ligne de commande, triee par commande ; lue par paquets de batch_size
+# via un curseur cote serveur : la memoire reste constante quelle que soit la taille de la table
+def iter_commandes_lignes(db: Session, statut=None, batch_size: int = 1000):
+    stmt = (
+        select(
+            models.Commande.id,
+            models.Commande.client_id,
+            models.Commande.statut,
+            models.Commande.total,
+            models.Commande.date_commande,
+            models.LigneCommande.id.label("ligne_id"),
+            models.LigneCommande.produit_id,
+            models.LigneCommande.quantite,
+            models.LigneCommande.prix_unitaire
+        )
+        .outerjoin(models.LigneCommande, models.LigneCommande.commande_id == models.Commande.id)
+        .order_by(models.Commande.id, models.LigneCommande.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if statut is not None:
+        stmt = stmt.where(models.Commande.statut == statut)
+    return db.execute(stmt)
 
 
 # UPDATE - Modifier le statut d'une commande
 def update_commande(db: Session, commande_id: int, commande: schemas.CommandeUpdate):
-    db_commande = get_commande(db, commande_id)
+    db_commande = _get_commande_verrouillee(db, commande_id)
     if not db_commande:
         return None
+    comptee = _comptee(db_commande)
     update_data = commande.model_dump(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_commande, key, value)
+    if _comptee(db_commande) != comptee:
+        _ajuster_stats(db, [db_commande], -1 if comptee else 1)
     db.commit()
     db.refresh(db_commande)
     return db_commande
@@ -60,20 +135,273 @@ def update_commande(db: Session, commande_id: int, commande: schemas.CommandeUpd
 
 # UPDATE STATUT - Modifier uniquement le statut d'une commande (utilisé par le consumer)
 def update_commande_statut(db: Session, commande_id: int, statut: str):
-    db_commande = get_commande(db, commande_id)
+    db_commande = _get_commande_verrouillee(db, commande_id)
     if not db_commande:
         return None
+    comptee = _comptee(db_commande)
     db_commande.statut = statut
+    if _comptee(db_commande) != comptee:
+        _ajuster_stats(db, [db_commande], -1 if comptee else 1)
     db.commit()
     db.refresh(db_commande)
     return db_commande
 
 
+# UPDATE STATUT - Marquer toutes les commandes d'un client supprime (utilisé par le consumer)
+# Un seul UPDATE ensembliste ; les commandes deja marquees ne sont pas retouchees, donc un
+# message rejoue ne change rien. Les commandes qui comptaient encore dans les ventes en sont
+# retirees juste avant, dans la meme transaction. Retourne le nombre de commandes modifiees.
+def marquer_commandes_client_supprime(db: Session, client_id: int) -> int:
+    du_client = models.Commande.client_id == client_id
+    if db.get_bind().dialect.name == "postgresql":
+        # Statuts figes jusqu'au commit : les agregats retires sont exactement ceux des commandes marquees
+        db.execute(select(models.Commande.id).where(du_client).with_for_update())
+    _retirer_stats(db, du_client)
+    result = db.execute(
+        update(models.Commande)
+        .where(du_client, models.Commande.statut != "client_supprime")
+        .values(statut="client_supprime")
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount
+
+
 # DELETE - Supprimer une commande (et ses lignes grace au CASCADE)
 def delete_commande(db: Session, commande_id: int):
-    db_commande = get_commande(db, commande_id)
+    db_commande = _get_commande_verrouillee(db, commande_id)
     if db_commande:
+        if _comptee(db_commande):
+            _ajuster_stats(db, [db_commande], -1)
         db.delete(db_commande)
         db.commit()
         return True
-    return False
\ No newline at end of file
+    return False
+
+
+# INSERT propre au dialecte : celui de PostgreSQL et de SQLite acceptent ON CONFLICT DO UPDATE
+def _upsert(db: Session, model):
+    insert_stmt = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    return insert_stmt(model)
+
+
+# REPLIQUE - Enregistrer l'etat de produits (evenements produit.*, chargement initial)
+# Un seul INSERT ... ON CONFLICT DO UPDATE ; une ligne n'est remplacee que par une version plus recente,
+# donc les evenements peuvent arriver dans le desordre ou etre rejoues
+def upsert_produits_replica(db: Session, produits: list):
+    if not produits:
+        return
+    # Deux etats du meme produit dans le lot : seul le plus recent est envoye (ON CONFLICT refuse les doublons)
+    derniers = {}
+    for produit in produits:
+        courant = derniers.get(produit["produit_id"])
+        if courant is None or courant["version"] <= produit["version"]:
+            derniers[produit["produit_id"]] = produit
+    stmt = _upsert(db, models.ProduitReplica).values([derniers[key] for key in sorted(derniers)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["produit_id"],
+        set_={col: getattr(stmt.excluded, col) for col in ("prix", "actif", "stock", "version")},
+        where=models.ProduitReplica.version <= stmt.excluded.version
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+# REPLIQUE - Marquer des produits supprimes (inactifs, sans stock)
+def supprimer_produits_replica(db: Session, produit_ids: list, version):
+    stmt = _upsert(db, models.ProduitReplica).values([
+        {"produit_id": produit_id, "prix": 0.0, "actif": False, "stock": 0, "version": version}
+        for produit_id in sorted(set(produit_ids))
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["produit_id"],
+        set_={"actif": False, "stock": 0, "version": stmt.excluded.version},
+        where=models.ProduitReplica.version <= stmt.excluded.version
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+# REPLIQUE - Noter la fin du chargement initial (rejouable)
+def marquer_replica_chargee(db: Session):
+    stmt = _upsert(db, models.ReplicaChargement).values(id=1, charge_le=datetime.now(timezone.utc))
+    db.execute(stmt.on_conflict_do_update(index_elements=["id"], set_={"charge_le": stmt.excluded.charge_le}))
+    db.commit()
+
+
+# REPLIQUE - Le chargement initial a-t-il abouti ?
+def replica_chargee(db: Session) -> bool:
+    return db.scalar(select(models.ReplicaChargement.id)) is not None
+
+
+# REPLIQUE - Tous les produits de la replique (chargement de l'index en memoire)
+def get_produits_replica(db: Session):
+    return db.execute(select(
+        models.ProduitReplica.produit_id,
+        models.ProduitReplica.prix,
+        models.ProduitReplica.actif,
+        models.ProduitReplica.stock
+    )).all()
+
+
+# STATS - Agregats de ventes (jour, client, produit) tenus a jour par increments
+
+def _comptee(commande) -> bool:
+    return commande.statut not in STATUTS_HORS_VENTES
+
+
+# Jour (UTC) d'une commande, comme date(timezone('UTC', date_commande)) dans rebuild_stats
+def _jour(date_commande):
+    if date_commande.tzinfo is not None:
+        date_commande = date_commande.astimezone(timezone.utc)
+    return date_commande.date()
+
+
+# Jour (UTC) d'une commande cote SQL ; sous SQLite les dates sont deja stockees en UTC
+def _jour_sql(db: Session):
+    date_commande = models.Commande.date_commande
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date(func.timezone("UTC", date_commande))
+    return func.date(date_commande)
+
+
+# ON CONFLICT DO UPDATE SET col = col + excluded.col : un seul aller-retour par table,
+# et deux transactions qui ajoutent au meme agregat ne perdent aucun increment
+def _ajouter_en_conflit(db: Session, model, key: str, stmt, columns):
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={col: getattr(model, col) + getattr(stmt.excluded, col) for col in columns if col != key}
+    )
+    db.execute(stmt)
+
+
+# Increments donnes ligne par ligne (une ligne par cle)
+def _incrementer(db: Session, model, key: str, rows: list):
+    if rows:
+        _ajouter_en_conflit(db, model, key, _upsert(db, model).values(rows), list(rows[0]))
+
+
+# Increments calcules par un SELECT ... GROUP BY cle (INSERT ... SELECT)
+def _incrementer_depuis(db: Session, model, key: str, columns: list, query):
+    _ajouter_en_conflit(db, model, key, _upsert(db, model).from_select(columns, query), columns)
+
+
+# Ajoute (signe=1) ou retire (signe=-1) des commandes des agregats, sans commit :
+# l'appelant valide l'ensemble dans la meme transaction que les commandes.
+# Les commandes sont regroupees par cle : une seule instruction par table quel que soit leur nombre
+def _ajuster_stats(db: Session, commandes, signe: int):
+    jours, clients, produits = {}, {}, {}
+    for commande in commandes:
+        for totaux, cle in ((jours, _jour(commande.date_commande)), (clients, commande.client_id)):
+            nb, montant = totaux.get(cle, (0, 0.0))
+            totaux[cle] = (nb + 1, montant + commande.total)
+        for ligne in commande.lignes:
+            quantite, montant = produits.get(ligne.produit_id, (0, 0.0))
+            produits[ligne.produit_id] = (quantite + ligne.quantite, montant + ligne.quantite * ligne.prix_unitaire)
+    # Une ligne d'INSERT par cle (ON CONFLICT refuse deux fois la meme cle), dans l'ordre des cles
+    _incrementer(db, models.StatVentesJour, "jour", [
+        {"jour": jour, "nb_commandes": signe * nb, "chiffre_affaires": signe * montant}
+        for jour, (nb, montant) in sorted(jours.items())
+    ])
+    _incrementer(db, models.StatClient, "client_id", [
+        {"client_id": client_id, "nb_commandes": signe * nb, "chiffre_affaires": signe * montant}
+        for client_id, (nb, montant) in sorted(clients.items())
+    ])
+    _incrementer(db, models.StatProduit, "produit_id", [
+        {"produit_id": produit_id, "quantite_vendue": signe * quantite, "chiffre_affaires": signe * montant}
+        for produit_id, (quantite, montant) in sorted(produits.items())
+    ])
+
+
+# Retire des agregats les commandes qui y comptent parmi celles du filtre, sans les charger :
+# un INSERT ... SELECT ... GROUP BY ... ON CONFLICT DO UPDATE par table, sans commit
+def _retirer_stats(db: Session, *criteres):
+    commande, ligne = models.Commande, models.LigneCommande
+    vendues = (*criteres, commande.statut.notin_(STATUTS_HORS_VENTES))
+    jour = _jour_sql(db)
+    _incrementer_depuis(
+        db, models.StatVentesJour, "jour", ["jour", "nb_commandes", "chiffre_affaires"],
+        select(jour, -func.count(), -func.sum(commande.total)).where(*vendues).group_by(jour)
+    )
+    _incrementer_depuis(
+        db, models.StatClient, "client_id", ["client_id", "nb_commandes", "chiffre_affaires"],
+        select(commande.client_id, -func.count(), -func.sum(commande.total))
+        .where(*vendues).group_by(commande.client_id)
+    )
+    _incrementer_depuis(
+        db, models.StatProduit, "produit_id", ["produit_id", "quantite_vendue", "chiffre_affaires"],
+        select(ligne.produit_id, -func.sum(ligne.quantite), -func.sum(ligne.quantite * ligne.prix_unitaire))
+        .join(commande, commande.id == ligne.commande_id)
+        .where(*vendues).group_by(ligne.produit_id)
+    )
+
+
+# STATS - Reconstruire tous les agregats a partir des commandes (INSERT ... SELECT ... GROUP BY)
+# PostgreSQL : les tables d'agregats sont verrouillees pendant la reconstruction ; une commande creee
+# en parallele attend la fin du verrou puis ajoute son increment au resultat, sans etre comptee deux fois
+def rebuild_stats(db: Session) -> dict:
+    postgres = db.get_bind().dialect.name == "postgresql"
+    tables = (models.StatVentesJour, models.StatClient, models.StatProduit)
+    if postgres:
+        names = ", ".join(model.__tablename__ for model in tables)
+        db.execute(text(f"LOCK TABLE {names} IN EXCLUSIVE MODE"))
+    for model in tables:
+        db.execute(delete(model))
+
+    vendue = models.Commande.statut.notin_(STATUTS_HORS_VENTES)
+    jour = _jour_sql(db)
+    jours = db.execute(insert(models.StatVentesJour).from_select(
+        ["jour", "nb_commandes", "chiffre_affaires"],
+        select(jour, func.count(), func.sum(models.Commande.total)).where(vendue).group_by(jour)
+    ))
+    clients = db.execute(insert(models.StatClient).from_select(
+        ["client_id", "nb_commandes", "chiffre_affaires"],
+        select(models.Commande.client_id, func.count(), func.sum(models.Commande.total))
+        .where(vendue).group_by(models.Commande.client_id)
+    ))
+    ligne = models.LigneCommande
+    produits = db.execute(insert(models.StatProduit).from_select(
+        ["produit_id", "quantite_vendue", "chiffre_affaires"],
+        select(ligne.produit_id, func.sum(ligne.quantite), func.sum(ligne.quantite * ligne.prix_unitaire))
+        .join(models.Commande, models.Commande.id == ligne.commande_id)
+        .where(vendue).group_by(ligne.produit_id)
+    ))
+    db.commit()
+    return {"jours": jours.rowcount, "clients": clients.rowcount, "produits": produits.rowcount}
+
+
+# STATS - Chiffre d'affaires par jour, du plus ancien au plus recent
+def get_stats_ventes(db: Session, date_min=None, date_max=None):
+    query = db.query(models.StatVentesJour).filter(models.StatVentesJour.nb_commandes > 0)
+    if date_min is not None:
+        query = query.filter(models.StatVentesJour.jour >= date_min)
+    if date_max is not None:
+        query = query.filter(models.StatVentesJour.jour <= date_max)
+    return query.order_by(models.StatVentesJour.jour).all()
+
+
+# STATS - Meilleurs clients (chiffre d'affaires cumule)
+def get_stats_clients(db: Session, limit: int = 100):
+    return (
+        db.query(models.StatClient)
+        .filter(models.StatClient.nb_commandes > 0)
+        .order_by(models.StatClient.chiffre_affaires.desc(), models.StatClient.client_id)
+        .limit(limit)
+        .all()
+    )
+
+
+# STATS - Agregats d'un client
+def get_stats_client(db: Session, client_id: int):
+    return db.get(models.StatClient, client_id)
+
+
+# STATS - Produits les plus vendus (quantites)
+def get_stats_produits(db: Session, limit: int = 100):
+    return (
+        db.query(models.StatProduit)
+        .filter(models.StatProduit.quantite_vendue > 0)
+        .order_by(models.StatProduit.quantite_vendue.desc(), models.StatProduit.produit_id)
+        .limit(limit)
+        .all()
+    )
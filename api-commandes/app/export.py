@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+import os
+from fastapi.responses import StreamingResponse
+
+# Nombre de lignes lues par aller-retour avec la base (curseur cote serveur) et envoyees par morceau
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def iter_ndjson(records):
+    """Un objet JSON par ligne, envoye par paquets de EXPORT_BATCH_SIZE lignes"""
+    buffer = []
+    for record in records:
+        buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(buffer) >= EXPORT_BATCH_SIZE:
+            yield ("\n".join(buffer) + "\n").encode()
+            buffer = []
+    if buffer:
+        yield ("\n".join(buffer) + "\n").encode()
+
+
+def iter_csv(records, fieldnames):
+    """CSV avec ligne d'en-tete, envoye par paquets de EXPORT_BATCH_SIZE lignes"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    for count, record in enumerate(records, start=1):
+        writer.writerow(record)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def export_response(records, export_format: str, fieldnames, filename: str) -> StreamingResponse:
+    """Reponse streamee : la memoire utilisee ne depend pas du nombre de lignes exportees.
+
+    records est un iterable (generateur) de dictionnaires aux valeurs deja serialisables en JSON.
+    """
+    if export_format == "csv":
+        body = iter_csv(records, fieldnames)
+    else:
+        body = iter_ndjson(records)
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
@@ -1,19 +1,31 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .database import engine, Base
 from .routes import router
+from . import migrations, replica
 
-Base.metadata.create_all(bind=engine)
+# Tables, colonnes et index manquants (bases existantes comprises)
+migrations.upgrade()
 
 ALLOWED_ORIGINS = os.getenv(
     "ALLOWED_ORIGINS",
     "http://localhost:3000,http://localhost:4321"
 ).split(",")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Replique des produits jamais chargee (nouvelle base) : chargement depuis l'API Produits en arriere-plan
+    arret_seed = replica.start_seed()
+    yield
+    arret_seed.set()
+
+
 app = FastAPI(
     title="PayeTonKawa - API Commandes",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +33,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor"],
 )
 app.include_router(router)
 
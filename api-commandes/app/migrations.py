@@ -0,0 +1,66 @@
+"""Mise a niveau du schema d'une base existante.
+
+create_all ne cree que les tables absentes : sur un volume PostgreSQL deja initialise,
+les colonnes et index ajoutes au modele depuis ne seraient jamais crees. upgrade() les ajoute
+(ADD COLUMN / CREATE INDEX IF NOT EXISTS) ; idempotent, execute au demarrage de l'API.
+Les tables d'agregats de ventes creees sur une base qui a deja des commandes sont remplies aussitot.
+
+Commande manuelle : docker compose run --rm api-commandes python -m app.migrations
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from . import crud, models
+from .database import Base, engine
+
+logger = logging.getLogger(__name__)
+
+# Verrou consultatif PostgreSQL : les workers qui demarrent ensemble migrent l'un apres l'autre
+MIGRATION_LOCK_ID = 72_003
+# Remplace par ix_commandes_client_date (dont client_id est le prefixe)
+OBSOLETE_INDEXES = ("ix_commandes_client_id",)
+STATS_TABLES = (models.StatVentesJour, models.StatClient, models.StatProduit)
+
+
+def _add_missing_columns(conn, table) -> list:
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    if_not_exists = "IF NOT EXISTS " if conn.dialect.name == "postgresql" else ""
+    added = []
+    for column in table.columns:
+        if column.name not in existing:
+            spec = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{spec}")
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def upgrade(bind=engine) -> list:
+    """Cree les tables, colonnes et index manquants. Retourne les colonnes ajoutees."""
+    added = []
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        existing = set(inspect(conn).get_table_names())
+        stats_missing = "commandes" in existing and any(
+            model.__tablename__ not in existing for model in STATS_TABLES
+        )
+        Base.metadata.create_all(conn)
+        for table in Base.metadata.sorted_tables:
+            added += _add_missing_columns(conn, table)
+            # IF NOT EXISTS plutot qu'une inspection : SQLite ne rapporte pas les index sur expression
+            for index in table.indexes:
+                CreateIndex(index, if_not_exists=True)(table, conn)
+        for name in OBSOLETE_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    if added:
+        logger.info(f"Colonnes ajoutees : {', '.join(added)}")
+    if stats_missing:
+        with Session(bind) as db:
+            compte = crud.rebuild_stats(db)
+        logger.info(f"Agregats de ventes initialises : {compte['jours']} jour(s), {compte['clients']} client(s)")
+    return added
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade()
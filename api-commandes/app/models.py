@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey
+from datetime import datetime, timezone
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -8,10 +9,11 @@ class Commande(Base):
     __tablename__ = "commandes"
 
     id = Column(Integer, primary_key=True, index=True)
-    client_id = Column(Integer, nullable=False, index=True)
+    client_id = Column(Integer, nullable=False)
     statut = Column(String(50), default="en_attente", nullable=False)
     total = Column(Float, default=0.0)
-    date_commande = Column(DateTime(timezone=True), server_default=func.now())
+    # Valeur aussi fixée côté Python : même précision (microsecondes) que les curseurs de pagination
+    date_commande = Column(DateTime(timezone=True), server_default=func.now(), default=lambda: datetime.now(timezone.utc))
     date_modification = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     lignes = relationship("LigneCommande", back_populates="commande", cascade="all, delete-orphan")
@@ -26,4 +28,73 @@ class LigneCommande(Base):
     quantite = Column(Integer, nullable=False, default=1)
     prix_unitaire = Column(Float, nullable=False)
 
-    commande = relationship("Commande", back_populates="lignes")
\ No newline at end of file
+    commande = relationship("Commande", back_populates="lignes")
+
+
+# Index composites de la pagination par curseur (ORDER BY date_commande DESC, id DESC)
+# Historique d'un client : remplace l'index simple sur client_id (prefixe de celui-ci)
+Index("ix_commandes_client_date", Commande.client_id, Commande.date_commande.desc(), Commande.id.desc())
+# Ecran back-office filtre par statut ; l'index est parcouru a l'envers pour les plus recentes d'abord
+Index("ix_commandes_statut_date", Commande.statut, Commande.date_commande, Commande.id)
+# Liste sans filtre, ou seulement sur une periode
+Index("ix_commandes_date", Commande.date_commande, Commande.id)
+
+
+# --- REPLIQUE DES PRODUITS ---
+# Copie compacte des produits de l'API Produits, tenue a jour par le consumer (evenements produit.*) :
+# la creation d'une commande verifie prix et disponibilite sans appel reseau
+
+class ProduitReplica(Base):
+    __tablename__ = "produits_replica"
+
+    produit_id = Column(Integer, primary_key=True, autoincrement=False)
+    prix = Column(Float, nullable=False)
+    # Un produit supprime reste en base, inactif : un evenement plus ancien ne peut pas le faire revenir
+    actif = Column(Boolean, nullable=False, default=True)
+    stock = Column(Integer, nullable=False, default=0)
+    # Horodatage de l'evenement applique : un evenement plus ancien (arrive en retard) est ignore
+    version = Column(DateTime(timezone=True), nullable=False)
+
+
+# Fin du chargement initial de la replique (une seule ligne, id = 1). Tant qu'elle manque,
+# la replique est incomplete : la verification des commandes est suspendue
+class ReplicaChargement(Base):
+    __tablename__ = "produits_replica_chargement"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    charge_le = Column(DateTime(timezone=True), nullable=False)
+
+
+# --- AGREGATS DE VENTES ---
+# Tenus a jour dans la meme transaction que la creation, le changement de statut et la suppression
+# des commandes : les tableaux de bord lisent ces lignes au lieu de parcourir lignes_commande.
+# Reconstruction complete : python -m app.stats
+
+class StatVentesJour(Base):
+    __tablename__ = "stats_ventes_jour"
+
+    # Jour de la commande (UTC)
+    jour = Column(Date, primary_key=True)
+    nb_commandes = Column(Integer, nullable=False, default=0)
+    chiffre_affaires = Column(Float, nullable=False, default=0.0)
+
+
+class StatClient(Base):
+    __tablename__ = "stats_clients"
+
+    client_id = Column(Integer, primary_key=True, autoincrement=False)
+    nb_commandes = Column(Integer, nullable=False, default=0)
+    chiffre_affaires = Column(Float, nullable=False, default=0.0)
+
+
+class StatProduit(Base):
+    __tablename__ = "stats_produits"
+
+    produit_id = Column(Integer, primary_key=True, autoincrement=False)
+    quantite_vendue = Column(Integer, nullable=False, default=0)
+    chiffre_affaires = Column(Float, nullable=False, default=0.0)
+
+
+# Classements des tableaux de bord (meilleurs clients, produits les plus vendus)
+Index("ix_stats_clients_chiffre_affaires", StatClient.chiffre_affaires)
+Index("ix_stats_produits_quantite_vendue", StatProduit.quantite_vendue)
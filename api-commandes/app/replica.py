@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from . import crud
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Verification des lignes d'une commande (produit connu et actif, prix a jour, stock suffisant)
+VALIDATION_PRODUITS = os.getenv("VALIDATION_PRODUITS", "true").lower() == "true"
+# Age maximal (en secondes) de l'index en memoire avant relecture de la table produits_replica
+REPLICA_TTL = float(os.getenv("REPLICA_TTL", "5"))
+# Ecart tolere entre le prix envoye et le prix de la replique (arrondis)
+TOLERANCE_PRIX = 0.005
+# Chargement initial : export de l'API Produits
+PRODUITS_API_URL = os.getenv("PRODUITS_API_URL", "http://localhost:8001")
+SEED_BATCH_SIZE = 1000
+# Delai (en secondes) avant un nouvel essai du chargement initial (API Produits pas encore demarree...)
+REPLICA_SEED_RETRY = float(os.getenv("REPLICA_SEED_RETRY", "10"))
+
+ProduitReplique = namedtuple("ProduitReplique", ["prix", "actif", "stock"])
+
+
+def event_version(data: dict) -> datetime:
+    """Horodatage d'un evenement produit.*, en UTC (le moment present s'il n'en porte pas)"""
+    timestamp = data.get("timestamp")
+    if not timestamp:
+        return datetime.now(timezone.utc)
+    version = datetime.fromisoformat(timestamp)
+    if version.tzinfo is None:
+        return version.replace(tzinfo=timezone.utc)
+    return version.astimezone(timezone.utc)
+
+
+class ProduitIndex:
+    """Copie en memoire de la replique des produits : {produit_id: ProduitReplique}.
+
+    La table est ecrite par le consumer (un autre processus) : l'index est relu en entier
+    quand il a plus de ttl secondes. Quelques milliers de produits, quatre colonnes : une lecture rapide.
+    """
+
+    def __init__(self, ttl: float = REPLICA_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._produits = None
+        self._chargee = False
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self._produits = None
+
+    def _stale(self) -> bool:
+        return self._produits is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def produits(self, db: Session):
+        """{produit_id: ProduitReplique}, ou None tant que le chargement initial n'a pas abouti"""
+        if self._stale():
+            with self._lock:
+                # Une seule relecture quand plusieurs requetes trouvent l'index perime en meme temps
+                if self._stale():
+                    self._chargee = crud.replica_chargee(db)
+                    self._produits = {
+                        row.produit_id: ProduitReplique(row.prix, row.actif, row.stock)
+                        for row in crud.get_produits_replica(db)
+                    } if self._chargee else {}
+                    self._loaded_at = time.monotonic()
+        return self._produits if self._chargee else None
+
+
+index = ProduitIndex()
+
+
+def verifier_lignes(db: Session, lignes) -> list:
+    """Lignes refusees d'une commande, avec la raison : inconnu, indisponible, prix_modifie, stock_insuffisant.
+
+    Liste vide si la commande peut etre enregistree. Aucun appel a l'API Produits.
+    Replique pas encore chargee (nouvelle base) : rien n'est refuse, plutot que de tout refuser.
+    """
+    produits = index.produits(db)
+    if produits is None:
+        logger.warning("Replique des produits pas encore chargee : commande acceptee sans verification")
+        return []
+    quantites = {}
+    for ligne in lignes:
+        quantites[ligne.produit_id] = quantites.get(ligne.produit_id, 0) + ligne.quantite
+
+    refusees = []
+    for ligne in lignes:
+        produit = produits.get(ligne.produit_id)
+        if produit is None:
+            refusees.append({"produit_id": ligne.produit_id, "raison": "inconnu"})
+        elif not produit.actif:
+            refusees.append({"produit_id": ligne.produit_id, "raison": "indisponible"})
+        elif abs(produit.prix - ligne.prix_unitaire) > TOLERANCE_PRIX:
+            refusees.append({"produit_id": ligne.produit_id, "raison": "prix_modifie", "prix_actuel": produit.prix})
+        elif produit.stock < quantites[ligne.produit_id]:
+            refusees.append({"produit_id": ligne.produit_id, "raison": "stock_insuffisant", "stock": produit.stock})
+    return refusees
+
+
+def seed(db: Session, lines) -> int:
+    """Charge la replique depuis l'export NDJSON de l'API Produits (une ligne JSON par produit).
+
+    La version de chaque produit est sa date de modification : un evenement recu pendant
+    le chargement reste prioritaire s'il est plus recent.
+    """
+    total = 0
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        produit = json.loads(line)
+        batch.append({
+            "produit_id": produit["id"],
+            "prix": produit["prix"],
+            "actif": bool(produit["actif"]),
+            "stock": produit["stock"],
+            "version": event_version({"timestamp": produit.get("date_modification")})
+        })
+        if len(batch) >= SEED_BATCH_SIZE:
+            crud.upsert_produits_replica(db, batch)
+            total += len(batch)
+            batch = []
+    crud.upsert_produits_replica(db, batch)
+    crud.marquer_replica_chargee(db)
+    index.invalidate()
+    return total + len(batch)
+
+
+def run_seed(url: str = PRODUITS_API_URL):
+    request = urllib.request.Request(
+        f"{url}/products/export?format=ndjson",
+        headers={"X-API-Key": os.getenv("API_KEY", "")}
+    )
+    db = SessionLocal()
+    try:
+        with urllib.request.urlopen(request) as response:
+            total = seed(db, response)
+        logger.info(f"Replique des produits chargee : {total} produit(s)")
+    finally:
+        db.close()
+
+
+def seed_until_loaded(stop: threading.Event, retry: float = REPLICA_SEED_RETRY):
+    """Charge la replique si le chargement initial n'a jamais abouti, en reessayant jusqu'au succes"""
+    while True:
+        db = SessionLocal()
+        try:
+            if crud.replica_chargee(db):
+                return
+        finally:
+            db.close()
+        try:
+            run_seed()
+            return
+        except Exception as e:
+            logger.warning(f"Chargement de la replique impossible ({e}), nouvel essai dans {retry} s")
+        if stop.wait(retry):
+            return
+
+
+def start_seed():
+    """Demarrage de l'API : chargement initial en arriere-plan si besoin. Retourne l'evenement d'arret"""
+    stop = threading.Event()
+    if VALIDATION_PRODUITS:
+        threading.Thread(target=seed_until_loaded, args=(stop,), name="replica-seed", daemon=True).start()
+    return stop
+
+
+# Chargement initial a la main (fait aussi au demarrage de l'API) : docker compose run --rm api-commandes python -m app.replica
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_seed()
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date, datetime
+from itertools import groupby
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, schemas, rabbitmq
+from typing import List, Literal, Optional
+from . import crud, schemas, rabbitmq, replica
 from .database import get_db
 from .auth import verify_api_key
+from .export import EXPORT_BATCH_SIZE, export_response
+from .http_cache import make_etag, not_modified
+from .pagination import encode_cursor, decode_cursor, InvalidCursor
 
 router = APIRouter(
     prefix="/orders",
@@ -12,9 +17,44 @@ router = APIRouter(
 )
 
 
+# ETag d'une liste de commandes : elle n'a pas changé si aucune de ses commandes n'a changé
+def _conditional_list(request: Request, response: Response, commandes):
+    etag = make_etag([(c.id, c.date_modification) for c in commandes])
+    last_modified = max((c.date_modification for c in commandes), default=None)
+    return not_modified(request, response, etag, last_modified)
+
+
+# Curseur recu -> (date_commande, id) de la derniere commande de la page precedente
+def _decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        after = decode_cursor(cursor)
+        return [datetime.fromisoformat(after[0]), int(after[1])]
+    except (InvalidCursor, IndexError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
+
+# On lit une ligne de plus pour savoir s'il existe une page suivante : elle n'est pas renvoyee
+def _page(response: Response, commandes, limit: int):
+    if len(commandes) > limit:
+        commandes = commandes[:limit]
+        last = commandes[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.date_commande, last.id)
+    return commandes
+
+
 # POST /orders : Creer une commande
+# Prix et disponibilite verifies sur la replique locale des produits (aucun appel a l'API Produits)
 @router.post("/", response_model=schemas.CommandeResponse, status_code=201)
 def create_order(commande: schemas.CommandeCreate, db: Session = Depends(get_db)):
+    if replica.VALIDATION_PRODUITS:
+        refusees = replica.verifier_lignes(db, commande.lignes)
+        if refusees:
+            raise HTTPException(status_code=409, detail={
+                "message": "Produit inconnu, indisponible ou prix modifie",
+                "lignes": refusees
+            })
     db_commande = crud.create_commande(db=db, commande=commande)
     rabbitmq.publish_commande_created(db_commande.id, {
         "client_id": db_commande.client_id,
@@ -24,25 +64,138 @@ def create_order(commande: schemas.CommandeCreate, db: Session = Depends(get_db)
     return db_commande
 
 
-# GET /orders : Lister toutes les commandes
+# GET /orders : Lister les commandes, les plus recentes d'abord (filtres et pagination par curseur)
+# Le curseur de la page suivante est renvoye dans le header X-Next-Cursor (absent sur la derniere page)
 @router.get("/", response_model=List[schemas.CommandeResponse])
-def read_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_commandes(db, skip=skip, limit=limit)
+def read_orders(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    statut: Optional[str] = None,
+    client_id: Optional[int] = None,
+    date_min: Optional[datetime] = None,
+    date_max: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    commandes = crud.get_commandes(
+        db, skip=skip, limit=limit + 1, statut=statut, client_id=client_id,
+        date_min=date_min, date_max=date_max, after=_decode_cursor(cursor)
+    )
+    commandes = _page(response, commandes, limit)
+    return _conditional_list(request, response, commandes) or commandes
+
+
+# Colonnes de l'export CSV : une ligne par ligne de commande
+EXPORT_CSV_FIELDS = [
+    "commande_id", "client_id", "statut", "total", "date_commande",
+    "ligne_id", "produit_id", "quantite", "prix_unitaire"
+]
+
+
+def _export_records(bind, statut: Optional[str], export_format: str):
+    # Session propre a l'export : celle de la requete est fermee avant la fin du streaming
+    with Session(bind=bind) as db:
+        rows = crud.iter_commandes_lignes(db, statut=statut, batch_size=EXPORT_BATCH_SIZE)
+        if export_format == "csv":
+            for row in rows:
+                yield {
+                    "commande_id": row.id,
+                    "client_id": row.client_id,
+                    "statut": row.statut,
+                    "total": row.total,
+                    "date_commande": row.date_commande.isoformat() if row.date_commande else None,
+                    "ligne_id": row.ligne_id,
+                    "produit_id": row.produit_id,
+                    "quantite": row.quantite,
+                    "prix_unitaire": row.prix_unitaire
+                }
+            return
+        # NDJSON : une commande par ligne, avec ses lignes (consecutives grace au tri par commande)
+        for _, group in groupby(rows, key=lambda row: row.id):
+            group = list(group)
+            first = group[0]
+            yield {
+                "id": first.id,
+                "client_id": first.client_id,
+                "statut": first.statut,
+                "total": first.total,
+                "date_commande": first.date_commande.isoformat() if first.date_commande else None,
+                "lignes": [
+                    {
+                        "id": row.ligne_id,
+                        "produit_id": row.produit_id,
+                        "quantite": row.quantite,
+                        "prix_unitaire": row.prix_unitaire
+                    }
+                    for row in group if row.ligne_id is not None
+                ]
+            }
+
+
+# GET /orders/export : Exporter toutes les commandes et leurs lignes (NDJSON ou CSV), en streaming
+@router.get("/export")
+def export_orders(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    statut: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    records = _export_records(db.get_bind(), statut, export_format)
+    return export_response(records, export_format, EXPORT_CSV_FIELDS, "commandes")
+
+
+# GET /orders/stats/ventes : Chiffre d'affaires et nombre de commandes par jour (agregats precalcules)
+@router.get("/stats/ventes", response_model=List[schemas.StatVentesJourResponse])
+def read_sales_stats(date_min: Optional[date] = None, date_max: Optional[date] = None,
+                     db: Session = Depends(get_db)):
+    return crud.get_stats_ventes(db, date_min=date_min, date_max=date_max)
+
+
+# GET /orders/stats/clients : Meilleurs clients (chiffre d'affaires cumule)
+@router.get("/stats/clients", response_model=List[schemas.StatClientResponse])
+def read_clients_stats(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return crud.get_stats_clients(db, limit=limit)
+
+
+# GET /orders/stats/clients/{client_id} : Valeur d'un client (zero s'il n'a jamais commande)
+@router.get("/stats/clients/{client_id}", response_model=schemas.StatClientResponse)
+def read_client_stats(client_id: int, db: Session = Depends(get_db)):
+    stat = crud.get_stats_client(db, client_id=client_id)
+    if stat is None:
+        return {"client_id": client_id, "nb_commandes": 0, "chiffre_affaires": 0.0}
+    return stat
+
+
+# GET /orders/stats/produits : Produits les plus vendus (quantites et chiffre d'affaires)
+@router.get("/stats/produits", response_model=List[schemas.StatProduitResponse])
+def read_products_stats(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return crud.get_stats_produits(db, limit=limit)
 
 
 # GET /orders/{id} : Recuperer une commande par son ID
 @router.get("/{commande_id}", response_model=schemas.CommandeResponse)
-def read_order(commande_id: int, db: Session = Depends(get_db)):
+def read_order(commande_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     db_commande = crud.get_commande(db, commande_id=commande_id)
     if db_commande is None:
         raise HTTPException(status_code=404, detail="Commande non trouvee")
-    return db_commande
+    etag = make_etag(db_commande.id, db_commande.date_modification)
+    return not_modified(request, response, etag, db_commande.date_modification) or db_commande
 
 
-# GET /orders/client/{client_id} : Commandes d'un client
+# GET /orders/client/{client_id} : Commandes d'un client, les plus recentes d'abord (pagination par curseur)
 @router.get("/client/{client_id}", response_model=List[schemas.CommandeResponse])
-def read_orders_by_client(client_id: int, db: Session = Depends(get_db)):
-    return crud.get_commandes_by_client(db, client_id=client_id)
+def read_orders_by_client(
+    client_id: int,
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    commandes = crud.get_commandes_by_client(db, client_id=client_id, limit=limit + 1, after=_decode_cursor(cursor))
+    commandes = _page(response, commandes, limit)
+    return _conditional_list(request, response, commandes) or commandes
 
 
 # PUT /orders/{id} : Modifier le statut d'une commande
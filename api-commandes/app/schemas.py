@@ -1,6 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 
 
 # --- LIGNES DE COMMANDE ---
@@ -49,3 +49,32 @@ class CommandeResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# --- STATISTIQUES DE VENTES (agregats precalcules) ---
+
+class StatVentesJourResponse(BaseModel):
+    jour: date
+    nb_commandes: int
+    chiffre_affaires: float
+
+    class Config:
+        from_attributes = True
+
+
+class StatClientResponse(BaseModel):
+    client_id: int
+    nb_commandes: int
+    chiffre_affaires: float
+
+    class Config:
+        from_attributes = True
+
+
+class StatProduitResponse(BaseModel):
+    produit_id: int
+    quantite_vendue: int
+    chiffre_affaires: float
+
+    class Config:
+        from_attributes = True
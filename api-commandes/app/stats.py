@@ -0,0 +1,33 @@
+import logging
+from sqlalchemy.orm import Session
+from . import crud
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(db: Session) -> dict:
+    """Recalcule les agregats de ventes a partir de toutes les commandes.
+
+    A lancer apres la creation des tables d'agregats sur une base existante, ou pour corriger
+    un ecart : les increments faits par les routes pendant la reconstruction ne sont pas perdus.
+    """
+    return crud.rebuild_stats(db)
+
+
+def run_rebuild():
+    db = SessionLocal()
+    try:
+        compte = rebuild(db)
+        logger.info(
+            f"Agregats de ventes reconstruits : {compte['jours']} jour(s), "
+            f"{compte['clients']} client(s), {compte['produits']} produit(s)"
+        )
+    finally:
+        db.close()
+
+
+# Reconstruction : docker compose run --rm api-commandes python -m app.stats
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    run_rebuild()
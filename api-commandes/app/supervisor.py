@@ -0,0 +1,358 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from functools import partial
+import pika
+from .async_consumer import (
+    AckBatcher, AsyncConsumer, CONSUMER_ACK_INTERVAL, _call, serve, shard_of
+)
+from .consumer import QUEUES, RABBITMQ_URL, event_key
+
+logger = logging.getLogger(__name__)
+
+# Nombre de processus qui traitent les evenements (un shard chacun)
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", str(os.cpu_count() or 1)))
+# Un processus qui ne donne plus signe de vie depuis ce delai (en secondes) est redemarre
+HEARTBEAT_TIMEOUT = float(os.getenv("CONSUMER_HEARTBEAT_TIMEOUT", "60"))
+# Temps laisse aux processus pour finir leurs traitements en cours lors d'un arret (SIGTERM)
+DRAIN_TIMEOUT = float(os.getenv("CONSUMER_DRAIN_TIMEOUT", "30"))
+# Fichier d'etat (JSON) reecrit a chaque verification, lu par le healthcheck du conteneur
+HEALTH_FILE = os.getenv("CONSUMER_HEALTH_FILE", "/tmp/consumer-health.json")
+ROUTER_PREFETCH = int(os.getenv("CONSUMER_ROUTER_PREFETCH", "500"))
+# Attente maximale des confirmations de publication en cours a l'arret du routeur (en secondes)
+ROUTER_CONFIRM_TIMEOUT = float(os.getenv("CONSUMER_ROUTER_CONFIRM_TIMEOUT", "10"))
+
+
+def shard_queue(index: int) -> str:
+    return f"commandes_events.shard.{index}"
+
+
+def route(routing_key: str, body: bytes, shards: int):
+    """Shard d'un evenement : hachage de l'entite concernee. None si le message est invalide"""
+    try:
+        return shard_of(event_key(routing_key, json.loads(body)), shards)
+    except (KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class PublishConfirms:
+    """Confirmations de publication (mode confirm) : copie publiee -> message source.
+
+    Les publications ne s'attendent pas les unes les autres ; le message source est acquitte
+    (par lots, via l'AckBatcher) des que RabbitMQ confirme sa copie, remis en file s'il la refuse.
+    """
+
+    def __init__(self, acks: AckBatcher):
+        self._acks = acks
+        self._pending = {}
+        self._published = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def published(self, source_tag: int):
+        # Les numeros de publication du canal commencent a 1 avec confirm_delivery
+        self._published += 1
+        self._pending[self._published] = source_tag
+        self.idle.clear()
+
+    def on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            numbers = [number for number in self._pending if number <= method.delivery_tag]
+        else:
+            numbers = [method.delivery_tag]
+        confirmed = isinstance(method, pika.spec.Basic.Ack)
+        for number in numbers:
+            source_tag = self._pending.pop(number, None)
+            if source_tag is None:
+                continue
+            if confirmed:
+                self._acks.ack(source_tag)
+            else:
+                logger.error(f"Copie du message {source_tag} refusee par RabbitMQ, remise en file")
+                self._acks.nack(source_tag)
+        if not self._pending:
+            self.idle.set()
+
+    async def wait(self, timeout: float = ROUTER_CONFIRM_TIMEOUT):
+        """Attend la confirmation de toutes les copies publiees, puis envoie les derniers acks"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{len(self._pending)} copie(s) non confirmee(s) : sources remises en file a la reconnexion")
+        self._acks.flush()
+
+
+async def _message_count(connection, queue: str):
+    """Nombre de messages d'une file, None si elle n'existe pas.
+
+    Declaration passive sur un canal jetable : le serveur ferme le canal si la file n'existe pas.
+    """
+    loop = asyncio.get_running_loop()
+    opened = loop.create_future()
+    connection.channel(on_open_callback=opened.set_result)
+    probe = await opened
+    result = loop.create_future()
+    probe.add_on_close_callback(lambda channel, reason: result.done() or result.set_result(None))
+    probe.queue_declare(queue=queue, passive=True, callback=lambda frame: result.done() or result.set_result(frame))
+    frame = await result
+    if frame is None:
+        return None
+    probe.close()
+    return frame.method.message_count
+
+
+class Router(AsyncConsumer):
+    """Routeur : lit les files d'evenements et copie chaque message dans la file de son shard.
+
+    Un seul routeur : l'ordre des evenements d'une meme entite est conserve jusqu'a sa file de shard.
+    Le message source n'est acquitte qu'une fois la copie confirmee par RabbitMQ (confirmations
+    asynchrones, voir PublishConfirms). Au demarrage, les files de shard en trop (moins de workers
+    qu'au lancement precedent) sont videes dans les shards actuels puis supprimees.
+    """
+
+    def __init__(self, shards: int, url: str = RABBITMQ_URL, prefetch: int = ROUTER_PREFETCH, queues=QUEUES):
+        super().__init__(url=url, prefetch=prefetch, queues=queues)
+        self.shards = shards
+
+    async def _surplus_queues(self, connection):
+        """Files de shard au-dela du nombre de workers actuel : [(file, nombre de messages)]"""
+        surplus = []
+        index = self.shards
+        while (count := await _message_count(connection, shard_queue(index))) is not None:
+            surplus.append((shard_queue(index), count))
+            index += 1
+        return surplus
+
+    async def _drain(self, connection, channel, queue: str, count: int, on_message, confirms, interrupted) -> bool:
+        """Re-route les messages d'une file de shard en trop puis la supprime. False si interrompu"""
+        loop = asyncio.get_running_loop()
+        while count:
+            received = 0
+            done = loop.create_future()
+
+            def on_surplus(ch, method, properties, body):
+                nonlocal received
+                on_message(None, ch, method, properties, body)
+                received += 1
+                if received >= count and not done.done():
+                    done.set_result(None)
+
+            consumer_tag = channel.basic_consume(queue=queue, on_message_callback=on_surplus)
+            await asyncio.wait([done, *interrupted], return_when=asyncio.FIRST_COMPLETED)
+            if not done.done():
+                return False
+            await _call(channel.basic_cancel, consumer_tag=consumer_tag)
+            await confirms.wait()
+            # Une copie refusee a remis son message source dans la file : on recommence
+            count = await _message_count(connection, queue)
+        await _call(channel.queue_delete, queue=queue, if_empty=True)
+        logger.info(f"File {queue} videe et supprimee (shards : {self.shards})")
+        return True
+
+    async def run(self):
+        """Route jusqu'a l'arret demande par stop() ou la perte de la connexion"""
+        connection = await self._connect()
+        channel = await self._open_channel(connection)
+        for index in range(self.shards):
+            await _call(channel.queue_declare, queue=shard_queue(index), durable=True)
+        acks = AckBatcher(channel)
+        confirms = PublishConfirms(acks)
+        await _call(channel.confirm_delivery, ack_nack_callback=confirms.on_confirm)
+
+        def on_message(routing_key, ch, method, properties, body):
+            routing_key = routing_key or (properties.headers or {}).get("routing_key")
+            acks.received(method.delivery_tag)
+            shard = route(routing_key, body, self.shards)
+            if shard is None:
+                logger.error(f"Message {routing_key} invalide rejete")
+                acks.nack(method.delivery_tag, requeue=False)
+                return
+            ch.basic_publish(
+                exchange="",
+                routing_key=shard_queue(shard),
+                body=body,
+                properties=pika.BasicProperties(
+                    delivery_mode=2,
+                    content_type="application/json",
+                    headers={"routing_key": routing_key}
+                )
+            )
+            confirms.published(method.delivery_tag)
+
+        async def flush_periodically():
+            while True:
+                await asyncio.sleep(CONSUMER_ACK_INTERVAL)
+                acks.flush()
+
+        flusher = asyncio.create_task(flush_periodically())
+        stopping = asyncio.create_task(self._stopping.wait())
+        try:
+            # Les anciens evenements (files en trop) passent avant les nouveaux : ordre par entite conserve
+            for queue, count in await self._surplus_queues(connection):
+                if not await self._drain(connection, channel, queue, count, on_message, confirms, [stopping, self._closed]):
+                    break
+            else:
+                for queue, routing_key in self.queues.items():
+                    channel.basic_consume(queue=queue, on_message_callback=partial(on_message, routing_key))
+                logger.info(f"Routeur démarré ({self.shards} shards)")
+                await asyncio.wait([stopping, self._closed], return_when=asyncio.FIRST_COMPLETED)
+            if not self._closed.done():
+                for consumer_tag in list(channel.consumer_tags):
+                    channel.basic_cancel(consumer_tag)
+                await confirms.wait()
+                connection.close()
+                await self._closed
+        finally:
+            flusher.cancel()
+            stopping.cancel()
+
+
+def run_router(shards: int, heartbeat):
+    """Processus routeur (voir Router)"""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(Router(shards), heartbeat))
+
+
+def run_shard_worker(index: int, heartbeat):
+    """Processus de traitement : consomme uniquement la file de son shard"""
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(AsyncConsumer(queues={shard_queue(index): None}), heartbeat))
+
+
+class _Heartbeat:
+    """Appelable passe au processus enfant : met a jour l'horodatage partage"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self):
+        self.value.value = time.time()
+
+
+class Child:
+    """Un processus supervise : sa cible, son dernier signe de vie et ses redemarrages"""
+
+    def __init__(self, name: str, target, args, context):
+        self.name = name
+        self.target = target
+        self.args = args
+        self.context = context
+        self.heartbeat = context.Value("d", 0.0)
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        self.heartbeat.value = time.time()
+        self.process = self.context.Process(
+            target=self.target,
+            args=(*self.args, _Heartbeat(self.heartbeat)),
+            name=self.name,
+            daemon=False
+        )
+        self.process.start()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "restarts": self.restarts,
+            "last_heartbeat_age": round(time.time() - self.heartbeat.value, 1),
+        }
+
+
+class Supervisor:
+    """Lance et surveille les processus du consumer : redemarrage automatique, etat de sante,
+    arret propre sur SIGTERM (le routeur s'arrete d'abord, puis les shards finissent leurs messages)."""
+
+    def __init__(self, workers: int = CONSUMER_WORKERS, context=None, router=run_router,
+                 worker=run_shard_worker, heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+                 health_file: str = HEALTH_FILE):
+        context = context or multiprocessing.get_context("spawn")
+        self.router = Child("router", router, (workers,), context)
+        self.workers = [Child(f"shard-{i}", worker, (i,), context) for i in range(workers)]
+        self.heartbeat_timeout = heartbeat_timeout
+        self.health_file = health_file
+        self.stopping = False
+
+    @property
+    def children(self):
+        return [self.router, *self.workers]
+
+    def start(self):
+        for child in self.workers:
+            child.start()
+        self.router.start()
+
+    def check(self):
+        """Redemarre les processus morts ou bloques, puis publie l'etat de sante"""
+        for child in self.children:
+            if self.stopping:
+                break
+            if not child.process.is_alive():
+                logger.warning(f"{child.name} arrete (code {child.process.exitcode}), redemarrage")
+            elif time.time() - child.heartbeat.value > self.heartbeat_timeout:
+                logger.warning(f"{child.name} ne repond plus, redemarrage")
+                child.process.kill()
+                child.process.join()
+            else:
+                continue
+            child.restarts += 1
+            child.start()
+        self.write_health()
+
+    def health(self) -> dict:
+        statuses = [child.status() for child in self.children]
+        ok = all(s["alive"] and s["last_heartbeat_age"] <= self.heartbeat_timeout for s in statuses)
+        return {"status": "ok" if ok else "degraded", "processes": statuses}
+
+    def write_health(self):
+        if not self.health_file:
+            return
+        tmp_path = f"{self.health_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.health(), f)
+        os.replace(tmp_path, self.health_file)
+
+    def _terminate(self, children, deadline: float):
+        for child in children:
+            if child.process.is_alive():
+                child.process.terminate()
+        for child in children:
+            child.process.join(max(deadline - time.time(), 0))
+            if child.process.is_alive():
+                logger.warning(f"{child.name} n'a pas termine a temps, arret force")
+                child.process.kill()
+                child.process.join()
+
+    def stop(self, timeout: float = DRAIN_TIMEOUT):
+        """Plus de nouveaux messages routes, puis chaque shard termine ce qu'il a recu.
+
+        Un seul delai pour les deux etapes : l'arret complet tient en timeout secondes
+        (stop_grace_period du conteneur au-dessus de CONSUMER_DRAIN_TIMEOUT)
+        """
+        self.stopping = True
+        deadline = time.time() + timeout
+        self._terminate([self.router], deadline)
+        self._terminate(self.workers, deadline)
+
+    def run(self, interval: float = 1.0):
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, "stopping", True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, "stopping", True))
+        self.start()
+        logger.info(f"Superviseur démarré : routeur + {len(self.workers)} shard(s)")
+        while not self.stopping:
+            self.check()
+            time.sleep(interval)
+        logger.info("Arrêt demandé, fin des traitements en cours...")
+        self.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    Supervisor().run()
@@ -1,5 +1,6 @@
 import sys
 import os
+import threading
 
 # Ajouter api-commandes/ en tête de sys.path pour que "from app..." trouve le bon module
 _API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -13,15 +14,21 @@ for _key in list(sys.modules.keys()):
 # Doit être défini AVANT tout import des modules de l'app
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
 os.environ.setdefault("API_KEY", "test-key")
+# Les commandes de test portent des produits inventes : la verification sur la replique est testee a part
+os.environ.setdefault("VALIDATION_PRODUITS", "false")
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.database import Base, get_db
+from app import (
+    consumer as consumer_module, async_consumer as async_consumer_module, migrations as migrations_module,
+    replica as replica_module, stats as stats_module, supervisor as supervisor_module
+)
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 
@@ -60,6 +67,19 @@ def client(db_session):
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def queries():
+    """Liste des requêtes SQL exécutées pendant le test (pour compter les allers-retours avec la base)."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 @pytest.fixture
 def sample_commande():
     """Payload valide pour créer une commande avec deux lignes."""
@@ -78,3 +98,47 @@ def commande_creee(client, sample_commande):
     response = client.post("/orders/", json=sample_commande)
     assert response.status_code == 201
     return response.json()
+
+
+@pytest.fixture
+def consumer(monkeypatch):
+    """Module consumer de l'API Commandes, branché sur la base de test."""
+    monkeypatch.setattr(consumer_module, "SessionLocal", TestingSessionLocal)
+    return consumer_module
+
+
+@pytest.fixture
+def async_consumer():
+    """Module du consumer asyncio de l'API Commandes."""
+    return async_consumer_module
+
+
+@pytest.fixture
+def supervisor():
+    """Module du superviseur multi-processus du consumer."""
+    return supervisor_module
+
+
+@pytest.fixture
+def stats():
+    """Module de reconstruction des agrégats de ventes."""
+    return stats_module
+
+
+@pytest.fixture
+def replica(monkeypatch, db_session):
+    """Module de la réplique des produits, vérification des commandes activée et index vidé.
+
+    Pas de chargement initial au démarrage du client de test (il appellerait l'API Produits).
+    """
+    monkeypatch.setattr(replica_module, "VALIDATION_PRODUITS", True)
+    monkeypatch.setattr(replica_module, "start_seed", lambda: threading.Event())
+    replica_module.index.invalidate()
+    yield replica_module
+    replica_module.index.invalidate()
+
+
+@pytest.fixture
+def migrations():
+    """Module de mise a niveau du schema de l'API Commandes."""
+    return migrations_module
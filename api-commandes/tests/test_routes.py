@@ -1,4 +1,18 @@
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from types import SimpleNamespace
+import pika
 import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 
 class TestRootEndpoint:
@@ -89,6 +103,23 @@ class TestCreateOrder:
         assert response.json()["lignes"][0]["quantite"] == 1
 
 
+class TestCreateOrderStatements:
+    """Nombre de requêtes SQL par commande créée (banc de mesure de create_commande)"""
+
+    @pytest.mark.parametrize("nb_lignes", [1, 10, 250])
+    def test_statements_per_order(self, client, queries, nb_lignes):
+        """Nombre de requêtes constant : commande, toutes ses lignes, puis un upsert par table d'agrégats"""
+        lignes = [{"produit_id": i + 1, "quantite": 2, "prix_unitaire": 1.5} for i in range(nb_lignes)]
+        queries.clear()
+        response = client.post("/orders/", json={"client_id": 1, "lignes": lignes})
+
+        assert response.status_code == 201
+        assert len(response.json()["lignes"]) == nb_lignes
+        assert [l["produit_id"] for l in response.json()["lignes"]] == list(range(1, nb_lignes + 1))
+        assert response.json()["total"] == 3.0 * nb_lignes
+        assert len(queries) == 5
+
+
 class TestReadOrders:
     """Tests pour GET /orders/"""
 
@@ -115,6 +146,40 @@ class TestReadOrders:
         assert len(response.json()) == 2
 
 
+class TestReadOrdersQueryCount:
+    """Les lignes des commandes sont chargées en une requête, quel que soit le nombre de commandes"""
+
+    @pytest.fixture
+    def commandes(self, client, sample_commande):
+        for client_id in (1, 1, 1, 2, 2):
+            client.post("/orders/", json={**sample_commande, "client_id": client_id})
+
+    def test_list_orders_two_queries(self, client, commandes, queries, db_session):
+        """GET /orders/ - une requête pour les commandes, une pour toutes leurs lignes"""
+        db_session.expunge_all()
+        queries.clear()
+        response = client.get("/orders/")
+        assert len(response.json()) == 5
+        assert all(len(c["lignes"]) == 2 for c in response.json())
+        assert len(queries) == 2
+
+    def test_orders_by_client_two_queries(self, client, commandes, queries, db_session):
+        """GET /orders/client/{id} - une requête pour les commandes, une pour toutes leurs lignes"""
+        db_session.expunge_all()
+        queries.clear()
+        response = client.get("/orders/client/1")
+        assert len(response.json()) == 3
+        assert len(queries) == 2
+
+    def test_get_order_two_queries(self, client, commandes, queries, db_session):
+        """GET /orders/{id} - la commande puis ses lignes, sans chargement paresseux"""
+        db_session.expunge_all()
+        queries.clear()
+        response = client.get("/orders/1")
+        assert len(response.json()["lignes"]) == 2
+        assert len(queries) == 2
+
+
 class TestReadOrder:
     """Tests pour GET /orders/{id}"""
 
@@ -140,6 +205,32 @@ class TestReadOrder:
         assert "non trouvee" in response.json()["detail"]
 
 
+class TestConditionalGetOrder:
+    """Tests pour ETag / If-None-Match / Last-Modified sur GET /orders"""
+
+    def test_get_order_etag_304(self, client, commande_creee):
+        """Même ETag renvoyé - retourne 304 sans corps"""
+        commande_id = commande_creee["id"]
+        etag = client.get(f"/orders/{commande_id}").headers["ETag"]
+
+        response = client.get(f"/orders/{commande_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_get_order_if_modified_since(self, client, commande_creee):
+        """If-Modified-Since égal à Last-Modified - retourne 304"""
+        commande_id = commande_creee["id"]
+        last_modified = client.get(f"/orders/{commande_id}").headers["Last-Modified"]
+        response = client.get(f"/orders/{commande_id}", headers={"If-Modified-Since": last_modified})
+        assert response.status_code == 304
+
+    def test_get_orders_by_client_etag_304(self, client, commande_creee):
+        """Les commandes d'un client répondent 304 tant qu'elles n'ont pas changé"""
+        etag = client.get("/orders/client/1").headers["ETag"]
+        response = client.get("/orders/client/1", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+
 class TestReadOrdersByClient:
     """Tests pour GET /orders/client/{client_id}"""
 
@@ -164,6 +255,229 @@ class TestReadOrdersByClient:
         assert response.json() == []
 
 
+class TestOrderFiltersAndPagination:
+    """Tests pour les filtres, le tri (plus récentes d'abord) et la pagination par curseur de GET /orders/"""
+
+    @pytest.fixture
+    def commandes(self, client, sample_commande):
+        """Six commandes : clients 1 et 2 en alternance, la dernière expédiée"""
+        creees = [client.post("/orders/", json={**sample_commande, "client_id": 1 + i % 2}).json() for i in range(6)]
+        client.put(f"/orders/{creees[-1]['id']}", json={"statut": "expediee"})
+        return creees
+
+    def test_newest_first(self, client, commandes):
+        """Les commandes les plus récentes sont renvoyées en premier"""
+        response = client.get("/orders/")
+        assert [c["id"] for c in response.json()] == [c["id"] for c in reversed(commandes)]
+
+    def test_filter_statut_and_client(self, client, commandes):
+        """Filtres statut et client_id"""
+        assert [c["id"] for c in client.get("/orders/", params={"statut": "expediee"}).json()] == [commandes[-1]["id"]]
+        data = client.get("/orders/", params={"client_id": 2}).json()
+        assert len(data) == 3
+        assert all(c["client_id"] == 2 for c in data)
+
+    def test_filter_date_range(self, client, commandes):
+        """date_min / date_max incluses"""
+        params = {"date_min": commandes[1]["date_commande"], "date_max": commandes[3]["date_commande"]}
+        response = client.get("/orders/", params=params)
+        assert [c["id"] for c in response.json()] == [commandes[3]["id"], commandes[2]["id"], commandes[1]["id"]]
+
+    def test_pages_follow_cursor(self, client, commandes):
+        """Le parcours des pages par X-Next-Cursor renvoie chaque commande une seule fois"""
+        seen = []
+        response = client.get("/orders/", params={"limit": 4})
+        while True:
+            seen += [c["id"] for c in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            response = client.get("/orders/", params={"limit": 4, "cursor": cursor})
+        assert seen == [c["id"] for c in reversed(commandes)]
+
+    def test_cursor_with_filter(self, client, commandes):
+        """Le curseur se combine aux filtres"""
+        first = client.get("/orders/", params={"client_id": 1, "limit": 2})
+        assert "X-Next-Cursor" in first.headers
+        second = client.get("/orders/", params={"client_id": 1, "limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+        assert [c["id"] for c in first.json() + second.json()] == [commandes[4]["id"], commandes[2]["id"], commandes[0]["id"]]
+        assert "X-Next-Cursor" not in second.headers
+
+    def test_orders_by_client_limit_and_cursor(self, client, commandes):
+        """GET /orders/client/{id} est limité et paginé par curseur"""
+        first = client.get("/orders/client/2", params={"limit": 2})
+        assert [c["id"] for c in first.json()] == [commandes[5]["id"], commandes[3]["id"]]
+        second = client.get("/orders/client/2", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]})
+        assert [c["id"] for c in second.json()] == [commandes[1]["id"]]
+        assert "X-Next-Cursor" not in second.headers
+
+    def test_invalid_cursor(self, client):
+        """Curseur illisible - retourne 400"""
+        response = client.get("/orders/", params={"cursor": "pas-un-curseur"})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Curseur invalide"
+
+    def test_limit_bounds(self, client):
+        """limit hors bornes - retourne 422"""
+        assert client.get("/orders/", params={"limit": 0}).status_code == 422
+        assert client.get("/orders/client/1", params={"limit": 1000}).status_code == 422
+
+
+class TestExportOrders:
+    """Tests pour GET /orders/export"""
+
+    def test_export_ndjson(self, client, sample_commande):
+        """NDJSON - une commande par ligne, avec ses lignes"""
+        client.post("/orders/", json=sample_commande)
+        client.post("/orders/", json={"client_id": 2, "lignes": [{"produit_id": 30, "prix_unitaire": 5.0}]})
+
+        response = client.get("/orders/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        commandes = [json.loads(line) for line in response.text.splitlines()]
+        assert [c["client_id"] for c in commandes] == [1, 2]
+        assert [l["produit_id"] for l in commandes[0]["lignes"]] == [10, 20]
+        assert commandes[1]["lignes"][0]["quantite"] == 1
+
+    def test_export_csv(self, client, sample_commande):
+        """CSV - en-tête puis une ligne par ligne de commande"""
+        commande_id = client.post("/orders/", json=sample_commande).json()["id"]
+
+        response = client.get("/orders/export", params={"format": "csv"})
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [(int(r["commande_id"]), int(r["produit_id"])) for r in rows] == [(commande_id, 10), (commande_id, 20)]
+
+    def test_export_filter_statut(self, client, sample_commande):
+        """Filtre par statut"""
+        commande_id = client.post("/orders/", json=sample_commande).json()["id"]
+        client.post("/orders/", json=sample_commande)
+        client.put(f"/orders/{commande_id}", json={"statut": "expediee"})
+
+        response = client.get("/orders/export", params={"statut": "expediee"})
+        assert [json.loads(line)["id"] for line in response.text.splitlines()] == [commande_id]
+
+    def test_export_invalid_format(self, client):
+        """Format inconnu - retourne 422"""
+        assert client.get("/orders/export", params={"format": "xml"}).status_code == 422
+
+
+class TestSalesStats:
+    """Tests pour les agrégats de ventes GET /orders/stats/*"""
+
+    @pytest.fixture
+    def commandes(self, client, sample_commande):
+        """Trois commandes : deux du client 1 (45 €, 11 €), une du client 2 (33 €)"""
+        return [
+            client.post("/orders/", json=sample_commande).json(),
+            client.post("/orders/", json={"client_id": 1, "lignes": [
+                {"produit_id": 20, "quantite": 1, "prix_unitaire": 8.00},
+                {"produit_id": 30, "quantite": 1, "prix_unitaire": 3.00}
+            ]}).json(),
+            client.post("/orders/", json={"client_id": 2, "lignes": [
+                {"produit_id": 10, "quantite": 2, "prix_unitaire": 12.50},
+                {"produit_id": 20, "quantite": 1, "prix_unitaire": 8.00}
+            ]}).json(),
+        ]
+
+    def snapshot(self, client):
+        return {
+            "ventes": client.get("/orders/stats/ventes").json(),
+            "clients": client.get("/orders/stats/clients").json(),
+            "produits": client.get("/orders/stats/produits").json(),
+        }
+
+    def test_empty(self, client):
+        """Aucune commande - agrégats vides"""
+        assert self.snapshot(client) == {"ventes": [], "clients": [], "produits": []}
+
+    def test_daily_sales(self, client, commandes):
+        """Chiffre d'affaires et nombre de commandes du jour"""
+        ventes = client.get("/orders/stats/ventes").json()
+        assert len(ventes) == 1
+        assert ventes[0]["jour"] == commandes[0]["date_commande"][:10]
+        assert ventes[0]["nb_commandes"] == 3
+        assert ventes[0]["chiffre_affaires"] == pytest.approx(77.0)
+
+    def test_daily_sales_date_range(self, client, commandes):
+        """Jours hors de l'intervalle exclus"""
+        response = client.get("/orders/stats/ventes", params={"date_max": "2000-01-01"})
+        assert response.json() == []
+
+    def test_top_clients(self, client, commandes):
+        """Clients classés par chiffre d'affaires cumulé"""
+        clients = client.get("/orders/stats/clients").json()
+        assert [(c["client_id"], c["nb_commandes"]) for c in clients] == [(1, 2), (2, 1)]
+        assert clients[0]["chiffre_affaires"] == pytest.approx(44.0)
+        assert client.get("/orders/stats/clients", params={"limit": 1}).json() == clients[:1]
+
+    def test_client_stats(self, client, commandes):
+        """Valeur d'un client ; zéro pour un client sans commande"""
+        assert client.get("/orders/stats/clients/2").json()["chiffre_affaires"] == pytest.approx(33.0)
+        assert client.get("/orders/stats/clients/999").json() == {
+            "client_id": 999, "nb_commandes": 0, "chiffre_affaires": 0.0
+        }
+
+    def test_top_products(self, client, commandes):
+        """Produits classés par quantité vendue"""
+        produits = client.get("/orders/stats/produits").json()
+        assert [(p["produit_id"], p["quantite_vendue"]) for p in produits] == [(10, 4), (20, 3), (30, 1)]
+        assert produits[0]["chiffre_affaires"] == pytest.approx(50.0)
+
+    def test_cancelled_order_leaves_stats(self, client, commandes):
+        """Une commande annulée sort des agrégats, et y revient si elle est réactivée"""
+        avant = self.snapshot(client)
+        client.put(f"/orders/{commandes[2]['id']}", json={"statut": "annulee"})
+        assert [c["client_id"] for c in client.get("/orders/stats/clients").json()] == [1]
+        assert client.get("/orders/stats/ventes").json()[0]["nb_commandes"] == 2
+
+        client.put(f"/orders/{commandes[2]['id']}", json={"statut": "en_attente"})
+        assert self.snapshot(client) == avant
+
+    def test_status_change_keeps_stats(self, client, commandes):
+        """Un changement de statut qui reste dans les ventes ne modifie pas les agrégats"""
+        avant = self.snapshot(client)
+        client.put(f"/orders/{commandes[0]['id']}", json={"statut": "expediee"})
+        assert self.snapshot(client) == avant
+
+    def test_deleted_order_leaves_stats(self, client, commandes):
+        """Une commande supprimée sort des agrégats"""
+        client.delete(f"/orders/{commandes[1]['id']}")
+        produits = client.get("/orders/stats/produits").json()
+        assert [(p["produit_id"], p["quantite_vendue"]) for p in produits] == [(10, 4), (20, 2)]
+        assert client.get("/orders/stats/clients/1").json()["nb_commandes"] == 1
+
+    def test_rebuild_matches_incremental(self, client, commandes, stats, db_session):
+        """La reconstruction complète donne les mêmes agrégats que les mises à jour incrémentales"""
+        client.put(f"/orders/{commandes[0]['id']}", json={"statut": "annulee"})
+        client.delete(f"/orders/{commandes[1]['id']}")
+        avant = self.snapshot(client)
+
+        assert stats.rebuild(db_session) == {"jours": 1, "clients": 1, "produits": 2}
+        assert self.snapshot(client) == avant
+
+    def test_client_deleted_leaves_stats(self, client, commandes, consumer, stats, db_session):
+        """client.deleted : les commandes du client sortent des ventes, une commande annulée n'est pas retirée deux fois"""
+        client.put(f"/orders/{commandes[0]['id']}", json={"statut": "annulee"})
+        consumer.callback_client_deleted(FakeChannel(), FakeMethod(), None, json.dumps({"client_id": 1}))
+        db_session.expire_all()
+
+        assert client.get(f"/orders/{commandes[0]['id']}").json()["statut"] == "client_supprime"
+        assert client.get(f"/orders/{commandes[1]['id']}").json()["statut"] == "client_supprime"
+        assert client.get("/orders/stats/clients/1").json()["nb_commandes"] == 0
+        ventes = client.get("/orders/stats/ventes").json()
+        assert (ventes[0]["nb_commandes"], ventes[0]["chiffre_affaires"]) == (1, pytest.approx(33.0))
+        produits = client.get("/orders/stats/produits").json()
+        assert [(p["produit_id"], p["quantite_vendue"]) for p in produits] == [(10, 2), (20, 1)]
+
+        # Message rejoue : rien n'est retire une seconde fois ; la reconstruction donne le meme resultat
+        consumer.callback_client_deleted(FakeChannel(), FakeMethod(2), None, json.dumps({"client_id": 1}))
+        avant = self.snapshot(client)
+        stats.rebuild(db_session)
+        assert self.snapshot(client) == avant
+
+
 class TestUpdateOrder:
     """Tests pour PUT /orders/{id}"""
 
@@ -235,3 +549,450 @@ class TestDeleteOrder:
         response = client.delete("/orders/99999")
         assert response.status_code == 404
         assert "non trouvee" in response.json()["detail"]
+
+
+class FakeChannel:
+    """Canal RabbitMQ factice : enregistre les ack / nack"""
+
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+        self.multiple_acks = 0
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+        self.multiple_acks += multiple
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        self.nacks.append(delivery_tag)
+
+
+class FakeMethod:
+    def __init__(self, delivery_tag=1, routing_key="client.deleted"):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+
+
+class TestClientDeletedConsumer:
+    """Tests pour le traitement de l'événement client.deleted"""
+
+    def test_marks_all_client_orders(self, client, sample_commande, consumer, queries):
+        """Toutes les commandes du client sont marquées en un seul UPDATE"""
+        for client_id in (1, 1, 1, 2):
+            client.post("/orders/", json={**sample_commande, "client_id": client_id})
+        channel = FakeChannel()
+
+        queries.clear()
+        consumer.callback_client_deleted(channel, FakeMethod(), None, json.dumps({"client_id": 1}))
+
+        assert channel.acks == [1]
+        assert len([q for q in queries if q.startswith("UPDATE")]) == 1
+        statuts = {c["client_id"]: c["statut"] for c in client.get("/orders/").json()}
+        assert statuts == {1: "client_supprime", 2: "en_attente"}
+
+    def test_redelivery_is_idempotent(self, client, sample_commande, consumer, db_session):
+        """Message rejoué - aucune commande modifiée, le message est acquitté"""
+        client.post("/orders/", json=sample_commande)
+        consumer.callback_client_deleted(FakeChannel(), FakeMethod(), None, json.dumps({"client_id": 1}))
+
+        assert consumer.crud.marquer_commandes_client_supprime(db_session, 1) == 0
+        channel = FakeChannel()
+        consumer.callback_client_deleted(channel, FakeMethod(2), None, json.dumps({"client_id": 1}))
+        assert channel.acks == [2]
+
+
+class TestProductReplica:
+    """Tests pour la réplique locale des produits (événements produit.*) et la vérification des commandes"""
+
+    @pytest.fixture
+    def events(self, consumer, replica, monkeypatch):
+        """Envoie un événement produit.* au consumer ; l'index en mémoire est relu à chaque commande"""
+        monkeypatch.setattr(replica.index, "ttl", 0)
+
+        def send(routing_key, message, timestamp="2026-01-01T10:00:00+00:00"):
+            channel = FakeChannel()
+            consumer._callback(channel, FakeMethod(), json.dumps({**message, "timestamp": timestamp}), routing_key)
+            assert channel.acks == [1]
+        return send
+
+    @pytest.fixture
+    def produits(self, events, replica, db_session):
+        """Deux produits actifs : 10 à 12,50 € (stock 5), 20 à 8 € (stock 100), réplique chargée"""
+        events("produit.created", {"produit_id": 10, "data": {"nom": "Café", "prix": 12.50, "stock": 5, "actif": True}})
+        events("produit.created", {"produit_id": 20, "data": {"nom": "Thé", "prix": 8.00, "stock": 100, "actif": True}})
+        replica.crud.marquer_replica_chargee(db_session)
+
+    def commander(self, client, *lignes):
+        return client.post("/orders/", json={"client_id": 1, "lignes": [
+            {"produit_id": produit_id, "quantite": quantite, "prix_unitaire": prix}
+            for produit_id, quantite, prix in lignes
+        ]})
+
+    def test_valid_order(self, client, produits):
+        """Prix à jour et stock suffisant - commande créée"""
+        response = self.commander(client, (10, 2, 12.50), (20, 1, 8.00))
+        assert response.status_code == 201
+
+    def test_unknown_product(self, client, produits):
+        """Produit absent de la réplique - 409"""
+        response = self.commander(client, (10, 1, 12.50), (99, 1, 1.00))
+        assert response.status_code == 409
+        assert response.json()["detail"]["lignes"] == [{"produit_id": 99, "raison": "inconnu"}]
+
+    def test_price_changed(self, client, produits):
+        """Prix envoyé différent du prix courant - 409 avec le prix à jour"""
+        response = self.commander(client, (10, 1, 9.99))
+        assert response.status_code == 409
+        assert response.json()["detail"]["lignes"] == [{"produit_id": 10, "raison": "prix_modifie", "prix_actuel": 12.50}]
+
+    def test_insufficient_stock_across_lines(self, client, produits):
+        """Le stock est comparé à la quantité totale du produit dans la commande"""
+        response = self.commander(client, (10, 3, 12.50), (10, 3, 12.50))
+        assert response.status_code == 409
+        assert response.json()["detail"]["lignes"][0] == {"produit_id": 10, "raison": "stock_insuffisant", "stock": 5}
+
+    def test_batch_update_event(self, client, produits, events):
+        """Un événement produit.updated groupé met à jour tous ses produits"""
+        events("produit.updated", {"batch": True, "produits": [
+            {"produit_id": 10, "nom": "Café", "prix": 11.00, "stock": 50, "actif": True},
+            {"produit_id": 20, "nom": "Thé", "prix": 8.00, "stock": 0, "actif": True}
+        ]}, timestamp="2026-01-01T11:00:00+00:00")
+        assert self.commander(client, (10, 10, 11.00)).status_code == 201
+        assert self.commander(client, (20, 1, 8.00)).json()["detail"]["lignes"][0]["raison"] == "stock_insuffisant"
+
+    def test_inactive_and_deleted_products(self, client, produits, events):
+        """Produit désactivé ou supprimé - indisponible"""
+        events("produit.updated", {"produit_id": 10, "data": {"nom": "Café", "prix": 12.50, "stock": 5, "actif": False}},
+               timestamp="2026-01-01T11:00:00+00:00")
+        events("produit.deleted", {"produit_id": 20}, timestamp="2026-01-01T11:00:00+00:00")
+        response = self.commander(client, (10, 1, 12.50), (20, 1, 8.00))
+        assert [l["raison"] for l in response.json()["detail"]["lignes"]] == ["indisponible", "indisponible"]
+
+    def test_late_event_ignored(self, client, produits, events):
+        """Un événement plus ancien que l'état connu (arrivé en retard) ne le remplace pas"""
+        events("produit.deleted", {"produit_id": 20}, timestamp="2026-01-01T12:00:00+00:00")
+        events("produit.updated", {"produit_id": 20, "data": {"nom": "Thé", "prix": 7.00, "stock": 100, "actif": True}},
+               timestamp="2026-01-01T11:00:00+00:00")
+        events("produit.updated", {"produit_id": 10, "data": {"nom": "Café", "prix": 1.00, "stock": 5, "actif": True}},
+               timestamp="2026-01-01T09:00:00+00:00")
+        assert self.commander(client, (20, 1, 7.00)).json()["detail"]["lignes"][0]["raison"] == "indisponible"
+        assert self.commander(client, (10, 1, 12.50)).status_code == 201
+
+    def test_index_served_from_memory(self, client, produits, replica, queries, monkeypatch):
+        """Tant que l'index en mémoire est récent, la vérification ne lit pas la table produits_replica"""
+        monkeypatch.setattr(replica.index, "ttl", 60)
+        self.commander(client, (10, 1, 12.50))
+        queries.clear()
+        assert self.commander(client, (10, 1, 12.50)).status_code == 201
+        assert not [q for q in queries if "produits_replica" in q]
+
+    def test_seed_from_export(self, client, replica, db_session):
+        """Chargement initial depuis l'export NDJSON de l'API Produits"""
+        lines = [
+            json.dumps({"id": 1, "prix": 4.5, "stock": 3, "actif": True, "date_modification": "2026-01-01T10:00:00"}),
+            "",
+            json.dumps({"id": 2, "prix": 6.0, "stock": 0, "actif": False, "date_modification": "2026-01-01T10:00:00"}),
+        ]
+        assert replica.seed(db_session, lines) == 2
+        assert self.commander(client, (1, 3, 4.5)).status_code == 201
+        assert self.commander(client, (2, 1, 6.0)).json()["detail"]["lignes"][0]["raison"] == "indisponible"
+
+    def test_not_loaded_skips_validation(self, client, events, replica, db_session):
+        """Réplique jamais chargée : commandes acceptées sans vérification, puis vérifiées une fois chargée"""
+        events("produit.created", {"produit_id": 10, "data": {"nom": "Café", "prix": 12.50, "stock": 5, "actif": True}})
+        assert self.commander(client, (99, 1, 1.00)).status_code == 201
+        replica.crud.marquer_replica_chargee(db_session)
+        assert self.commander(client, (99, 1, 1.00)).status_code == 409
+
+    def test_seed_retried_until_loaded(self, replica, db_session, monkeypatch):
+        """Démarrage : le chargement initial est réessayé tant qu'il échoue (API Produits indisponible)"""
+        session_factory = sessionmaker(bind=db_session.get_bind())
+        monkeypatch.setattr(replica, "SessionLocal", session_factory)
+        essais = []
+
+        def run_seed():
+            essais.append(1)
+            if len(essais) == 1:
+                raise ConnectionRefusedError("api-produits")
+            db = session_factory()
+            replica.seed(db, [json.dumps({"id": 1, "prix": 4.5, "stock": 3, "actif": True})])
+            db.close()
+        monkeypatch.setattr(replica, "run_seed", run_seed)
+
+        replica.seed_until_loaded(threading.Event(), retry=0)
+        assert len(essais) == 2
+        assert replica.crud.replica_chargee(db_session)
+        # Déjà chargée : pas de nouveau chargement
+        replica.seed_until_loaded(threading.Event(), retry=0)
+        assert len(essais) == 2
+
+
+class FakeSession:
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class TestAsyncConsumer:
+    """Tests pour le consumer asyncio (parallélisme, ordre par entité, acks groupés)"""
+
+    def run_events(self, async_consumer, handler, events, concurrency, ack_batch=10):
+        """Fait traiter les événements (client_id, données) par un EventProcessor branché sur un canal factice"""
+        channel = FakeChannel()
+        handlers = {"client.deleted": (handler, "client_id")}
+
+        async def scenario():
+            acks = async_consumer.AckBatcher(channel, batch_size=ack_batch)
+            processor = async_consumer.EventProcessor(acks, concurrency, session_factory=FakeSession, handlers=handlers)
+            processor.start()
+            for tag, data in enumerate(events, start=1):
+                processor.submit(tag, "client.deleted", json.dumps(data))
+            await processor.drain()
+            await processor.stop()
+
+        asyncio.run(scenario())
+        return channel
+
+    def test_order_preserved_per_client(self, async_consumer):
+        """Les événements d'un même client sont traités dans l'ordre d'arrivée"""
+        traites = []
+
+        def handler(db, data):
+            time.sleep(0.002 * (data["client_id"] % 3))
+            traites.append((data["client_id"], data["seq"]))
+
+        events = [{"client_id": client_id, "seq": seq} for seq in range(5) for client_id in range(8)]
+        channel = self.run_events(async_consumer, handler, events, concurrency=4)
+
+        for client_id in range(8):
+            assert [seq for c, seq in traites if c == client_id] == list(range(5))
+        assert max(channel.acks) == len(events)
+        assert channel.multiple_acks == len(channel.acks) < len(events)
+
+    def concurrency_peak(self, async_consumer, concurrency, events=32):
+        """Nombre maximal de handlers observés en même temps.
+
+        Chaque handler attend (sans délai fixe) que `concurrency` handlers aient démarré : si les
+        workers tournent bien en parallèle, le pic est atteint à coup sûr, sinon le test échoue.
+        """
+        lock = threading.Lock()
+        tous_demarres = threading.Event()
+        compteur = {"actifs": 0, "pic": 0}
+
+        def handler(db, data):
+            with lock:
+                compteur["actifs"] += 1
+                compteur["pic"] = max(compteur["pic"], compteur["actifs"])
+                if compteur["actifs"] == concurrency:
+                    tous_demarres.set()
+            if concurrency > 1:
+                tous_demarres.wait(timeout=5)
+            with lock:
+                compteur["actifs"] -= 1
+
+        self.run_events(async_consumer, handler, [{"client_id": client_id} for client_id in range(events)], concurrency)
+        return compteur["pic"]
+
+    def test_handlers_run_concurrently(self, async_consumer):
+        """Entités différentes : jusqu'à `concurrency` handlers en parallèle, jamais plus"""
+        assert len({async_consumer.shard_of(("client", i), 4) for i in range(32)}) == 4
+        assert self.concurrency_peak(async_consumer, concurrency=1) == 1
+        assert self.concurrency_peak(async_consumer, concurrency=4) == 4
+
+    def test_failed_event_nacked(self, async_consumer):
+        """Erreur de traitement - le message est rejeté (nack) et les autres acquittés"""
+        def handler(db, data):
+            if data["client_id"] == 2:
+                raise RuntimeError("base indisponible")
+
+        channel = self.run_events(async_consumer, handler, [{"client_id": i} for i in range(1, 4)], concurrency=2)
+        assert channel.nacks == [2]
+        assert max(channel.acks) == 3
+
+    def test_ack_never_covers_in_flight_message(self, async_consumer):
+        """Un ack groupé ne couvre jamais un message encore en cours de traitement"""
+        channel = FakeChannel()
+        acks = async_consumer.AckBatcher(channel, batch_size=100)
+        for tag in (1, 2, 3):
+            acks.received(tag)
+        acks.ack(2)
+        acks.ack(3)
+        acks.flush()
+        assert channel.acks == []
+        acks.ack(1)
+        acks.flush()
+        assert channel.acks == [3]
+
+    def test_shard_is_stable(self, async_consumer):
+        """Une même entité tombe toujours sur le même shard"""
+        assert async_consumer.shard_of(("client", 42), 8) == async_consumer.shard_of(("client", 42), 8)
+        assert len({async_consumer.shard_of(("client", i), 8) for i in range(100)}) == 8
+
+    def test_shard_ring_consistent(self, async_consumer):
+        """Un shard de plus : seules les entités reprises par le nouveau shard changent de shard"""
+        avant = [async_consumer.shard_of(("client", i), 4) for i in range(2000)]
+        apres = [async_consumer.shard_of(("client", i), 5) for i in range(2000)]
+        deplaces = [nouveau for ancien, nouveau in zip(avant, apres) if ancien != nouveau]
+        assert set(deplaces) == {4}
+        assert len(deplaces) < 2000 * 0.3
+
+
+def exit_immediately(*args):
+    """Processus supervisé qui s'arrête tout de suite (simule un crash)"""
+    sys.exit(3)
+
+
+def run_until_sigterm(*args):
+    """Processus supervisé qui donne signe de vie jusqu'à SIGTERM, puis s'arrête proprement"""
+    heartbeat = args[-1]
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    while not stopping:
+        heartbeat()
+        time.sleep(0.05)
+
+
+def hang(*args):
+    """Processus supervisé bloqué : ne donne plus signe de vie"""
+    time.sleep(60)
+
+
+def ignore_sigterm(*args):
+    """Processus supervisé qui ne s'arrête pas sur SIGTERM (vidage trop long)"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+def wait_for(condition, timeout=5.0):
+    """Attend qu'une condition soit vraie (vérifiée toutes les 10 ms), au plus timeout secondes"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestConsumerSupervisor:
+    """Tests pour le superviseur multi-processus (shards, redémarrage, arrêt propre)"""
+
+    def make(self, supervisor, tmp_path, target, **kwargs):
+        return supervisor.Supervisor(
+            workers=2, context=multiprocessing.get_context("fork"), router=target, worker=target,
+            health_file=str(tmp_path / "health.json"), **kwargs
+        )
+
+    def test_route_by_entity(self, supervisor):
+        """Les événements d'un même client vont toujours dans le même shard"""
+        body = json.dumps({"client_id": 42}).encode()
+        shards = {supervisor.route("client.deleted", body, 4) for _ in range(10)}
+        assert len(shards) == 1
+        assert supervisor.route("client.deleted", b"pas du json", 4) is None
+        assert supervisor.route("commande.inconnue", body, 4) is None
+
+    def test_publish_confirms(self, supervisor, async_consumer):
+        """Source acquittée une fois sa copie confirmée ; copie refusée - source remise en file"""
+        channel = FakeChannel()
+        acks = async_consumer.AckBatcher(channel, batch_size=100)
+        confirms = supervisor.PublishConfirms(acks)
+        for source_tag in (11, 12, 13, 14):
+            acks.received(source_tag)
+            confirms.published(source_tag)
+
+        confirms.on_confirm(SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=2, multiple=True)))
+        confirms.on_confirm(SimpleNamespace(method=pika.spec.Basic.Nack(delivery_tag=3)))
+        assert channel.nacks == [13]
+        assert not confirms.idle.is_set()
+        confirms.on_confirm(SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=4)))
+        assert confirms.idle.is_set()
+
+        asyncio.run(confirms.wait(timeout=1))
+        assert channel.acks == [14]
+        assert channel.multiple_acks == 1
+
+    def test_restarts_crashed_process(self, supervisor, tmp_path):
+        """Un processus arrêté est redémarré et l'état de santé le signale"""
+        sup = self.make(supervisor, tmp_path, exit_immediately)
+        sup.start()
+        for child in sup.children:
+            child.process.join(5)
+        sup.check()
+        assert [child.restarts for child in sup.children] == [1, 1, 1]
+        health = json.loads((tmp_path / "health.json").read_text())
+        assert [p["name"] for p in health["processes"]] == ["router", "shard-0", "shard-1"]
+        sup.stop(timeout=5)
+
+    def test_restarts_unresponsive_process(self, supervisor, tmp_path):
+        """Un processus sans signe de vie depuis trop longtemps est tué puis redémarré"""
+        sup = self.make(supervisor, tmp_path, hang, heartbeat_timeout=60)
+        sup.start()
+        # Dernier signe de vie vieux de deux minutes : inutile d'attendre l'expiration du délai
+        for child in sup.children:
+            child.heartbeat.value -= 120
+        sup.check()
+        assert all(child.restarts == 1 for child in sup.children)
+        sup.stop(timeout=0.5)
+        assert not any(child.process.is_alive() for child in sup.children)
+
+    def test_graceful_stop(self, supervisor, tmp_path):
+        """SIGTERM : chaque processus termine proprement (code 0)"""
+        sup = self.make(supervisor, tmp_path, run_until_sigterm)
+        sup.start()
+        # Premier signe de vie de chaque processus : son gestionnaire de SIGTERM est installé
+        started = [child.heartbeat.value for child in sup.children]
+        assert wait_for(lambda: all(child.heartbeat.value > t for child, t in zip(sup.children, started)))
+        sup.check()
+        assert sup.health()["status"] == "ok"
+        sup.stop(timeout=5)
+        assert [child.process.exitcode for child in sup.children] == [0, 0, 0]
+
+    def test_stop_single_deadline(self, supervisor, tmp_path):
+        """Routeur puis shards : l'arrêt complet respecte un seul délai, pas un délai par étape"""
+        sup = self.make(supervisor, tmp_path, ignore_sigterm)
+        sup.start()
+        started = time.monotonic()
+        sup.stop(timeout=1)
+        # Un délai par étape : au moins 2 s (routeur puis shards tués chacun après 1 s)
+        assert time.monotonic() - started < 1.8
+        assert not any(child.process.is_alive() for child in sup.children)
+
+
+class TestSchemaUpgrade:
+    """Tests de la mise a niveau d'une base creee avant les nouveaux index et les agregats"""
+
+    def test_upgrade_base_existante(self, migrations):
+        """Index remplaces, tables d'agregats creees et remplies depuis les commandes existantes"""
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE commandes (id INTEGER PRIMARY KEY, client_id INTEGER NOT NULL, "
+                "statut VARCHAR(50) NOT NULL, total FLOAT, date_commande DATETIME, date_modification DATETIME)"
+            ))
+            conn.execute(text("CREATE INDEX ix_commandes_client_id ON commandes (client_id)"))
+            conn.execute(text(
+                "CREATE TABLE lignes_commande (id INTEGER PRIMARY KEY, commande_id INTEGER NOT NULL "
+                "REFERENCES commandes (id) ON DELETE CASCADE, produit_id INTEGER NOT NULL, "
+                "quantite INTEGER NOT NULL, prix_unitaire FLOAT NOT NULL)"
+            ))
+            conn.execute(text(
+                "INSERT INTO commandes (client_id, statut, total, date_commande) "
+                "VALUES (7, 'livree', 30.0, '2024-03-01 10:00:00'), (7, 'annulee', 5.0, '2024-03-01 11:00:00')"
+            ))
+            conn.execute(text("INSERT INTO lignes_commande (commande_id, produit_id, quantite, prix_unitaire) "
+                              "VALUES (1, 3, 2, 15.0)"))
+
+        assert migrations.upgrade(engine) == []
+
+        with engine.connect() as conn:
+            indexes = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+            assert {"ix_commandes_client_date", "ix_commandes_statut_date", "ix_commandes_date"} <= indexes
+            assert "ix_commandes_client_id" not in indexes
+            client = conn.execute(text("SELECT nb_commandes, chiffre_affaires FROM stats_clients "
+                                       "WHERE client_id = 7")).one()
+            assert tuple(client) == (1, 30.0)
+            produit = conn.execute(text("SELECT quantite_vendue FROM stats_produits WHERE produit_id = 3")).scalar()
+            assert produit == 2
+        # Relancee : rien a faire, les agregats ne sont pas recalcules
+        assert migrations.upgrade(engine) == []
@@ -0,0 +1,241 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+import pika
+from sqlalchemy.orm import Session
+from . import models, schemas
+from .http_cache import content_etag
+from .database import SessionLocal
+from .rabbitmq import RABBITMQ_URL, EXCHANGE_NAME
+
+logger = logging.getLogger(__name__)
+
+# Écoute des événements produit.* pour garder le catalogue à jour entre plusieurs instances de l'API
+CATALOG_SYNC_EVENTS = os.getenv("CATALOG_SYNC_EVENTS", "true").lower() == "true"
+
+
+def normalize(text: str) -> str:
+    """Minuscules sans accents : "Café" et "cafe" donnent la même clé"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class PrefixIndex:
+    """Index des noms de produits pour l'autocomplétion : liste triée de clés, recherche par dichotomie.
+
+    Chaque nom est indexé à partir de chacun de ses mots : "bur" trouve "Café Burkina".
+    """
+
+    def __init__(self, noms: dict, version: int):
+        self.version = version
+        keys = []
+        for produit_id, nom in noms.items():
+            words = normalize(nom).split()
+            for i in range(len(words)):
+                keys.append((" ".join(words[i:]), produit_id, nom))
+        keys.sort()
+        self._keys = keys
+
+    def search(self, prefix: str, limit: int = 10):
+        prefix = " ".join(normalize(prefix).split())
+        results, seen = [], set()
+        i = bisect.bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(results) < limit:
+            key, produit_id, nom = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            if produit_id not in seen:
+                seen.add(produit_id)
+                results.append({"id": produit_id, "nom": nom})
+            i += 1
+        return results
+
+
+class CatalogSnapshot:
+    """Catalogue des produits actifs gardé en mémoire, déjà sérialisé en JSON.
+
+    Chaque produit est sérialisé une seule fois (à son chargement ou à sa modification) :
+    servir une page du catalogue revient à concaténer des octets, sans requête SQL
+    ni validation Pydantic.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  # {produit_id: JSON du ProduitResponse}, trié par id
+        self._values = ()
+        self._noms = {}  # {produit_id: nom}, pour l'autocomplétion
+        self._prefix_index = None
+        self._etags = (None, {})  # (version, {(skip, limit): ETag de la page})
+        self.version = 0
+        # Version des seuls noms (ajout, renommage, retrait) : un mouvement de stock ne reconstruit pas l'index
+        self.noms_version = 0
+
+    def _serialize(self, produit: models.Produit) -> bytes:
+        return schemas.ProduitResponse.model_validate(produit).model_dump_json().encode()
+
+    def _changed(self):
+        self._values = tuple(self._entries.values())
+        self.version += 1
+
+    def load(self, db: Session):
+        """(Re)construit tout le catalogue depuis la base"""
+        while True:
+            started = self.version
+            produits = db.query(models.Produit).filter(models.Produit.actif.is_(True)).order_by(models.Produit.id).all()
+            entries = {p.id: self._serialize(p) for p in produits}
+            noms = {p.id: p.nom for p in produits}
+            with self._lock:
+                # Un produit a changé pendant la lecture : on recommence pour ne pas installer une version périmée
+                if self.version == started:
+                    self._entries = entries
+                    if noms != self._noms:
+                        self._noms = noms
+                        self.noms_version += 1
+                    self._changed()
+                    return
+
+    def invalidate(self):
+        """Oublie le catalogue : il sera rechargé à la prochaine lecture"""
+        with self._lock:
+            self._entries = None
+            self._values = ()
+            self._noms = {}
+            self.version += 1
+            self.noms_version += 1
+
+    def upsert(self, produit: models.Produit):
+        """Met à jour un produit (ou le retire s'il n'est plus actif)"""
+        self.upsert_many([produit])
+
+    def upsert_many(self, produits):
+        """Met à jour un lot de produits en une seule fois (mise à jour en masse, stock)"""
+        actifs = {p.id: self._serialize(p) for p in produits if p.actif}
+        inactifs = [p.id for p in produits if not p.actif]
+        with self._lock:
+            if self._entries is None:
+                self.version += 1
+                return
+            nouveaux = [produit_id for produit_id in actifs if produit_id not in self._entries]
+            # Produit réactivé au milieu du catalogue : il faudra retrier pour garder l'ordre des ids
+            in_order = nouveaux == sorted(nouveaux) and (
+                not nouveaux or not self._entries or nouveaux[0] > next(reversed(self._entries))
+            )
+            removed = [self._entries.pop(produit_id, None) for produit_id in inactifs]
+            if not actifs and not any(entry is not None for entry in removed):
+                return
+            self._entries.update(actifs)
+            noms = {p.id: p.nom for p in produits if p.actif and self._noms.get(p.id) != p.nom}
+            retires = [produit_id for produit_id in inactifs if self._noms.pop(produit_id, None) is not None]
+            if noms or retires:
+                self._noms.update(noms)
+                self.noms_version += 1
+            if not in_order:
+                self._entries = dict(sorted(self._entries.items()))
+            self._changed()
+
+    def remove(self, produit_id: int):
+        with self._lock:
+            if self._entries is None:
+                self.version += 1
+            elif self._entries.pop(produit_id, None) is not None:
+                self._noms.pop(produit_id, None)
+                self.noms_version += 1
+                self._changed()
+
+    def page(self, db: Session, skip: int = 0, limit: int = 100):
+        """Retourne (corps JSON de la page, ETag calculé sur ce corps).
+
+        La version du catalogue est propre au processus (elle repart de zéro au redémarrage et
+        diffère d'un worker à l'autre) : elle ne sert que de clé au cache des ETags, jamais d'ETag.
+        """
+        if self._entries is None:
+            self.load(db)
+        values, version = self._values, self.version
+        body = b"[" + b",".join(values[skip:skip + limit]) + b"]"
+        etags_version, etags = self._etags
+        if etags_version != version or len(etags) >= 256:
+            # Nouvelle version du catalogue : les ETags des versions précédentes ne resserviront plus
+            etags = {}
+            self._etags = (version, etags)
+        etag = etags.get((skip, limit))
+        if etag is None:
+            etag = etags[(skip, limit)] = content_etag(body)
+        return body, etag
+
+    def suggest(self, db: Session, prefix: str, limit: int = 10):
+        """Produits actifs dont un mot du nom commence par prefix.
+
+        L'index est reconstruit à la première recherche qui suit un changement des noms
+        (modification locale ou événement produit.* d'une autre instance), pas du stock ou du prix.
+        """
+        if self._entries is None:
+            self.load(db)
+        index = self._prefix_index
+        if index is None or index.version != self.noms_version:
+            with self._lock:
+                noms, version = dict(self._noms), self.noms_version
+            index = self._prefix_index = PrefixIndex(noms, version)
+        return index.search(prefix, limit)
+
+
+catalog = CatalogSnapshot()
+
+
+def refresh_produits(produit_ids: list):
+    """Recharge des produits depuis la base (après un événement venant d'une autre instance)"""
+    db = SessionLocal()
+    try:
+        produits = db.query(models.Produit).filter(models.Produit.id.in_(produit_ids)).all()
+        catalog.upsert_many(produits)
+        for produit_id in set(produit_ids) - {p.id for p in produits}:
+            catalog.remove(produit_id)
+    finally:
+        db.close()
+
+
+def callback_produit_event(ch, method, properties, body):
+    try:
+        data = json.loads(body)
+        # Un événement groupé (mise à jour en masse, réservation de stock) porte une liste de produits
+        if data.get("batch"):
+            produit_ids = [p["produit_id"] for p in data.get("produits", [])]
+        else:
+            produit_ids = [data.get("produit_id")]
+        produit_ids = [produit_id for produit_id in produit_ids if produit_id is not None]
+
+        if method.routing_key == "produit.deleted":
+            for produit_id in produit_ids:
+                catalog.remove(produit_id)
+        elif produit_ids:
+            refresh_produits(produit_ids)
+    except Exception as e:
+        logger.error(f"Erreur mise à jour du catalogue ({method.routing_key}): {e}")
+        catalog.invalidate()
+
+
+def listen_catalog_events():
+    """Boucle d'écoute des événements produit.* (file exclusive propre à cette instance)"""
+    while True:
+        try:
+            connection = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
+            channel = connection.channel()
+            channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type='topic', durable=True)
+            queue = channel.queue_declare(queue='', exclusive=True, auto_delete=True).method.queue
+            for routing_key in ("produit.created", "produit.updated", "produit.deleted"):
+                channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue, routing_key=routing_key)
+            channel.basic_consume(queue=queue, on_message_callback=callback_produit_event, auto_ack=True)
+            # Des événements ont pu être manqués pendant la déconnexion : on repart de la base
+            catalog.invalidate()
+            channel.start_consuming()
+        except Exception as e:
+            logger.error(f"Écoute du catalogue interrompue: {e}")
+            time.sleep(5)
+
+
+def start_catalog_listener():
+    if CATALOG_SYNC_EVENTS:
+        threading.Thread(target=listen_catalog_events, name="catalog-events", daemon=True).start()
@@ -1,3 +1,4 @@
+from sqlalchemy import case, column, func, literal_column, or_, select, tuple_, update, values
 from sqlalchemy.orm import Session
 from . import models, schemas
 
@@ -16,9 +17,76 @@ def get_produit(db: Session, produit_id: int):
     return db.query(models.Produit).filter(models.Produit.id == produit_id).first()
 
 
-# READ - Recuperer la liste de tous les produits
-def get_produits(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Produit).offset(skip).limit(limit).all()
+# READ - Recuperer plusieurs produits en une seule requete, indexes par ID
+def get_produits_by_ids(db: Session, produit_ids):
+    produits = db.query(models.Produit).filter(models.Produit.id.in_(list(set(produit_ids)))).all()
+    return {p.id: p for p in produits}
+
+
+# Colonnes autorisees pour le tri de la liste des produits
+SORT_COLUMNS = {
+    "id": models.Produit.id,
+    "prix": models.Produit.prix,
+    "nom": models.Produit.nom,
+    "date_creation": models.Produit.date_creation,
+}
+
+
+# READ - Recuperer la liste des produits, filtree et triee
+# "after" = (valeur de tri, id) du dernier produit de la page precedente : pagination par curseur
+def get_produits(db: Session, skip: int = 0, limit: int = 100, actif=None, origine=None,
+                 prix_min=None, prix_max=None, en_stock=None, sort: str = "id", order: str = "asc",
+                 after=None):
+    query = db.query(models.Produit)
+    if actif is not None:
+        query = query.filter(models.Produit.actif == actif)
+    if origine is not None:
+        query = query.filter(models.Produit.origine == origine)
+    if prix_min is not None:
+        query = query.filter(models.Produit.prix >= prix_min)
+    if prix_max is not None:
+        query = query.filter(models.Produit.prix <= prix_max)
+    if en_stock is not None:
+        query = query.filter(models.Produit.stock > 0 if en_stock else models.Produit.stock <= 0)
+
+    # Tri sur (colonne, id) : l'id departage les egalites et rend l'ordre stable entre deux appels
+    keys = [SORT_COLUMNS[sort]] if sort == "id" else [SORT_COLUMNS[sort], models.Produit.id]
+    query = query.order_by(*(k.asc() if order == "asc" else k.desc() for k in keys))
+    if after is not None:
+        key, bound = tuple_(*keys), tuple_(*after[:len(keys)])
+        query = query.filter(key > bound if order == "asc" else key < bound)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+# READ - Parcourir tout le catalogue (export), lu par paquets de batch_size via un curseur cote serveur
+def iter_produits(db: Session, actif=None, batch_size: int = 1000):
+    stmt = select(models.Produit).order_by(models.Produit.id).execution_options(yield_per=batch_size)
+    if actif is not None:
+        stmt = stmt.where(models.Produit.actif == actif)
+    return db.scalars(stmt)
+
+
+# READ - Recherche plein texte dans le nom et la description, les plus pertinents d'abord
+# PostgreSQL : colonne tsvector generee + index GIN, classement ts_rank_cd ; ailleurs : LIKE sans index
+def search_produits(db: Session, q: str, limit: int = 20, actif=None):
+    query = db.query(models.Produit)
+    if actif is not None:
+        query = query.filter(models.Produit.actif == actif)
+
+    if db.get_bind().dialect.name == "postgresql":
+        recherche = literal_column("produits.recherche")
+        tsquery = func.websearch_to_tsquery("french", q)
+        query = query.filter(recherche.op("@@")(tsquery)).order_by(func.ts_rank_cd(recherche, tsquery).desc())
+    else:
+        pattern = "%" + q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        nom_match = func.lower(models.Produit.nom).like(pattern, escape="\\")
+        query = query.filter(or_(
+            nom_match,
+            func.lower(models.Produit.description).like(pattern, escape="\\")
+        )).order_by(case((nom_match, 0), else_=1))
+    return query.order_by(models.Produit.id).limit(limit).all()
 
 
 # UPDATE - Modifier un produit existant
@@ -34,17 +102,188 @@ def update_produit(db: Session, produit_id: int, produit: schemas.ProduitUpdate)
     return db_produit
 
 
+def _update_from_values(champs, lignes):
+    """UPDATE produits SET ... FROM (VALUES ...) : une seule requete pour tout un groupe de lignes"""
+    colonnes = [models.Produit.__table__.c[nom] for nom in ("id", *champs)]
+    maj = values(*(column(c.name, c.type) for c in colonnes), name="maj").data(
+        [tuple(ligne[c.name] for c in colonnes) for ligne in lignes]
+    )
+    return (
+        update(models.Produit)
+        .where(models.Produit.id == maj.c.id)
+        .values({champ: maj.c[champ] for champ in champs})
+        .execution_options(synchronize_session=False)
+    )
+
+
+# UPDATE BULK - Appliquer une liste de modifications partielles dans une seule transaction
+# Les lignes sont regroupees par ensemble de champs modifies : une requete par groupe
+# (UPDATE ... FROM (VALUES ...) sous PostgreSQL, executemany ailleurs) au lieu d'une par produit
+# Retourne (produits modifies, ids inconnus)
+def bulk_update_produits(db: Session, modifications):
+    changements = {}
+    for modification in modifications:
+        # Un meme produit present plusieurs fois : les champs sont fusionnes, le dernier l'emporte
+        changements.setdefault(modification.id, {}).update(
+            modification.model_dump(exclude_unset=True, exclude={"id"})
+        )
+    existants = set(db.scalars(select(models.Produit.id).where(models.Produit.id.in_(list(changements)))))
+    inconnus = [produit_id for produit_id in changements if produit_id not in existants]
+
+    groupes = {}
+    for produit_id, champs in changements.items():
+        if produit_id in existants and champs:
+            groupes.setdefault(tuple(sorted(champs)), []).append({"id": produit_id, **champs})
+
+    postgres = db.get_bind().dialect.name == "postgresql"
+    for champs, lignes in groupes.items():
+        if postgres:
+            db.execute(_update_from_values(champs, lignes))
+        else:
+            db.execute(update(models.Produit), lignes)
+    db.commit()
+
+    produits = (
+        db.query(models.Produit)
+        .filter(models.Produit.id.in_(list(existants)))
+        .order_by(models.Produit.id)
+        .populate_existing()
+        .all()
+    )
+    return produits, inconnus
+
+
 # UPDATE IMAGE - Enregistrer l'URL de l'image d'un produit
 def update_produit_image(db: Session, produit_id: int, image_url: str):
     db_produit = get_produit(db, produit_id)
     if not db_produit:
         return None
     db_produit.image_url = image_url
+    # Les declinaisons de l'ancienne image ne sont plus valables (regenerees en arriere-plan)
+    db_produit.image_variantes = None
     db.commit()
     db.refresh(db_produit)
     return db_produit
 
 
+# Regroupe les lignes par produit (un meme produit peut apparaitre plusieurs fois)
+def _quantites_par_produit(lignes):
+    quantites = {}
+    for ligne in lignes:
+        quantites[ligne.produit_id] = quantites.get(ligne.produit_id, 0) + ligne.quantite
+    return dict(sorted(quantites.items()))
+
+
+# UPDATE STOCK - Reserver le stock de plusieurs produits, tout ou rien
+# RETURNING des colonnes plutot que des entites : des lignes en lecture seule que le commit n'expire pas,
+# donc pas de SELECT de rechargement par produit (evenement, catalogue, reponse)
+# Un seul UPDATE conditionnel (stock >= quantite) : sous PostgreSQL, un checkout concurrent sur le meme
+# produit attend le verrou de ligne puis re-evalue la condition, sans survente possible
+def reserver_stock(db: Session, lignes):
+    quantites = _quantites_par_produit(lignes)
+    quantite = case(quantites, value=models.Produit.id)
+    stmt = (
+        update(models.Produit)
+        .where(
+            models.Produit.id.in_(list(quantites)),
+            models.Produit.actif.is_(True),
+            models.Produit.stock >= quantite
+        )
+        .values(stock=models.Produit.stock - quantite)
+        .returning(*models.Produit.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    produits = db.execute(stmt).all()
+    if len(produits) != len(quantites):
+        db.rollback()
+        reserves = {p.id for p in produits}
+        return None, [produit_id for produit_id in quantites if produit_id not in reserves]
+    db.commit()
+    return produits, []
+
+
+# UPDATE STOCK - Liberer du stock reserve (commande annulee, panier expire...)
+# Les produits inconnus sont ignores et renvoyes a part
+def liberer_stock(db: Session, lignes):
+    quantites = _quantites_par_produit(lignes)
+    quantite = case(quantites, value=models.Produit.id)
+    stmt = (
+        update(models.Produit)
+        .where(models.Produit.id.in_(list(quantites)))
+        .values(stock=models.Produit.stock + quantite)
+        .returning(*models.Produit.__table__.columns)
+        .execution_options(synchronize_session=False)
+    )
+    produits = db.execute(stmt).all()
+    db.commit()
+    liberes = {p.id for p in produits}
+    return produits, [produit_id for produit_id in quantites if produit_id not in liberes]
+
+
+# READ - Produits actifs passes sous leur seuil d'alerte et pas encore signales
+# Verrouilles pour la duree du balayage : deux instances de l'API n'envoient pas la meme alerte
+def get_produits_stock_bas_a_signaler(db: Session):
+    return (
+        db.query(models.Produit)
+        .filter(
+            models.Produit.stock < models.Produit.seuil_alerte,
+            models.Produit.actif.is_(True),
+            models.Produit.alerte_stock_envoyee.is_(False)
+        )
+        .order_by(models.Produit.id)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+# UPDATE ALERTES - Marquer les produits dont l'alerte stock bas vient d'etre envoyee
+def marquer_alertes_stock(db: Session, produit_ids: list):
+    db.execute(
+        update(models.Produit)
+        .where(models.Produit.id.in_(produit_ids))
+        .values(alerte_stock_envoyee=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# UPDATE ALERTES - Rearmer l'alerte des produits revenus au-dessus de leur seuil
+def rearmer_alertes_stock(db: Session) -> int:
+    result = db.execute(
+        update(models.Produit)
+        .where(
+            models.Produit.alerte_stock_envoyee.is_(True),
+            models.Produit.stock >= models.Produit.seuil_alerte
+        )
+        .values(alerte_stock_envoyee=False)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+# UPDATE IMAGE - Enregistrer les declinaisons (miniatures) generees pour l'image d'un produit
+# Ignore si une autre image a ete uploadee entre-temps
+def update_produit_variantes(db: Session, produit_id: int, image_url: str, variantes: dict):
+    db_produit = get_produit(db, produit_id)
+    if not db_produit or db_produit.image_url != image_url:
+        return None
+    db_produit.image_variantes = variantes
+    db.commit()
+    db.refresh(db_produit)
+    return db_produit
+
+
+# READ - URLs de toutes les images encore referencees (image principale et declinaisons)
+def get_image_urls(db: Session) -> set:
+    urls = set()
+    rows = db.query(models.Produit.image_url, models.Produit.image_variantes).filter(
+        models.Produit.image_url.isnot(None)
+    )
+    for image_url, variantes in rows:
+        urls.add(image_url)
+        urls.update((variantes or {}).values())
+    return urls
+
+
 # DELETE - Supprimer un produit
 def delete_produit(db: Session, produit_id: int):
     db_produit = get_produit(db, produit_id)
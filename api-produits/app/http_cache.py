@@ -0,0 +1,57 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request, Response
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite renvoie des dates naïves : on les considère comme UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def make_etag(*parts) -> str:
+    """ETag faible calculé à partir d'un marqueur de version (id, date de modification...)"""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def content_etag(body: bytes) -> str:
+    """ETag faible calculé sur le corps servi : identique d'un processus ou d'un redémarrage à l'autre"""
+    return f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def not_modified(request: Request, response: Response, etag: str,
+                 last_modified: Optional[datetime] = None) -> Optional[Response]:
+    """Pose ETag / Last-Modified sur la réponse.
+    Retourne une réponse 304 si le client possède déjà cette version, None sinon."""
+    response.headers["ETag"] = etag
+    # no-cache : le navigateur garde la réponse mais revalide à chaque fois (réponse 304 sans corps)
+    response.headers["Cache-Control"] = "no-cache"
+    if last_modified is not None:
+        last_modified = _as_utc(last_modified)
+        response.headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    fresh = False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, etag)
+    elif last_modified is not None and "if-modified-since" in request.headers:
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"])
+            fresh = last_modified.replace(microsecond=0) <= since
+        except (TypeError, ValueError):
+            fresh = False
+
+    if fresh:
+        return Response(status_code=304, headers=dict(response.headers))
+    return None
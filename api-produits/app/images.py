@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+import time
+from typing import Optional
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
+# Taille maximale d'une image uploadee (5 Mo par defaut)
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", str(5 * 1024 * 1024)))
+IMAGE_TOO_LARGE = f"Image trop volumineuse (maximum {MAX_IMAGE_SIZE // (1024 * 1024)} Mo)"
+CHUNK_SIZE = 64 * 1024
+
+# Format reel de l'image -> extensions acceptees pour ce format
+EXTENSIONS_BY_FORMAT = {
+    "jpeg": {"jpg", "jpeg"},
+    "png": {"png"},
+    "webp": {"webp"},
+}
+# Extension du fichier stocke pour chaque format
+CANONICAL_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+# Age minimum (en secondes) d'un fichier non reference avant sa suppression par le ramasse-miettes
+UPLOAD_GC_GRACE = int(os.getenv("UPLOAD_GC_GRACE", "3600"))
+
+
+class ImageTooLarge(Exception):
+    """L'image depasse MAX_IMAGE_SIZE"""
+
+
+class InvalidImage(Exception):
+    """Le contenu du fichier ne correspond pas a une image du format annonce"""
+
+
+def detect_format(head: bytes) -> Optional[str]:
+    """Reconnait le format d'une image a partir de ses premiers octets (magic bytes)"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _store(tmp_path: str, filename: str):
+    """Installe le fichier temporaire sous son nom final, sauf si ce contenu est deja stocke"""
+    path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.exists(path):
+        # Meme contenu deja present (re-upload, autre produit) : on garde un seul exemplaire
+        _remove_quietly(tmp_path)
+        # Le fichier est de nouveau reference : le ramasse-miettes ne doit pas le supprimer
+        os.utime(path)
+    else:
+        # Le fichier final n'est jamais visible a moitie ecrit
+        os.replace(tmp_path, path)
+
+
+async def save_upload(file: UploadFile, ext: str):
+    """Ecrit l'upload par morceaux dans un fichier temporaire, puis le renomme atomiquement.
+
+    Les ecritures disque se font dans le threadpool : l'event loop n'est jamais bloquee.
+    Le fichier est nomme d'apres l'empreinte SHA-256 de son contenu, calculee au fil de
+    l'ecriture : un meme contenu n'est stocke qu'une fois et son URL ne change jamais.
+    Retourne (nom du fichier, empreinte).
+    """
+    fd, tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=UPLOAD_DIR, suffix=".part")
+    out = os.fdopen(fd, "wb")
+    try:
+        size = 0
+        image_format = None
+        digest = hashlib.sha256()
+        while chunk := await file.read(CHUNK_SIZE):
+            if size == 0:
+                image_format = detect_format(chunk)
+                if ext not in EXTENSIONS_BY_FORMAT.get(image_format, set()):
+                    raise InvalidImage()
+            size += len(chunk)
+            if size > MAX_IMAGE_SIZE:
+                raise ImageTooLarge()
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+        if size == 0:
+            raise InvalidImage()
+        await run_in_threadpool(out.close)
+        hexdigest = digest.hexdigest()
+        filename = f"{hexdigest[:32]}.{CANONICAL_EXTENSIONS[image_format]}"
+        await run_in_threadpool(_store, tmp_path, filename)
+        return filename, hexdigest
+    except BaseException:
+        out.close()
+        await run_in_threadpool(_remove_quietly, tmp_path)
+        raise
+
+
+def collect_orphans(referenced_urls: set, grace: int = UPLOAD_GC_GRACE) -> int:
+    """Supprime les fichiers de UPLOAD_DIR (et des declinaisons) qui ne sont plus references.
+
+    Remplace le nettoyage fait a chaque upload : une image peut etre partagee entre plusieurs
+    produits, on ne peut la supprimer qu'une fois plus aucun produit ne la reference.
+    Les fichiers recents (upload en cours, miniatures pas encore enregistrees) sont epargnes.
+    Retourne le nombre de fichiers supprimes.
+    """
+    limit = time.time() - grace
+    removed = 0
+    for directory, url_prefix in ((UPLOAD_DIR, "/uploads/"), (os.path.join(UPLOAD_DIR, "derivees"), "/uploads/derivees/")):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if not entry.is_file() or url_prefix + entry.name in referenced_urls:
+                continue
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
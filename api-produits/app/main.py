@@ -1,11 +1,21 @@
+import asyncio
+import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from .database import engine, Base
+from .database import SessionLocal
 from .routes import router
+from .catalog import start_catalog_listener
+from .static_files import UploadStaticFiles
+from .upload_limit import UploadSizeLimitMiddleware
+from . import crud, images, migrations, stock_alerts, thumbnails
 
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+# Tables, colonnes et index manquants (bases existantes comprises)
+migrations.upgrade()
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -14,20 +24,70 @@ ALLOWED_ORIGINS = os.getenv(
     "ALLOWED_ORIGINS",
     "http://localhost:3000,http://localhost:4321"
 ).split(",")
+# Intervalle (en secondes) entre deux passages du ramasse-miettes des images ; 0 pour le desactiver
+UPLOAD_GC_INTERVAL = int(os.getenv("UPLOAD_GC_INTERVAL", "3600"))
+
+
+def collect_upload_orphans() -> int:
+    """Supprime les images qui ne sont plus referencees par aucun produit"""
+    db = SessionLocal()
+    try:
+        referenced = crud.get_image_urls(db)
+    finally:
+        db.close()
+    removed = images.collect_orphans(referenced)
+    if removed:
+        logger.info(f"{removed} image(s) orpheline(s) supprimee(s)")
+    return removed
+
+
+async def run_periodically(interval: int, job, description: str):
+    """Execute une tache bloquante a intervalle regulier, dans le threadpool"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(job)
+        except Exception as e:
+            logger.error(f"Erreur {description}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Garde le catalogue en mémoire synchronisé avec les événements produit.* des autres instances
+    start_catalog_listener()
+    tasks = []
+    if UPLOAD_GC_INTERVAL > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(UPLOAD_GC_INTERVAL, collect_upload_orphans, "ramasse-miettes des images")
+        ))
+    if stock_alerts.STOCK_ALERT_INTERVAL > 0:
+        tasks.append(asyncio.create_task(
+            run_periodically(stock_alerts.STOCK_ALERT_INTERVAL, stock_alerts.run_sweep, "alertes stock bas")
+        ))
+    yield
+    for task in tasks:
+        task.cancel()
+    thumbnails.shutdown()
+
 
 app = FastAPI(
     title="PayeTonKawa - API Produits",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
+# Uploads trop gros refuses avant la lecture du corps (ajoute avant CORS : la 413 porte les en-tetes CORS)
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor"],
 )
 app.include_router(router)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Images adressees par contenu : cache immuable, ETag fort, requetes Range
+app.mount("/uploads", UploadStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 @app.get("/")
 def root():
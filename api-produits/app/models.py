@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, Text, Index, JSON, DDL, event
+from sqlalchemy.sql import false, func
+from datetime import datetime, timezone
 from .database import Base
 
 
@@ -11,9 +12,54 @@ class Produit(Base):
     description = Column(Text, nullable=True)
     prix = Column(Float, nullable=False)
     stock = Column(Integer, default=0, nullable=False)
+    # Seuil d'alerte stock bas, propre a chaque produit
+    seuil_alerte = Column(Integer, default=10, server_default="10", nullable=False)
+    # Alerte deja envoyee pour le passage sous le seuil en cours (rearmee quand le stock remonte)
+    alerte_stock_envoyee = Column(Boolean, default=False, server_default=false(), nullable=False)
     origine = Column(String(100), nullable=True)
     poids_kg = Column(Float, default=1.0)
     image_url = Column(String(500), nullable=True)
+    # URLs des declinaisons WebP de l'image : {"thumbnail": ..., "card": ..., "detail": ...}
+    image_variantes = Column(JSON, nullable=True)
     actif = Column(Boolean, default=True)
-    date_creation = Column(DateTime(timezone=True), server_default=func.now())
-    date_modification = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    # Valeur aussi fixée côté Python : même précision (microsecondes) que les curseurs de pagination
+    date_creation = Column(DateTime(timezone=True), server_default=func.now(), default=lambda: datetime.now(timezone.utc))
+    date_modification = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Index du catalogue : filtre sur actif puis tri (+ id pour la pagination par curseur)
+Index("ix_produits_actif_prix", Produit.actif, Produit.prix, Produit.id)
+Index("ix_produits_actif_nom", Produit.actif, Produit.nom, Produit.id)
+Index("ix_produits_actif_date_creation", Produit.actif, Produit.date_creation, Produit.id)
+Index("ix_produits_origine_prix", Produit.origine, Produit.prix)
+# Index partiel : produits vendables (actifs et en stock), le cas le plus fréquent côté boutique
+Index(
+    "ix_produits_vendables_prix", Produit.prix, Produit.id,
+    postgresql_where=(Produit.actif.is_(True)) & (Produit.stock > 0),
+    sqlite_where=(Produit.actif.is_(True)) & (Produit.stock > 0),
+)
+# Index partiels du balayage des alertes de stock : seuls les produits concernes y figurent
+Index(
+    "ix_produits_stock_bas", Produit.id,
+    postgresql_where=Produit.stock < Produit.seuil_alerte,
+    sqlite_where=Produit.stock < Produit.seuil_alerte,
+)
+Index(
+    "ix_produits_alerte_stock_envoyee", Produit.id,
+    postgresql_where=Produit.alerte_stock_envoyee.is_(True),
+    sqlite_where=Produit.alerte_stock_envoyee.is_(True),
+)
+
+# Recherche plein texte (GET /products/search), PostgreSQL uniquement : colonne tsvector générée
+# (nom prioritaire sur la description) et index GIN. Colonne absente du modèle : elle n'est jamais écrite.
+# Idempotent : également rejoué par migrations.upgrade sur les bases existantes.
+RECHERCHE_COLUMN_DDL = DDL(
+    "ALTER TABLE produits ADD COLUMN IF NOT EXISTS recherche tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('french', coalesce(nom, '')), 'A') || "
+    "setweight(to_tsvector('french', coalesce(description, '')), 'B')"
+    ") STORED"
+).execute_if(dialect="postgresql")
+RECHERCHE_INDEX_DDL = DDL(
+    "CREATE INDEX IF NOT EXISTS ix_produits_recherche ON produits USING gin (recherche)"
+).execute_if(dialect="postgresql")
+event.listen(Produit.__table__, "after_create", RECHERCHE_COLUMN_DDL)
+event.listen(Produit.__table__, "after_create", RECHERCHE_INDEX_DDL)
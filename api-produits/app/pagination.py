@@ -0,0 +1,24 @@
+import base64
+import json
+from datetime import datetime
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou falsifié"""
+
+
+# Le curseur est opaque pour le front : base64 d'un JSON ([tri, ordre, valeur de tri, id] pour /products)
+def encode_cursor(*values) -> str:
+    payload = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError as e:
+        raise InvalidCursor(str(e)) from e
+    if not isinstance(values, list) or not values:
+        raise InvalidCursor("liste de valeurs attendue")
+    return values
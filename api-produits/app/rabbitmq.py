@@ -72,6 +72,16 @@ def publish_produit_updated(produit_id: int, produit_data: dict):
     })
 
 
+def publish_produits_updated(produits: list):
+    """Publie un seul événement de modification pour tout un lot de produits"""
+    publish_message("produit.updated", {
+        "event": "produit_updated",
+        "batch": True,
+        "produits": produits,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
+
 def publish_produit_deleted(produit_id: int):
     """Publie un événement de suppression de produit"""
     publish_message("produit.deleted", {
@@ -81,13 +91,11 @@ def publish_produit_deleted(produit_id: int):
     })
 
 
-def publish_produit_stock_low(produit_id: int, produit_nom: str, stock: int):
-    """Alerte quand le stock est bas (< 10 unités)"""
-    publish_message("produit.stock_low", {
+def publish_produits_stock_low(produits: list):
+    """Alerte stock bas : un seul message recapitulatif pour tous les produits passes sous leur seuil"""
+    return publish_message("produit.stock_low", {
         "event": "produit_stock_low",
-        "produit_id": produit_id,
-        "produit_nom": produit_nom,
-        "stock_actuel": stock,
-        "seuil_alerte": 10,
+        "batch": True,
+        "produits": produits,
         "timestamp": datetime.now(timezone.utc).isoformat()
     })
@@ -1,15 +1,16 @@
 import os
-import glob
-import shutil
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
-from . import crud, schemas, rabbitmq
+from typing import List, Literal, Optional
+from . import crud, schemas, rabbitmq, images, thumbnails
+from .catalog import catalog
 from .database import get_db
 from .auth import verify_api_key
-
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
-ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
+from .export import EXPORT_BATCH_SIZE, export_response
+from .http_cache import make_etag, not_modified
+from .pagination import encode_cursor, decode_cursor, InvalidCursor
 
 router = APIRouter(
     prefix="/products",
@@ -25,24 +26,209 @@ def create_product(produit: schemas.ProduitCreate, db: Session = Depends(get_db)
     rabbitmq.publish_produit_created(db_produit.id, {
         "nom": db_produit.nom,
         "prix": db_produit.prix,
-        "stock": db_produit.stock
+        "stock": db_produit.stock,
+        "actif": db_produit.actif
     })
+    catalog.upsert(db_produit)
     return db_produit
 
 
-# GET /products : Lister tous les produits
+def _cursor_value(sort: str, value):
+    """Valeur de tri lue dans un curseur, du type de la colonne de tri (ValueError sinon)"""
+    if sort == "date_creation":
+        if not isinstance(value, str):
+            raise ValueError("date attendue")
+        return datetime.fromisoformat(value)
+    expected = str if sort == "nom" else (int, float) if sort == "prix" else int
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise ValueError(f"valeur de tri invalide pour {sort}")
+    return value
+
+
+# Curseur [tri, ordre, valeur de tri, id] : un curseur obtenu avec un autre tri est refuse (400)
+# plutot que de comparer la colonne a une valeur d'un autre type
+def _decode_cursor(cursor: Optional[str], sort: str, order: str):
+    if not cursor:
+        return None
+    try:
+        values = decode_cursor(cursor)
+        if len(values) != 4 or values[:2] != [sort, order]:
+            raise InvalidCursor("curseur d'un autre tri")
+        return [_cursor_value(sort, values[2]), _cursor_value("id", values[3])]
+    except (InvalidCursor, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
+
+# GET /products : Lister les produits (filtres, tri et pagination par curseur)
+# Le curseur de la page suivante est renvoyé dans le header X-Next-Cursor (absent sur la dernière page)
 @router.get("/", response_model=List[schemas.ProduitResponse])
-def read_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_produits(db, skip=skip, limit=limit)
+def read_products(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    actif: Optional[bool] = None,
+    origine: Optional[str] = None,
+    prix_min: Optional[float] = Query(None, ge=0),
+    prix_max: Optional[float] = Query(None, ge=0),
+    en_stock: Optional[bool] = None,
+    sort: Literal["id", "prix", "nom", "date_creation"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    # Catalogue de la boutique (produits actifs, ordre par défaut) : servi depuis la copie en mémoire
+    filtered = any(v is not None for v in (origine, prix_min, prix_max, en_stock, cursor))
+    if actif and not filtered and sort == "id" and order == "asc":
+        body, etag = catalog.page(db, skip=skip, limit=limit)
+        return not_modified(request, response, etag) or Response(
+            content=body, media_type="application/json", headers=dict(response.headers)
+        )
+
+    after = _decode_cursor(cursor, sort, order)
+
+    # On lit une ligne de plus pour savoir s'il existe une page suivante
+    produits = crud.get_produits(
+        db, skip=skip, limit=limit + 1, actif=actif, origine=origine, prix_min=prix_min,
+        prix_max=prix_max, en_stock=en_stock, sort=sort, order=order, after=after
+    )
+    if len(produits) > limit:
+        produits = produits[:limit]
+        last = produits[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(sort, order, getattr(last, sort), last.id)
+
+    etag = make_etag([(p.id, p.date_modification) for p in produits])
+    last_modified = max((p.date_modification for p in produits), default=None)
+    return not_modified(request, response, etag, last_modified) or produits
+
+
+# Colonnes de l'export CSV (les declinaisons d'image n'y figurent pas)
+EXPORT_CSV_FIELDS = [
+    "id", "nom", "description", "prix", "stock", "seuil_alerte", "origine", "poids_kg",
+    "image_url", "actif", "date_creation", "date_modification"
+]
+
+
+def _export_records(bind, actif: Optional[bool]):
+    # Session propre a l'export : celle de la requete est fermee avant la fin du streaming
+    with Session(bind=bind) as db:
+        for produit in crud.iter_produits(db, actif=actif, batch_size=EXPORT_BATCH_SIZE):
+            yield schemas.ProduitResponse.model_validate(produit).model_dump(mode="json")
+
+
+# GET /products/export : Exporter tout le catalogue (NDJSON ou CSV), en streaming
+@router.get("/export")
+def export_products(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    actif: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    return export_response(_export_records(db.get_bind(), actif), export_format, EXPORT_CSV_FIELDS, "produits")
+
+
+# GET /products/search : Recherche plein texte dans le nom et la description (les plus pertinents d'abord)
+@router.get("/search", response_model=List[schemas.ProduitResponse])
+def search_products(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(20, ge=1, le=100),
+    actif: Optional[bool] = None,
+    db: Session = Depends(get_db)
+):
+    return crud.search_produits(db, q=q.strip(), limit=limit, actif=actif)
+
+
+# GET /products/suggest : Autocompletion sur le nom des produits actifs, servie depuis la memoire
+@router.get("/suggest", response_model=List[schemas.ProduitSuggestion])
+def suggest_products(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    return catalog.suggest(db, prefix, limit)
+
+
+# POST /products/quote : Chiffrer un panier (prix et stock actuels de tous les produits en une requete)
+# Un produit present sur plusieurs lignes doit avoir assez de stock pour la quantite totale
+@router.post("/quote", response_model=schemas.DevisResponse)
+def quote_products(demande: schemas.DevisRequest, db: Session = Depends(get_db)):
+    produits = crud.get_produits_by_ids(db, [ligne.produit_id for ligne in demande.lignes])
+    quantites = {}
+    for ligne in demande.lignes:
+        quantites[ligne.produit_id] = quantites.get(ligne.produit_id, 0) + ligne.quantite
+
+    lignes = []
+    for ligne in demande.lignes:
+        produit = produits.get(ligne.produit_id)
+        if produit is None:
+            lignes.append({"produit_id": ligne.produit_id, "quantite": ligne.quantite, "disponible": False})
+            continue
+        lignes.append({
+            "produit_id": produit.id,
+            "quantite": ligne.quantite,
+            "nom": produit.nom,
+            "prix_unitaire": produit.prix,
+            "stock": produit.stock,
+            "disponible": bool(produit.actif) and produit.stock >= quantites[produit.id],
+            "total_ligne": round(produit.prix * ligne.quantite, 2)
+        })
+    return {
+        "lignes": lignes,
+        "total": round(sum(ligne["total_ligne"] for ligne in lignes if ligne["disponible"]), 2),
+        "disponible": all(ligne["disponible"] for ligne in lignes)
+    }
+
+
+def _publish_stock(produits):
+    rabbitmq.publish_produits_updated([
+        {"produit_id": p.id, "nom": p.nom, "prix": p.prix, "stock": p.stock, "actif": p.actif}
+        for p in produits
+    ])
+    catalog.upsert_many(produits)
+
+
+# PATCH /products/bulk : Modifier un lot de produits (synchronisation fournisseur : prix, stock...)
+# Une seule transaction et un seul evenement produit.updated pour tout le lot
+@router.patch("/bulk", response_model=schemas.ProduitBulkResponse)
+def bulk_update_products(demande: schemas.ProduitBulkRequest, db: Session = Depends(get_db)):
+    produits, inconnus = crud.bulk_update_produits(db, demande.produits)
+    if produits:
+        _publish_stock(produits)
+    return {"mis_a_jour": len(produits), "inconnus": inconnus}
+
+
+# POST /products/stock/reserve : Reserver le stock de plusieurs produits (tout ou rien)
+@router.post("/stock/reserve", response_model=schemas.StockResponse)
+def reserve_stock(demande: schemas.StockRequest, db: Session = Depends(get_db)):
+    produits, indisponibles = crud.reserver_stock(db, demande.lignes)
+    if produits is None:
+        raise HTTPException(status_code=409, detail={
+            "message": "Stock insuffisant ou produit indisponible",
+            "produits": indisponibles
+        })
+    _publish_stock(produits)
+    return {"produits": [{"produit_id": p.id, "stock": p.stock} for p in produits]}
+
+
+# POST /products/stock/release : Liberer du stock precedemment reserve
+@router.post("/stock/release", response_model=schemas.StockResponse)
+def release_stock(demande: schemas.StockRequest, db: Session = Depends(get_db)):
+    produits, inconnus = crud.liberer_stock(db, demande.lignes)
+    if produits:
+        _publish_stock(produits)
+    return {
+        "produits": [{"produit_id": p.id, "stock": p.stock} for p in produits],
+        "inconnus": inconnus
+    }
 
 
 # GET /products/{id} : Recuperer un produit par son ID
 @router.get("/{produit_id}", response_model=schemas.ProduitResponse)
-def read_product(produit_id: int, db: Session = Depends(get_db)):
+def read_product(produit_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     db_produit = crud.get_produit(db, produit_id=produit_id)
     if db_produit is None:
         raise HTTPException(status_code=404, detail="Produit non trouve")
-    return db_produit
+    etag = make_etag(db_produit.id, db_produit.date_modification)
+    return not_modified(request, response, etag, db_produit.date_modification) or db_produit
 
 
 # PUT /products/{id} : Modifier un produit
@@ -54,10 +240,11 @@ def update_product(produit_id: int, produit: schemas.ProduitUpdate, db: Session
     rabbitmq.publish_produit_updated(db_produit.id, {
         "nom": db_produit.nom,
         "prix": db_produit.prix,
-        "stock": db_produit.stock
+        "stock": db_produit.stock,
+        "actif": db_produit.actif
     })
-    if db_produit.stock < 10:
-        rabbitmq.publish_produit_stock_low(db_produit.id, db_produit.nom, db_produit.stock)
+    catalog.upsert(db_produit)
+    # Les alertes de stock bas sont envoyees par le balayage periodique (stock_alerts)
     return db_produit
 
 
@@ -68,34 +255,39 @@ def delete_product(produit_id: int, db: Session = Depends(get_db)):
     if not success:
         raise HTTPException(status_code=404, detail="Produit non trouve")
     rabbitmq.publish_produit_deleted(produit_id)
+    catalog.remove(produit_id)
 
 
 # POST /products/{id}/image : Uploader une image pour un produit
+# Tout le travail bloquant (disque, base) passe par le threadpool pour ne pas figer les autres requetes
 @router.post("/{produit_id}/image", response_model=schemas.ProduitResponse)
 async def upload_product_image(
     produit_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    db_produit = crud.get_produit(db, produit_id=produit_id)
+    db_produit = await run_in_threadpool(crud.get_produit, db, produit_id)
     if db_produit is None:
         raise HTTPException(status_code=404, detail="Produit non trouve")
 
     ext = (file.filename or "").rsplit(".", 1)[-1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
+    if ext not in images.ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail="Format invalide. Formats acceptes : jpg, jpeg, png, webp"
         )
 
-    # Supprimer l'ancienne image du produit s'il en a une
-    for old_file in glob.glob(os.path.join(UPLOAD_DIR, f"produit_{produit_id}.*")):
-        os.remove(old_file)
-
-    filename = f"produit_{produit_id}.{ext}"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    with open(filepath, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
+    try:
+        # Nom de fichier = empreinte du contenu : URL immuable, contenu identique stocke une seule fois
+        filename, digest = await images.save_upload(file, ext)
+    except images.InvalidImage:
+        raise HTTPException(status_code=400, detail="Le contenu du fichier n'est pas une image " + ext)
+    except images.ImageTooLarge:
+        raise HTTPException(status_code=413, detail=images.IMAGE_TOO_LARGE)
+    # L'ancienne image n'est pas supprimee ici : le ramasse-miettes de /uploads s'en charge
     image_url = f"/uploads/{filename}"
-    return crud.update_produit_image(db, produit_id=produit_id, image_url=image_url)
\ No newline at end of file
+    db_produit = await run_in_threadpool(crud.update_produit_image, db, produit_id, image_url)
+    catalog.upsert(db_produit)
+    # Miniatures WebP generees en arriere-plan par le pool de processus
+    thumbnails.schedule(produit_id, os.path.join(images.UPLOAD_DIR, filename), digest, image_url)
+    return db_produit
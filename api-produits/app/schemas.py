@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 
@@ -11,6 +11,7 @@ class ProduitCreate(BaseModel):
     stock: int = Field(0, ge=0, description="Le stock doit être >= 0")
     origine: Optional[str] = Field(None, max_length=100)
     poids_kg: float = Field(1.0, gt=0, description="Le poids doit être supérieur à 0")
+    seuil_alerte: int = Field(10, ge=0, description="Alerte quand le stock passe sous ce seuil")
 
 
 # Ce qu'on envoie pour MODIFIER un produit (PUT)
@@ -21,9 +22,24 @@ class ProduitUpdate(BaseModel):
     stock: Optional[int] = Field(None, ge=0)
     origine: Optional[str] = Field(None, max_length=100)
     poids_kg: Optional[float] = Field(None, gt=0)
+    seuil_alerte: Optional[int] = Field(None, ge=0)
     actif: Optional[bool] = None
 
 
+# Une modification dans une mise a jour en masse (PATCH /products/bulk) : seuls les champs fournis changent
+class ProduitBulkUpdate(ProduitUpdate):
+    id: int = Field(..., gt=0)
+
+
+class ProduitBulkRequest(BaseModel):
+    produits: List[ProduitBulkUpdate] = Field(..., min_length=1, max_length=10000)
+
+
+class ProduitBulkResponse(BaseModel):
+    mis_a_jour: int
+    inconnus: List[int] = []
+
+
 # Ce que l'API RENVOIE (la reponse)
 class ProduitResponse(BaseModel):
     id: int
@@ -33,10 +49,66 @@ class ProduitResponse(BaseModel):
     stock: int
     origine: Optional[str]
     poids_kg: float
+    seuil_alerte: int
     image_url: Optional[str] = None
+    image_variantes: Optional[Dict[str, str]] = None
     actif: bool
     date_creation: datetime
     date_modification: datetime
 
     class Config:
         from_attributes = True
+
+
+# Une proposition d'autocompletion (GET /products/suggest)
+class ProduitSuggestion(BaseModel):
+    id: int
+    nom: str
+
+
+# --- STOCK ---
+
+# Une ligne de reservation / liberation de stock
+class StockLigne(BaseModel):
+    produit_id: int = Field(..., gt=0)
+    quantite: int = Field(..., ge=1, description="La quantité doit être >= 1")
+
+
+# Ce qu'on envoie pour RESERVER ou LIBERER du stock (POST /products/stock/...)
+class StockRequest(BaseModel):
+    lignes: List[StockLigne] = Field(..., min_length=1, description="Au moins une ligne requise")
+
+
+# Stock restant d'un produit apres l'operation
+class StockNiveau(BaseModel):
+    produit_id: int
+    stock: int
+
+
+class StockResponse(BaseModel):
+    produits: List[StockNiveau]
+    inconnus: List[int] = []
+
+
+# --- DEVIS (panier) ---
+
+# Ce qu'on envoie pour chiffrer un panier (POST /products/quote)
+class DevisRequest(BaseModel):
+    lignes: List[StockLigne] = Field(..., min_length=1, max_length=200, description="Au moins une ligne requise")
+
+
+# Une ligne du panier chiffree avec le prix et le stock actuels
+class DevisLigne(BaseModel):
+    produit_id: int
+    quantite: int
+    nom: Optional[str] = None
+    prix_unitaire: Optional[float] = None
+    stock: Optional[int] = None
+    disponible: bool
+    total_ligne: float = 0
+
+
+class DevisResponse(BaseModel):
+    lignes: List[DevisLigne]
+    total: float
+    disponible: bool
@@ -0,0 +1,101 @@
+import os
+import re
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+# Nom de fichier construit a partir de l'empreinte du contenu : "<hash>.<ext>" ou "<hash>_<declinaison>.webp"
+CONTENT_ADDRESSED = re.compile(r"^(?P<hash>[0-9a-f]{32})(_[a-z]+)?\.(jpg|png|webp)$")
+# Un fichier dont le nom depend du contenu ne change jamais : cache navigateur / proxy d'un an
+IMMUTABLE = "public, max-age=31536000, immutable"
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(range_header: str, size: int):
+    """Retourne (debut, fin) inclus pour un header "Range: bytes=..." a une seule plage.
+
+    None si la plage n'est pas satisfaisable ; (0, size - 1) si le header n'est pas exploitable
+    (plusieurs plages, autre unite) : on renvoie alors le fichier entier.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return 0, size - 1
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if start == "":
+            # "bytes=-500" : les 500 derniers octets
+            length = int(end)
+            if length == 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return 0, size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _iter_file_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class UploadStaticFiles(StaticFiles):
+    """StaticFiles pour /uploads : ETag fort et cache immuable pour les fichiers adresses par contenu,
+    et support des requetes Range (reprise de telechargement, lecture partielle)."""
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope,
+                      status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["accept-ranges"] = "bytes"
+
+        match = CONTENT_ADDRESSED.match(os.path.basename(full_path))
+        if match:
+            # Le hash du contenu est un ETag fort naturel
+            response.headers["etag"] = f'"{match.group("hash")}"'
+            response.headers["cache-control"] = IMMUTABLE
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if range_header and status_code == 200 and self._if_range_matches(request_headers, response.headers):
+            return self._range_response(str(full_path), stat_result.st_size, range_header, response)
+        return response
+
+    def _if_range_matches(self, request_headers: Headers, response_headers) -> bool:
+        # If-Range : on ne sert une plage que si le client a toujours la meme version du fichier
+        if_range = request_headers.get("if-range")
+        return if_range is None or if_range in (response_headers.get("etag"), response_headers.get("last-modified"))
+
+    def _range_response(self, path: str, size: int, range_header: str, full: FileResponse) -> Response:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"})
+        start, end = byte_range
+        if (start, end) == (0, size - 1):
+            return full
+
+        headers = {
+            key: value for key, value in full.headers.items()
+            if key in ("etag", "last-modified", "cache-control", "accept-ranges")
+        }
+        headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file_range(path, start, end),
+            status_code=206,
+            headers=headers,
+            media_type=full.media_type
+        )
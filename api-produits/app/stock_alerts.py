@@ -0,0 +1,52 @@
+import logging
+import os
+from sqlalchemy.orm import Session
+from . import crud, rabbitmq
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Intervalle (en secondes) entre deux balayages des stocks bas ; 0 pour le desactiver
+STOCK_ALERT_INTERVAL = int(os.getenv("STOCK_ALERT_INTERVAL", "60"))
+
+
+def sweep_low_stock(db: Session) -> int:
+    """Envoie un seul message produit.stock_low pour tous les produits passes sous leur seuil.
+
+    Un produit n'est signale qu'une fois par passage sous le seuil : l'alerte est rearmee
+    quand son stock remonte. Modifier la description d'un produit en stock bas n'envoie donc rien.
+    Retourne le nombre de produits signales.
+    """
+    crud.rearmer_alertes_stock(db)
+    db.commit()
+
+    produits = crud.get_produits_stock_bas_a_signaler(db)
+    if not produits:
+        db.commit()
+        return 0
+    envoye = rabbitmq.publish_produits_stock_low([
+        {
+            "produit_id": p.id,
+            "produit_nom": p.nom,
+            "stock_actuel": p.stock,
+            "seuil_alerte": p.seuil_alerte
+        }
+        for p in produits
+    ])
+    if not envoye:
+        # RabbitMQ indisponible : les produits seront signales au prochain balayage
+        db.rollback()
+        return 0
+    crud.marquer_alertes_stock(db, [p.id for p in produits])
+    db.commit()
+    return len(produits)
+
+
+def run_sweep():
+    db = SessionLocal()
+    try:
+        signales = sweep_low_stock(db)
+        if signales:
+            logger.info(f"Alerte stock bas envoyee pour {signales} produit(s)")
+    finally:
+        db.close()
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from PIL import Image, ImageOps
+from . import crud
+from .catalog import catalog
+from .database import SessionLocal
+from .images import UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+# Declinaisons generees pour chaque image produit : nom -> taille maximale (largeur et hauteur, en px)
+VARIANTS = {
+    "thumbnail": 160,
+    "card": 480,
+    "detail": 1200,
+}
+DERIVED_DIR = os.path.join(UPLOAD_DIR, "derivees")
+# Nombre maximum de processus qui encodent des images en parallele
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+WEBP_QUALITY = 80
+
+_executor = None
+
+
+def generate_variants(source_path: str, digest: str) -> dict:
+    """Genere les declinaisons WebP d'une image (execute dans un processus du pool).
+
+    Les fichiers sont nommes d'apres l'empreinte du contenu source : une image deja traitee
+    (meme contenu, autre produit ou re-upload) n'est pas re-encodee.
+    """
+    with open(source_path, "rb") as f:
+        if hashlib.file_digest(f, "sha256").hexdigest() != digest:
+            raise ValueError("l'image source a ete remplacee entre-temps")
+
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    urls = {}
+    image = None
+    for name, size in VARIANTS.items():
+        filename = f"{digest[:32]}_{name}.webp"
+        path = os.path.join(DERIVED_DIR, filename)
+        if not os.path.exists(path):
+            if image is None:
+                with Image.open(source_path) as source:
+                    image = ImageOps.exif_transpose(source)
+                    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            variant = image.copy()
+            variant.thumbnail((size, size))
+            tmp_path = f"{path}.{os.getpid()}.part"
+            variant.save(tmp_path, "WEBP", quality=WEBP_QUALITY)
+            os.replace(tmp_path, path)
+        urls[name] = f"/uploads/derivees/{filename}"
+    return urls
+
+
+def apply_variants(produit_id: int, image_url: str, variantes: dict):
+    """Enregistre les URLs des declinaisons sur le produit et met a jour le catalogue"""
+    db = SessionLocal()
+    try:
+        db_produit = crud.update_produit_variantes(db, produit_id, image_url, variantes)
+        if db_produit is not None:
+            catalog.upsert(db_produit)
+    finally:
+        db.close()
+
+
+def _on_done(produit_id: int, image_url: str, future):
+    try:
+        variantes = future.result()
+    except Exception as e:
+        logger.error(f"Erreur generation des miniatures du produit {produit_id}: {e}")
+        return
+    apply_variants(produit_id, image_url, variantes)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn plutot que fork : le processus de l'API a deja des threads (threadpool, consumer...)
+        _executor = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def schedule(produit_id: int, source_path: str, digest: str, image_url: str):
+    """Lance la generation des declinaisons en arriere-plan ; la requete d'upload n'attend pas"""
+    future = _get_executor().submit(generate_variants, source_path, digest)
+    future.add_done_callback(partial(_on_done, produit_id, image_url))
+    return future
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,58 @@
+import re
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from . import images
+
+# POST /products/{id}/image
+UPLOAD_PATH = re.compile(r"^/products/\d+/image$")
+# Marge pour l'enveloppe multipart (delimiteurs, en-tetes de la partie, nom du fichier)
+MULTIPART_OVERHEAD = 16 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """Refuse (413) un upload d'image trop gros avant que le corps ne soit lu en entier.
+
+    Starlette lit et met en tampon (memoire puis fichier temporaire) tout le formulaire multipart
+    avant d'appeler la route : la verification de save_upload arrive trop tard.
+    Content-Length annonce trop grand : refus immediat. Sans Content-Length (envoi par morceaux),
+    les octets sont comptes a la reception et la lecture s'arrete des que la limite est depassee.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int = images.MAX_IMAGE_SIZE + MULTIPART_OVERHEAD):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not UPLOAD_PATH.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        too_large = JSONResponse({"detail": images.IMAGE_TOO_LARGE}, status_code=413)
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_size:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size and not rejected:
+                    rejected = True
+                    await too_large(scope, receive, send)
+                    # Pour l'application, le client s'est deconnecte : la lecture du formulaire s'arrete
+                    return {"type": "http.disconnect"}
+            if rejected:
+                return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message):
+            # La reponse 413 est deja partie : celle de l'application (erreur de lecture) est ignoree
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
@@ -1,15 +1,34 @@
+import sys
 import os
+import tempfile
+
+_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _API_DIR)
+
+for _key in list(sys.modules.keys()):
+    if _key == "app" or _key.startswith("app."):
+        del sys.modules[_key]
 
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("API_KEY", "test-key")
+os.environ.setdefault("CATALOG_SYNC_EVENTS", "false")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp())
+os.environ.setdefault("MAX_IMAGE_SIZE", str(256 * 1024))
+os.environ.setdefault("STOCK_ALERT_INTERVAL", "0")
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
 from app.main import app
 from app.database import Base, get_db
+from app.catalog import catalog
+from app import (
+    images as images_module, migrations as migrations_module, stock_alerts as stock_alerts_module,
+    thumbnails as thumbnails_module, upload_limit as upload_limit_module
+)
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 
@@ -33,8 +52,20 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture
+def scheduled_variants(monkeypatch):
+    """Générations de miniatures demandées pendant le test : (produit_id, source, empreinte, image_url).
+
+    Le pool de processus n'est jamais démarré : ses callbacks écriraient par le SessionLocal de l'app,
+    hors de la base de test. generate_variants et apply_variants sont testées directement.
+    """
+    calls = []
+    monkeypatch.setattr(thumbnails_module, "schedule", lambda *args: calls.append(args))
+    return calls
+
+
 @pytest.fixture(scope="function")
-def client(db_session):
+def client(db_session, scheduled_variants):
     """Client HTTP de test branché sur la base SQLite."""
     def override_get_db():
         try:
@@ -43,11 +74,26 @@ def client(db_session):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
-    with TestClient(app) as test_client:
+    # La base est recréée à chaque test : le catalogue en mémoire aussi
+    catalog.invalidate()
+    with TestClient(app, headers={"X-API-Key": "test-key"}) as test_client:
         yield test_client
     app.dependency_overrides.clear()
 
 
+@pytest.fixture
+def queries():
+    """Liste des requêtes SQL exécutées pendant le test (pour compter les allers-retours avec la base)."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 @pytest.fixture
 def sample_produit():
     """Données valides pour créer un produit de test."""
@@ -59,3 +105,39 @@ def sample_produit():
         "origine": "Burkina",
         "poids_kg": 0.25
     }
+
+
+@pytest.fixture
+def thumbnails():
+    """Module des miniatures de l'API Produits (le paquet 'app' importé en cours de test peut être celui d'une autre API)."""
+    return thumbnails_module
+
+
+@pytest.fixture
+def images():
+    """Module de stockage des images de l'API Produits."""
+    return images_module
+
+
+@pytest.fixture
+def stock_alerts():
+    """Module des alertes de stock bas de l'API Produits."""
+    return stock_alerts_module
+
+
+@pytest.fixture
+def catalog_snapshot():
+    """Catalogue en mémoire de l'API Produits."""
+    return catalog
+
+
+@pytest.fixture
+def migrations():
+    """Module de mise a niveau du schema de l'API Produits."""
+    return migrations_module
+
+
+@pytest.fixture
+def upload_limit():
+    """Module de limitation de la taille des uploads de l'API Produits."""
+    return upload_limit_module
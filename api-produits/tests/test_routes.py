@@ -1,4 +1,15 @@
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
 import pytest
+from PIL import Image
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 
 
 class TestRootEndpoint:
@@ -94,6 +105,150 @@ class TestReadProducts:
         assert len(response.json()) == 2
 
 
+class TestFilterProducts:
+    """Tests pour les filtres, le tri et le curseur de GET /products/"""
+
+    @pytest.fixture
+    def catalogue(self, client):
+        produits = [
+            {"nom": "Café Kenya", "prix": 14.00, "stock": 5, "origine": "Kenya"},
+            {"nom": "Café Brasil", "prix": 8.99, "stock": 0, "origine": "Brasil"},
+            {"nom": "Café Colombie", "prix": 10.00, "stock": 20, "origine": "Colombie"},
+            {"nom": "Café Ethiopie", "prix": 16.50, "stock": 3, "origine": "Kenya"},
+        ]
+        return [client.post("/products/", json=p).json() for p in produits]
+
+    def test_filter_origine_et_prix(self, client, catalogue):
+        """Filtres origine et fourchette de prix combinés"""
+        response = client.get("/products/", params={"origine": "Kenya", "prix_max": 15})
+        assert response.status_code == 200
+        assert [p["nom"] for p in response.json()] == ["Café Kenya"]
+
+    def test_filter_en_stock(self, client, catalogue):
+        """en_stock=true exclut les produits en rupture"""
+        response = client.get("/products/", params={"en_stock": True})
+        assert "Café Brasil" not in [p["nom"] for p in response.json()]
+        assert len(response.json()) == 3
+
+    def test_sort_prix_desc(self, client, catalogue):
+        """Tri par prix décroissant"""
+        response = client.get("/products/", params={"sort": "prix", "order": "desc"})
+        assert [p["prix"] for p in response.json()] == [16.50, 14.00, 10.00, 8.99]
+
+    def test_cursor_pages(self, client, catalogue):
+        """Le curseur parcourt toutes les pages dans l'ordre du tri"""
+        prix = []
+        params = {"sort": "prix", "limit": 3}
+        response = client.get("/products/", params=params)
+        prix += [p["prix"] for p in response.json()]
+        response = client.get("/products/", params={**params, "cursor": response.headers["X-Next-Cursor"]})
+        prix += [p["prix"] for p in response.json()]
+        assert prix == [8.99, 10.00, 14.00, 16.50]
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_cursor_date_creation(self, client, catalogue):
+        """Curseur sur date_creation"""
+        response = client.get("/products/", params={"sort": "date_creation", "limit": 2})
+        response = client.get("/products/", params={
+            "sort": "date_creation", "limit": 2, "cursor": response.headers["X-Next-Cursor"]
+        })
+        assert [p["nom"] for p in response.json()] == ["Café Colombie", "Café Ethiopie"]
+
+    def test_invalid_cursor(self, client):
+        """Curseur illisible - retourne 400"""
+        response = client.get("/products/", params={"cursor": "pas-un-curseur"})
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize("sort, values", [
+        ("nom", [1]),
+        ("nom", ["nom", "asc", 1, 2]),
+        ("prix", ["prix", "asc", {"a": 1}, 2]),
+        ("prix", ["prix", "asc", 10.0, "2"]),
+        ("date_creation", ["date_creation", "asc", 10.0, 2]),
+    ])
+    def test_cursor_wrong_values(self, client, catalogue, sort, values):
+        """Curseur lisible mais valeurs du mauvais nombre ou du mauvais type - 400, pas 500"""
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+        response = client.get("/products/", params={"sort": sort, "cursor": cursor})
+        assert response.status_code == 400
+
+    def test_cursor_other_sort(self, client, catalogue):
+        """Curseur obtenu avec un autre tri ou un autre ordre - 400"""
+        cursor = client.get("/products/", params={"sort": "prix", "limit": 2}).headers["X-Next-Cursor"]
+        for params in ({"sort": "nom"}, {"sort": "date_creation"}, {"sort": "prix", "order": "desc"}):
+            response = client.get("/products/", params={**params, "cursor": cursor})
+            assert response.status_code == 400
+
+
+class TestCatalogSnapshot:
+    """Tests pour GET /products/?actif=true (catalogue servi depuis la mémoire)"""
+
+    def test_catalog_lists_active_products(self, client, sample_produit):
+        """Seuls les produits actifs sont dans le catalogue"""
+        actif_id = client.post("/products/", json=sample_produit).json()["id"]
+        inactif_id = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99}).json()["id"]
+        client.put(f"/products/{inactif_id}", json={"actif": False})
+
+        response = client.get("/products/", params={"actif": True})
+        assert response.status_code == 200
+        assert [p["id"] for p in response.json()] == [actif_id]
+
+    def test_catalog_follows_updates(self, client, sample_produit):
+        """Le catalogue reflète les créations, modifications et suppressions"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        assert client.get("/products/", params={"actif": True}).json()[0]["prix"] == 12.50
+
+        client.put(f"/products/{produit_id}", json={"prix": 15.00})
+        assert client.get("/products/", params={"actif": True}).json()[0]["prix"] == 15.00
+
+        client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99})
+        client.delete(f"/products/{produit_id}")
+        data = client.get("/products/", params={"actif": True}).json()
+        assert [p["nom"] for p in data] == ["Café Brasil"]
+
+    def test_catalog_reactivated_product_keeps_order(self, client, sample_produit):
+        """Un produit réactivé reprend sa place (tri par id)"""
+        premier_id = client.post("/products/", json=sample_produit).json()["id"]
+        client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99})
+        client.put(f"/products/{premier_id}", json={"actif": False})
+        client.get("/products/", params={"actif": True})
+        client.put(f"/products/{premier_id}", json={"actif": True})
+
+        data = client.get("/products/", params={"actif": True}).json()
+        assert data[0]["id"] == premier_id
+        assert len(data) == 2
+
+    def test_catalog_pagination_and_etag(self, client, sample_produit):
+        """skip/limit s'appliquent au catalogue, qui répond 304 tant qu'il n'a pas changé"""
+        client.post("/products/", json=sample_produit)
+        client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99})
+        response = client.get("/products/", params={"actif": True, "skip": 1, "limit": 1})
+        assert [p["nom"] for p in response.json()] == ["Café Brasil"]
+
+        etag = response.headers["ETag"]
+        response = client.get("/products/", params={"actif": True, "skip": 1, "limit": 1},
+                              headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+
+    def test_catalog_etag_follows_content(self, client, sample_produit, catalog_snapshot):
+        """L'ETag dépend du contenu servi, pas du compteur de version propre au processus"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.get("/products/", params={"actif": True})
+        etag, version = response.headers["ETag"], catalog_snapshot.version
+
+        # Catalogue rechargé (redémarrage, autre worker) : même contenu, même ETag
+        catalog_snapshot.invalidate()
+        response = client.get("/products/", params={"actif": True}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+        # Même numéro de version qu'au premier appel, mais contenu différent : pas de 304
+        client.put(f"/products/{produit_id}", json={"prix": 15.00})
+        catalog_snapshot.version = version
+        response = client.get("/products/", params={"actif": True}, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
 class TestReadProduct:
     """Tests pour GET /products/{id}"""
 
@@ -114,6 +269,33 @@ class TestReadProduct:
         assert "non trouve" in response.json()["detail"]
 
 
+class TestConditionalGetProduct:
+    """Tests pour ETag / If-None-Match sur GET /products"""
+
+    def test_get_product_etag_304(self, client, sample_produit):
+        """Même ETag renvoyé - retourne 304 sans corps"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        etag = client.get(f"/products/{produit_id}").headers["ETag"]
+
+        response = client.get(f"/products/{produit_id}", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_get_product_etag_mismatch(self, client, sample_produit):
+        """ETag différent - retourne 200 avec le produit"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.get(f"/products/{produit_id}", headers={"If-None-Match": 'W/"autre"'})
+        assert response.status_code == 200
+        assert response.json()["id"] == produit_id
+
+    def test_get_products_list_etag_304(self, client, sample_produit):
+        """La liste répond 304 tant qu'elle n'a pas changé"""
+        client.post("/products/", json=sample_produit)
+        etag = client.get("/products/").headers["ETag"]
+        response = client.get("/products/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+
 class TestUpdateProduct:
     """Tests pour PUT /products/{id}"""
 
@@ -178,6 +360,313 @@ class TestUpdateProduct:
         assert "non trouve" in response.json()["detail"]
 
 
+class TestExportProducts:
+    """Tests pour GET /products/export"""
+
+    def test_export_ndjson(self, client, sample_produit):
+        """NDJSON - un produit par ligne, dans l'ordre des ids"""
+        for i in range(3):
+            client.post("/products/", json={**sample_produit, "nom": f"Café {i}"})
+
+        response = client.get("/products/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line)["nom"] for line in response.text.splitlines()] == ["Café 0", "Café 1", "Café 2"]
+
+    def test_export_csv_filter_actif(self, client, sample_produit):
+        """CSV - en-tête puis une ligne par produit, filtre actif"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={**sample_produit, "nom": "Café Brasil"}).json()["id"]
+        client.put(f"/products/{p2}", json={"actif": False})
+
+        response = client.get("/products/export", params={"format": "csv", "actif": True})
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [(int(r["id"]), r["nom"], float(r["prix"])) for r in rows] == [(p1, "Café Burkina", 12.5)]
+
+
+class TestSearchProducts:
+    """Tests pour GET /products/search"""
+
+    def test_search_name_and_description(self, client, sample_produit):
+        """Recherche dans le nom et la description - les correspondances sur le nom d'abord"""
+        client.post("/products/", json={"nom": "Café Éthiopie", "prix": 9, "description": "Notes de burkina"})
+        burkina = client.post("/products/", json=sample_produit).json()["id"]
+        client.post("/products/", json={"nom": "Café Brasil", "prix": 8})
+
+        response = client.get("/products/search", params={"q": "burkina"})
+        assert response.status_code == 200
+        noms = [p["nom"] for p in response.json()]
+        assert noms == ["Café Burkina", "Café Éthiopie"]
+        assert response.json()[0]["id"] == burkina
+
+    def test_search_filter_actif(self, client, sample_produit):
+        """Filtre actif - les produits désactivés sont exclus"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        client.put(f"/products/{produit_id}", json={"actif": False})
+        assert client.get("/products/search", params={"q": "burkina", "actif": True}).json() == []
+
+    def test_search_query_too_short(self, client):
+        """Requête trop courte - retourne 422"""
+        assert client.get("/products/search", params={"q": "b"}).status_code == 422
+
+
+class TestSuggestProducts:
+    """Tests pour GET /products/suggest"""
+
+    def test_suggest_word_prefix(self, client, sample_produit):
+        """Un préfixe de n'importe quel mot du nom, sans tenir compte des accents"""
+        client.post("/products/", json=sample_produit)
+        client.post("/products/", json={"nom": "Café Brasil", "prix": 8})
+        client.post("/products/", json={"nom": "Thé Vert", "prix": 5})
+
+        assert [p["nom"] for p in client.get("/products/suggest", params={"prefix": "bur"}).json()] == ["Café Burkina"]
+        assert [p["nom"] for p in client.get("/products/suggest", params={"prefix": "CAFE"}).json()] == [
+            "Café Brasil", "Café Burkina"
+        ]
+        assert client.get("/products/suggest", params={"prefix": "café b", "limit": 1}).json() == [
+            {"id": 2, "nom": "Café Brasil"}
+        ]
+
+    def test_suggest_follows_updates(self, client, sample_produit):
+        """Renommage et désactivation sont pris en compte immédiatement"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        assert client.get("/products/suggest", params={"prefix": "bur"}).json() != []
+
+        client.put(f"/products/{produit_id}", json={"nom": "Café Kenya"})
+        assert client.get("/products/suggest", params={"prefix": "bur"}).json() == []
+        assert client.get("/products/suggest", params={"prefix": "ken"}).json() == [{"id": produit_id, "nom": "Café Kenya"}]
+
+        client.delete(f"/products/{produit_id}")
+        assert client.get("/products/suggest", params={"prefix": "ken"}).json() == []
+
+    def test_suggest_index_kept_on_stock_change(self, client, sample_produit, catalog_snapshot):
+        """Réservation de stock ou changement de prix : l'index des noms n'est pas reconstruit"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        client.get("/products/suggest", params={"prefix": "bur"})
+        version = catalog_snapshot.noms_version
+
+        client.post("/products/stock/reserve", json={"lignes": [{"produit_id": produit_id, "quantite": 1}]})
+        client.put(f"/products/{produit_id}", json={"prix": 13.0})
+        assert client.get("/products/suggest", params={"prefix": "bur"}).json() == [{"id": produit_id, "nom": "Café Burkina"}]
+        assert catalog_snapshot.noms_version == version
+
+
+class TestBulkUpdateProducts:
+    """Tests pour PATCH /products/bulk"""
+
+    def test_bulk_update(self, client, sample_produit):
+        """Mise à jour en masse - seuls les champs fournis changent, produit par produit"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 5}).json()["id"]
+
+        response = client.patch("/products/bulk", json={"produits": [
+            {"id": p1, "prix": 13.0},
+            {"id": p2, "prix": 9.5, "stock": 40},
+            {"id": p1, "stock": 70}
+        ]})
+        assert response.status_code == 200
+        assert response.json() == {"mis_a_jour": 2, "inconnus": []}
+
+        produit1 = client.get(f"/products/{p1}").json()
+        assert (produit1["prix"], produit1["stock"], produit1["nom"]) == (13.0, 70, sample_produit["nom"])
+        produit2 = client.get(f"/products/{p2}").json()
+        assert (produit2["prix"], produit2["stock"]) == (9.5, 40)
+
+    def test_bulk_update_unknown_products(self, client, sample_produit):
+        """Produits inexistants - ignorés et renvoyés dans 'inconnus'"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.patch("/products/bulk", json={"produits": [
+            {"id": p1, "stock": 3},
+            {"id": 99999, "stock": 3}
+        ]})
+        assert response.json() == {"mis_a_jour": 1, "inconnus": [99999]}
+        assert client.get(f"/products/{p1}").json()["stock"] == 3
+
+    def test_bulk_update_invalid_value(self, client, sample_produit):
+        """Une valeur invalide - retourne 422 et rien n'est modifié"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.patch("/products/bulk", json={"produits": [
+            {"id": p1, "stock": 3},
+            {"id": p1, "prix": -1}
+        ]})
+        assert response.status_code == 422
+        assert client.get(f"/products/{p1}").json()["stock"] == 100
+
+    def test_bulk_update_refreshes_catalog(self, client, sample_produit):
+        """Le catalogue en mémoire reflète la mise à jour (désactivation comprise)"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 5}).json()["id"]
+        client.get("/products/", params={"actif": True})
+
+        client.patch("/products/bulk", json={"produits": [
+            {"id": p1, "prix": 11.0},
+            {"id": p2, "actif": False}
+        ]})
+        catalogue = client.get("/products/", params={"actif": True}).json()
+        assert [(p["id"], p["prix"]) for p in catalogue] == [(p1, 11.0)]
+
+
+class TestLowStockAlerts:
+    """Tests pour le balayage des alertes de stock bas (produit.stock_low)"""
+
+    @pytest.fixture
+    def digests(self, stock_alerts, monkeypatch):
+        sent = []
+
+        def fake_publish(produits):
+            sent.append(produits)
+            return True
+        monkeypatch.setattr(stock_alerts.rabbitmq, "publish_produits_stock_low", fake_publish)
+        return sent
+
+    def test_single_digest_for_all_low_products(self, client, db_session, stock_alerts, digests):
+        """Un seul message pour tous les produits sous leur seuil, seuil propre à chaque produit"""
+        bas = client.post("/products/", json={"nom": "Café Bas", "prix": 5, "stock": 3}).json()["id"]
+        seuil = client.post("/products/", json={"nom": "Café Seuil", "prix": 5, "stock": 50, "seuil_alerte": 60}).json()["id"]
+        client.post("/products/", json={"nom": "Café Plein", "prix": 5, "stock": 50})
+
+        assert stock_alerts.sweep_low_stock(db_session) == 2
+        assert len(digests) == 1
+        assert [(p["produit_id"], p["seuil_alerte"]) for p in digests[0]] == [(bas, 10), (seuil, 60)]
+
+    def test_alert_sent_once_per_crossing(self, client, db_session, stock_alerts, digests):
+        """Pas de nouvelle alerte tant que le stock ne remonte pas au-dessus du seuil"""
+        produit_id = client.post("/products/", json={"nom": "Café Bas", "prix": 5, "stock": 3}).json()["id"]
+        stock_alerts.sweep_low_stock(db_session)
+
+        client.put(f"/products/{produit_id}", json={"description": "Nouvelle description"})
+        assert stock_alerts.sweep_low_stock(db_session) == 0
+
+        client.put(f"/products/{produit_id}", json={"stock": 20})
+        assert stock_alerts.sweep_low_stock(db_session) == 0
+        client.put(f"/products/{produit_id}", json={"stock": 2})
+        assert stock_alerts.sweep_low_stock(db_session) == 1
+        assert len(digests) == 2
+
+    def test_publish_failure_retried(self, client, db_session, stock_alerts, monkeypatch):
+        """RabbitMQ indisponible - l'alerte est renvoyée au balayage suivant"""
+        client.post("/products/", json={"nom": "Café Bas", "prix": 5, "stock": 3})
+        monkeypatch.setattr(stock_alerts.rabbitmq, "publish_produits_stock_low", lambda produits: False)
+        assert stock_alerts.sweep_low_stock(db_session) == 0
+        monkeypatch.setattr(stock_alerts.rabbitmq, "publish_produits_stock_low", lambda produits: True)
+        assert stock_alerts.sweep_low_stock(db_session) == 1
+
+
+class TestQuoteCart:
+    """Tests pour POST /products/quote"""
+
+    def test_quote_prices_and_total(self, client, sample_produit):
+        """Panier disponible - prix actuels, totaux par ligne et total du panier"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 5}).json()["id"]
+
+        response = client.post("/products/quote", json={"lignes": [
+            {"produit_id": p1, "quantite": 2},
+            {"produit_id": p2, "quantite": 3}
+        ]})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["disponible"] is True
+        assert [(l["prix_unitaire"], l["total_ligne"]) for l in data["lignes"]] == [(12.5, 25.0), (8.99, 26.97)]
+        assert data["total"] == 51.97
+
+    def test_quote_unavailable_lines(self, client, sample_produit):
+        """Stock insuffisant (toutes lignes confondues), produit inactif ou inconnu - ligne indisponible"""
+        p1 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 5}).json()["id"]
+        p2 = client.post("/products/", json=sample_produit).json()["id"]
+        client.put(f"/products/{p2}", json={"actif": False})
+
+        data = client.post("/products/quote", json={"lignes": [
+            {"produit_id": p1, "quantite": 3},
+            {"produit_id": p1, "quantite": 3},
+            {"produit_id": p2, "quantite": 1},
+            {"produit_id": 99999, "quantite": 1}
+        ]}).json()
+        assert data["disponible"] is False
+        assert [l["disponible"] for l in data["lignes"]] == [False, False, False, False]
+        assert data["lignes"][3]["prix_unitaire"] is None
+        assert data["total"] == 0
+
+
+class TestStockReservation:
+    """Tests pour POST /products/stock/reserve et /products/stock/release"""
+
+    def test_reserve_decrements_all(self, client, sample_produit):
+        """Réservation réussie - tous les stocks sont décrémentés"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 5}).json()["id"]
+
+        response = client.post("/products/stock/reserve", json={"lignes": [
+            {"produit_id": p1, "quantite": 10},
+            {"produit_id": p2, "quantite": 2},
+            {"produit_id": p2, "quantite": 1}
+        ]})
+        assert response.status_code == 200
+        stocks = {p["produit_id"]: p["stock"] for p in response.json()["produits"]}
+        assert stocks == {p1: 90, p2: 2}
+        assert client.get(f"/products/{p2}").json()["stock"] == 2
+
+    def test_reserve_all_or_nothing(self, client, sample_produit):
+        """Un seul produit en stock insuffisant - retourne 409 et rien n'est réservé"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        p2 = client.post("/products/", json={"nom": "Café Brasil", "prix": 8.99, "stock": 1}).json()["id"]
+
+        response = client.post("/products/stock/reserve", json={"lignes": [
+            {"produit_id": p1, "quantite": 10},
+            {"produit_id": p2, "quantite": 2}
+        ]})
+        assert response.status_code == 409
+        assert response.json()["detail"]["produits"] == [p2]
+        assert client.get(f"/products/{p1}").json()["stock"] == 100
+
+    def test_reserve_inactive_or_unknown(self, client, sample_produit):
+        """Produit inactif ou inexistant - retourne 409"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        client.put(f"/products/{p1}", json={"actif": False})
+        response = client.post("/products/stock/reserve", json={"lignes": [
+            {"produit_id": p1, "quantite": 1},
+            {"produit_id": 99999, "quantite": 1}
+        ]})
+        assert response.status_code == 409
+        assert response.json()["detail"]["produits"] == [p1, 99999]
+
+    def test_reserve_updates_catalog(self, client, sample_produit):
+        """Le catalogue en mémoire reflète le nouveau stock"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        client.get("/products/", params={"actif": True})
+        client.post("/products/stock/reserve", json={"lignes": [{"produit_id": p1, "quantite": 4}]})
+        assert client.get("/products/", params={"actif": True}).json()[0]["stock"] == 96
+
+    def test_release(self, client, sample_produit):
+        """Libération - le stock est réincrémenté, les produits inconnus sont signalés"""
+        p1 = client.post("/products/", json=sample_produit).json()["id"]
+        client.post("/products/stock/reserve", json={"lignes": [{"produit_id": p1, "quantite": 30}]})
+
+        response = client.post("/products/stock/release", json={"lignes": [
+            {"produit_id": p1, "quantite": 30},
+            {"produit_id": 99999, "quantite": 1}
+        ]})
+        assert response.status_code == 200
+        assert response.json()["produits"] == [{"produit_id": p1, "stock": 100}]
+        assert response.json()["inconnus"] == [99999]
+
+    def test_reserve_release_sans_rechargement(self, client, sample_produit, queries):
+        """Réservation puis libération de 3 produits - un UPDATE ... RETURNING chacune, aucun SELECT ensuite"""
+        ids = [client.post("/products/", json={**sample_produit, "nom": f"Café {i}"}).json()["id"] for i in range(3)]
+        lignes = {"lignes": [{"produit_id": produit_id, "quantite": 1} for produit_id in ids]}
+        queries.clear()
+
+        assert client.post("/products/stock/reserve", json=lignes).status_code == 200
+        assert client.post("/products/stock/release", json=lignes).status_code == 200
+        statements = [statement.lstrip().split()[0].upper() for statement in queries]
+        assert statements == ["UPDATE", "UPDATE"]
+
+    def test_reserve_invalid_quantite(self, client, sample_produit):
+        """Quantité nulle - retourne 422"""
+        response = client.post("/products/stock/reserve", json={"lignes": [{"produit_id": 1, "quantite": 0}]})
+        assert response.status_code == 422
+
+
 class TestDeleteProduct:
     """Tests pour DELETE /products/{id}"""
 
@@ -204,3 +693,280 @@ class TestDeleteProduct:
         response = client.delete("/products/99999")
         assert response.status_code == 404
         assert "non trouve" in response.json()["detail"]
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * 64
+
+
+class TestUploadProductImage:
+    """Tests pour POST /products/{id}/image"""
+
+    def test_upload_image_success(self, client, sample_produit):
+        """Upload réussi - l'image est nommée d'après l'empreinte de son contenu"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.post(f"/products/{produit_id}/image",
+                               files={"file": ("photo.png", PNG_BYTES, "image/png")})
+        assert response.status_code == 200
+        assert response.json()["image_url"] == f"/uploads/{hashlib.sha256(PNG_BYTES).hexdigest()[:32]}.png"
+
+        image = client.get(response.json()["image_url"])
+        assert image.status_code == 200
+        assert image.content == PNG_BYTES
+
+    def test_upload_image_new_content_new_url(self, client, sample_produit):
+        """Un nouvel upload change l'URL de l'image (l'ancienne URL reste cacheable indéfiniment)"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        first = client.post(f"/products/{produit_id}/image",
+                            files={"file": ("photo.png", PNG_BYTES, "image/png")}).json()["image_url"]
+        response = client.post(f"/products/{produit_id}/image",
+                               files={"file": ("photo.jpeg", JPEG_BYTES, "image/jpeg")})
+        assert response.status_code == 200
+        assert response.json()["image_url"] != first
+        assert response.json()["image_url"].endswith(".jpg")
+
+    def test_upload_same_image_deduplicated(self, client, sample_produit):
+        """Le même contenu uploadé pour deux produits n'est stocké qu'une fois"""
+        urls = set()
+        for _ in range(2):
+            produit_id = client.post("/products/", json=sample_produit).json()["id"]
+            urls.add(client.post(f"/products/{produit_id}/image",
+                                 files={"file": ("photo.png", PNG_BYTES, "image/png")}).json()["image_url"])
+        assert len(urls) == 1
+
+    def test_upload_image_bad_extension(self, client, sample_produit):
+        """Extension non acceptée - retourne 400"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.post(f"/products/{produit_id}/image",
+                               files={"file": ("photo.gif", b"GIF89a", "image/gif")})
+        assert response.status_code == 400
+
+    def test_upload_image_content_mismatch(self, client, sample_produit):
+        """Contenu qui ne correspond pas à l'extension (magic bytes) - retourne 400"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.post(f"/products/{produit_id}/image",
+                               files={"file": ("photo.png", b"<?php echo 1; ?>", "image/png")})
+        assert response.status_code == 400
+        assert client.get(f"/products/{produit_id}").json()["image_url"] is None
+
+    def test_upload_image_too_large(self, client, sample_produit):
+        """Image plus grande que MAX_IMAGE_SIZE - retourne 413"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        big = PNG_BYTES + b"\x00" * (300 * 1024)
+        response = client.post(f"/products/{produit_id}/image",
+                               files={"file": ("photo.png", big, "image/png")})
+        assert response.status_code == 413
+
+    def test_upload_image_content_length_too_large(self, client, sample_produit):
+        """Content-Length au-delà de la limite - 413 sans lire le formulaire"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        response = client.post(f"/products/{produit_id}/image", content=b"\x00" * (400 * 1024),
+                               headers={"Content-Type": "multipart/form-data; boundary=x"})
+        assert response.status_code == 413
+        assert response.json()["detail"].startswith("Image trop volumineuse")
+
+    def test_upload_image_streamed_too_large(self, client, sample_produit):
+        """Envoi par morceaux sans Content-Length - 413, aucune image enregistrée"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+
+        def corps():
+            yield (b'--x\r\nContent-Disposition: form-data; name="file"; filename="photo.png"\r\n'
+                   b"Content-Type: image/png\r\n\r\n" + PNG_BYTES)
+            for _ in range(40):
+                yield b"\x00" * (16 * 1024)
+
+        response = client.post(f"/products/{produit_id}/image", content=corps(),
+                               headers={"Content-Type": "multipart/form-data; boundary=x"})
+        assert response.status_code == 413
+        assert client.get(f"/products/{produit_id}").json()["image_url"] is None
+
+    def test_upload_limit_stops_reading(self, upload_limit):
+        """Limite dépassée en cours de réception - la lecture s'arrête, seule la réponse 413 est envoyée"""
+        recus, envoyes = [], []
+
+        async def receive():
+            recus.append(1)
+            return {"type": "http.request", "body": b"\x00" * 1024, "more_body": True}
+
+        async def send(message):
+            envoyes.append(message)
+
+        async def application(scope, receive, send):
+            # Lit le corps jusqu'a la deconnexion puis tente de repondre, comme la lecture du formulaire
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            await send({"type": "http.response.start", "status": 400, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = upload_limit.UploadSizeLimitMiddleware(application, max_body_size=10 * 1024)
+        scope = {"type": "http", "method": "POST", "path": "/products/1/image", "headers": []}
+        asyncio.run(middleware(scope, receive, send))
+        assert len(recus) == 11
+        assert [m["status"] for m in envoyes if m["type"] == "http.response.start"] == [413]
+
+    def test_upload_image_product_not_found(self, client):
+        """Produit inexistant - retourne 404"""
+        response = client.post("/products/99999/image", files={"file": ("photo.png", PNG_BYTES, "image/png")})
+        assert response.status_code == 404
+
+
+class TestServeUploads:
+    """Tests pour GET /uploads/... (cache HTTP et requêtes Range)"""
+
+    @pytest.fixture
+    def image_url(self, client, sample_produit):
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        return client.post(f"/products/{produit_id}/image",
+                           files={"file": ("photo.png", PNG_BYTES, "image/png")}).json()["image_url"]
+
+    def test_immutable_cache_headers(self, client, image_url):
+        """Image adressée par contenu : cache immuable et ETag fort égal à l'empreinte"""
+        response = client.get(image_url)
+        assert "immutable" in response.headers["cache-control"]
+        assert response.headers["etag"] == f'"{hashlib.sha256(PNG_BYTES).hexdigest()[:32]}"'
+        assert response.headers["accept-ranges"] == "bytes"
+
+    def test_if_none_match_returns_304(self, client, image_url):
+        """If-None-Match avec l'ETag courant - retourne 304 sans corps"""
+        etag = client.get(image_url).headers["etag"]
+        response = client.get(image_url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+    def test_range_request(self, client, image_url):
+        """Range sur une partie du fichier - retourne 206 avec uniquement ces octets"""
+        response = client.get(image_url, headers={"Range": "bytes=2-9"})
+        assert response.status_code == 206
+        assert response.content == PNG_BYTES[2:10]
+        assert response.headers["content-range"] == f"bytes 2-9/{len(PNG_BYTES)}"
+
+    def test_suffix_range_request(self, client, image_url):
+        """Range "bytes=-N" - retourne les N derniers octets"""
+        response = client.get(image_url, headers={"Range": "bytes=-4"})
+        assert response.status_code == 206
+        assert response.content == PNG_BYTES[-4:]
+
+    def test_unsatisfiable_range(self, client, image_url):
+        """Range au-delà de la fin du fichier - retourne 416"""
+        response = client.get(image_url, headers={"Range": f"bytes={len(PNG_BYTES)}-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(PNG_BYTES)}"
+
+    def test_if_range_mismatch_returns_full_file(self, client, image_url):
+        """If-Range avec un autre ETag - le fichier entier est renvoyé"""
+        response = client.get(image_url, headers={"Range": "bytes=0-3", "If-Range": '"autre"'})
+        assert response.status_code == 200
+        assert response.content == PNG_BYTES
+
+
+class TestUploadGarbageCollection:
+    """Tests pour le ramasse-miettes des images orphelines"""
+
+    def test_collect_orphans(self, images, tmp_path, monkeypatch):
+        """Seuls les fichiers non référencés et plus vieux que le délai de grâce sont supprimés"""
+        monkeypatch.setattr(images, "UPLOAD_DIR", str(tmp_path))
+        (tmp_path / "derivees").mkdir()
+        for name in ("utilisee.png", "orpheline.png", "derivees/utilisee_card.webp", "derivees/orpheline_card.webp"):
+            (tmp_path / name).write_bytes(PNG_BYTES)
+
+        referenced = {"/uploads/utilisee.png", "/uploads/derivees/utilisee_card.webp"}
+        assert images.collect_orphans(referenced, grace=3600) == 0
+        assert images.collect_orphans(referenced, grace=-1) == 2
+        assert sorted(p.name for p in tmp_path.rglob("*") if p.is_file()) == ["utilisee.png", "utilisee_card.webp"]
+
+
+def make_png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (120, 80, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class TestImageVariants:
+    """Tests pour la génération des déclinaisons WebP (miniatures)"""
+
+    def test_generate_variants(self, thumbnails, tmp_path, monkeypatch):
+        """Les trois déclinaisons sont générées en WebP, à la bonne taille"""
+        monkeypatch.setattr(thumbnails, "DERIVED_DIR", str(tmp_path / "derivees"))
+        source = tmp_path / "source.png"
+        source.write_bytes(make_png(2000, 1000))
+        digest = hashlib.sha256(source.read_bytes()).hexdigest()
+
+        urls = thumbnails.generate_variants(str(source), digest)
+        assert set(urls) == {"thumbnail", "card", "detail"}
+        for name, size in thumbnails.VARIANTS.items():
+            assert urls[name] == f"/uploads/derivees/{digest[:32]}_{name}.webp"
+            with Image.open(tmp_path / "derivees" / f"{digest[:32]}_{name}.webp") as variant:
+                assert variant.format == "WEBP"
+                assert variant.size == (size, size // 2)
+
+    def test_generate_variants_source_replaced(self, thumbnails, tmp_path, monkeypatch):
+        """Source modifiée depuis l'upload (empreinte différente) - rien n'est généré"""
+        monkeypatch.setattr(thumbnails, "DERIVED_DIR", str(tmp_path / "derivees"))
+        source = tmp_path / "source.png"
+        source.write_bytes(make_png(10, 10))
+        with pytest.raises(ValueError):
+            thumbnails.generate_variants(str(source), "0" * 64)
+
+    def test_apply_variants(self, thumbnails, client, db_session, sample_produit, monkeypatch):
+        """Les URLs sont exposées dans ProduitResponse, sauf si l'image a changé entre-temps"""
+        monkeypatch.setattr(thumbnails, "SessionLocal", sessionmaker(bind=db_session.get_bind()))
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        image_url = client.post(f"/products/{produit_id}/image",
+                                files={"file": ("photo.png", make_png(20, 20), "image/png")}).json()["image_url"]
+        variantes = {"thumbnail": "/uploads/derivees/abc_thumbnail.webp"}
+
+        thumbnails.apply_variants(produit_id, "/uploads/autre.png", variantes)
+        db_session.expire_all()
+        assert client.get(f"/products/{produit_id}").json()["image_variantes"] is None
+
+        thumbnails.apply_variants(produit_id, image_url, variantes)
+        db_session.expire_all()
+        assert client.get(f"/products/{produit_id}").json()["image_variantes"] == variantes
+
+    def test_upload_schedules_variants(self, client, sample_produit, scheduled_variants, images):
+        """L'upload demande la génération des déclinaisons de la nouvelle image, sans l'attendre"""
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        image_url = client.post(f"/products/{produit_id}/image",
+                                files={"file": ("photo.png", PNG_BYTES, "image/png")}).json()["image_url"]
+        digest = hashlib.sha256(PNG_BYTES).hexdigest()
+        filename = image_url.rsplit("/", 1)[-1]
+        assert scheduled_variants == [(produit_id, os.path.join(images.UPLOAD_DIR, filename), digest, image_url)]
+
+    def test_generate_then_apply(self, thumbnails, client, db_session, sample_produit, scheduled_variants,
+                                 tmp_path, monkeypatch):
+        """Déclinaisons générées pour l'image uploadée puis enregistrées sur le produit"""
+        monkeypatch.setattr(thumbnails, "DERIVED_DIR", str(tmp_path / "derivees"))
+        monkeypatch.setattr(thumbnails, "SessionLocal", sessionmaker(bind=db_session.get_bind()))
+        produit_id = client.post("/products/", json=sample_produit).json()["id"]
+        client.post(f"/products/{produit_id}/image", files={"file": ("photo.png", make_png(600, 300), "image/png")})
+        [(scheduled_id, source_path, digest, image_url)] = scheduled_variants
+
+        thumbnails.apply_variants(scheduled_id, image_url, thumbnails.generate_variants(source_path, digest))
+        db_session.expire_all()
+        variantes = client.get(f"/products/{produit_id}").json()["image_variantes"]
+        assert set(variantes) == set(thumbnails.VARIANTS)
+
+
+class TestSchemaUpgrade:
+    """Tests de la mise a niveau d'une base creee avant les nouvelles colonnes"""
+
+    def test_upgrade_base_existante(self, migrations):
+        """Colonnes et index manquants ajoutes, lignes existantes conservees ; relancer ne change rien"""
+        engine = create_engine("sqlite://", poolclass=StaticPool)
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE produits (id INTEGER PRIMARY KEY, nom VARCHAR(200) NOT NULL, description TEXT, "
+                "prix FLOAT NOT NULL, stock INTEGER NOT NULL, origine VARCHAR(100), poids_kg FLOAT, "
+                "image_url VARCHAR(500), actif BOOLEAN, date_creation DATETIME, date_modification DATETIME)"
+            ))
+            conn.execute(text("INSERT INTO produits (nom, prix, stock, actif) VALUES ('Ancien', 9.5, 3, 1)"))
+
+        added = migrations.upgrade(engine)
+
+        assert set(added) == {"produits.image_variantes", "produits.seuil_alerte", "produits.alerte_stock_envoyee"}
+        indexes = {index["name"] for index in inspect(engine).get_indexes("produits")}
+        assert {"ix_produits_actif_prix", "ix_produits_vendables_prix", "ix_produits_stock_bas"} <= indexes
+        with engine.connect() as conn:
+            row = conn.execute(text("SELECT nom, seuil_alerte, alerte_stock_envoyee FROM produits")).one()
+        assert tuple(row) == ("Ancien", 10, 0)
+        assert migrations.upgrade(engine) == []
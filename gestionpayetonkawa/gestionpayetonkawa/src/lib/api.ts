@@ -83,11 +83,38 @@ export interface CommandeCreate {
 
 // --- CLIENTS ---
 
-export async function getClients(): Promise<Client[]> {
-    const response = await fetch(`${API_CLIENTS}/customers/`, {
+export interface ClientsPage {
+    clients: Client[];
+    nextCursor: string | null;
+    total: number | null;
+}
+
+// Pagination par curseur : passer le nextCursor de la page precedente
+export async function getClientsPage(cursor?: string, limit: number = 50): Promise<ClientsPage> {
+    const params = new URLSearchParams({ limit: String(limit), total: "estimate" });
+    if (cursor) params.set("cursor", cursor);
+    const response = await fetch(`${API_CLIENTS}/customers/?${params}`, {
         headers: HEADERS_GET
     });
-    return await response.json();
+    if (!response.ok) throw new Error("Erreur API Clients");
+    const total = response.headers.get("X-Total-Count");
+    return {
+        clients: await response.json(),
+        nextCursor: response.headers.get("X-Next-Cursor"),
+        total: total ? parseInt(total) : null
+    };
+}
+
+// Tous les clients (liste deroulante des commandes) : suit les curseurs jusqu'a la derniere page
+export async function getClients(): Promise<Client[]> {
+    const clients: Client[] = [];
+    let cursor: string | undefined;
+    do {
+        const page = await getClientsPage(cursor, 1000);
+        clients.push(...page.clients);
+        cursor = page.nextCursor ?? undefined;
+    } while (cursor);
+    return clients;
 }
 
 export async function getClient(id: number): Promise<Client> {
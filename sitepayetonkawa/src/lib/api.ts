@@ -46,6 +46,22 @@ export interface Produit {
     image_url?: string;
 }
 
+export interface DevisLigne {
+    produit_id: number;
+    quantite: number;
+    nom?: string;
+    prix_unitaire?: number;
+    stock?: number;
+    disponible: boolean;
+    total_ligne: number;
+}
+
+export interface Devis {
+    lignes: DevisLigne[];
+    total: number;
+    disponible: boolean;
+}
+
 export interface LigneCommande {
     id: number;
     produit_id: number;
@@ -91,6 +107,24 @@ export async function getClient(id: number): Promise<Client> {
     return response.json();
 }
 
+export async function getClientByEmail(email: string): Promise<Client | null> {
+    const response = await fetch(`${API_CLIENTS}/customers/by-email?email=${encodeURIComponent(email)}`, {
+        headers: HEADERS_GET
+    });
+    if (response.status === 404) return null;
+    if (!response.ok) throw new Error("Erreur API Clients");
+    return response.json();
+}
+
+export async function clientEmailExists(email: string): Promise<boolean> {
+    const response = await fetch(`${API_CLIENTS}/customers/by-email/exists?email=${encodeURIComponent(email)}`, {
+        headers: HEADERS_GET
+    });
+    if (!response.ok) throw new Error("Erreur API Clients");
+    const data = await response.json();
+    return data.exists;
+}
+
 export async function createClient(data: ClientCreate): Promise<Client> {
     const response = await fetch(`${API_CLIENTS}/customers/`, {
         method: "POST",
@@ -104,7 +138,7 @@ export async function createClient(data: ClientCreate): Promise<Client> {
 // ============ PRODUITS ============
 
 export async function getProduits(): Promise<Produit[]> {
-    const response = await fetch(`${API_PRODUITS}/products/`, {
+    const response = await fetch(`${API_PRODUITS}/products/?actif=true`, {
         headers: HEADERS_GET
     });
     if (!response.ok) throw new Error("Erreur API Produits");
@@ -119,6 +153,17 @@ export async function getProduit(id: number): Promise<Produit> {
     return response.json();
 }
 
+// Prix et stock actuels de tout le panier en une seule requete
+export async function quoteCart(lignes: { produit_id: number; quantite: number }[]): Promise<Devis> {
+    const response = await fetch(`${API_PRODUITS}/products/quote`, {
+        method: "POST",
+        headers: HEADERS_JSON,
+        body: JSON.stringify({ lignes })
+    });
+    if (!response.ok) throw new Error("Erreur API Produits");
+    return response.json();
+}
+
 // ============ COMMANDES ============
 
 export async function getCommandes(): Promise<Commande[]> {
@@ -129,12 +174,24 @@ export async function getCommandes(): Promise<Commande[]> {
     return response.json();
 }
 
-export async function getCommandesByClient(clientId: number): Promise<Commande[]> {
-    const response = await fetch(`${API_COMMANDES}/orders/client/${clientId}`, {
+export interface CommandesPage {
+    commandes: Commande[];
+    nextCursor: string | null;
+}
+
+// Historique d'un client, des plus recentes aux plus anciennes, page par page :
+// passer le nextCursor de la page precedente (null quand il n'y a plus rien a charger)
+export async function getCommandesByClient(clientId: number, cursor?: string, limit: number = 20): Promise<CommandesPage> {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
+    const response = await fetch(`${API_COMMANDES}/orders/client/${clientId}?${params}`, {
         headers: HEADERS_GET
     });
     if (!response.ok) throw new Error("Erreur recuperation commandes");
-    return response.json();
+    return {
+        commandes: await response.json(),
+        nextCursor: response.headers.get("X-Next-Cursor")
+    };
 }
 
 export async function createCommande(data: CommandeCreate): Promise<Commande> {
@@ -3,7 +3,7 @@
  * Les donnees sont stockees dans localStorage.
  */
 
-import { getClients, createClient, type Client, type ClientCreate } from './api';
+import { getClientByEmail, clientEmailExists, createClient, type Client, type ClientCreate } from './api';
 
 const STORAGE_KEY = 'payetonkawa_user';
 
@@ -25,8 +25,7 @@ export function isLoggedIn(): boolean {
 }
 
 export async function login(email: string): Promise<Client> {
-    const clients = await getClients();
-    const client = clients.find(c => c.email.toLowerCase() === email.toLowerCase());
+    const client = await getClientByEmail(email);
 
     if (!client) {
         throw new Error("Aucun compte trouve avec cet email");
@@ -37,8 +36,7 @@ export async function login(email: string): Promise<Client> {
 }
 
 export async function register(data: ClientCreate): Promise<Client> {
-    const clients = await getClients();
-    const exists = clients.some(c => c.email.toLowerCase() === data.email.toLowerCase());
+    const exists = await clientEmailExists(data.email);
 
     if (exists) {
         throw new Error("Un compte existe deja avec cet email");